@@ -0,0 +1,12 @@
+import os
+import shutil
+import tempfile
+
+# Tests never touch the configured database: point the app at a scratch file
+# before app.database is imported (it builds the engine at import time)
+_db_dir = tempfile.mkdtemp(prefix="gitea-reporter-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_db_dir, ignore_errors=True)
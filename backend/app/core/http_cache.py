@@ -0,0 +1,77 @@
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Dict, Optional
+import httpx
+
+
+class CachedEntry:
+    __slots__ = ("etag", "last_modified", "content", "headers")
+
+    def __init__(self, etag: Optional[str], last_modified: Optional[str], content: bytes, headers: Dict[str, str]):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content = content
+        self.headers = headers
+
+    def to_response(self, request: httpx.Request) -> httpx.Response:
+        # Rebuild a 200 response so callers don't need to know it came from the cache
+        return httpx.Response(200, headers=self.headers, content=self.content, request=request)
+
+
+class ResponseCache:
+    """
+    Process-wide store of GET bodies together with their validators (ETag / Last-Modified).
+    Entries are keyed by token + URL + query so different credentials never share a body.
+    """
+    # Headers worth replaying on a 304 (pagination info lives in X-Total-Count / Link)
+    KEPT_HEADERS = ("content-type", "x-total-count", "link")
+
+    def __init__(self, max_entries: int = 5000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CachedEntry]" = OrderedDict()
+
+    @staticmethod
+    def make_key(token: str, url: str, params: Optional[Dict] = None) -> str:
+        token_hash = hashlib.sha256(token.encode("utf-8")).hexdigest()[:16]
+        query = "&".join(f"{k}={v}" for k, v in sorted((params or {}).items()))
+        return f"{token_hash}|{url}?{query}"
+
+    def lookup(self, key: str) -> Optional[CachedEntry]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def conditional_headers(self, entry: Optional[CachedEntry]) -> Dict[str, str]:
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def store(self, key: str, response: httpx.Response) -> bool:
+        etag = response.headers.get("etag")
+        last_modified = response.headers.get("last-modified")
+        if not etag and not last_modified:
+            # Nothing to revalidate with, keeping the body would only waste memory
+            self._entries.pop(key, None)
+            return False
+        headers = {k: response.headers[k] for k in self.KEPT_HEADERS if k in response.headers}
+        self._entries[key] = CachedEntry(etag, last_modified, response.content, headers)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return True
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+response_cache = ResponseCache(max_entries=int(os.getenv("GITEA_CACHE_MAX_ENTRIES", "5000")))
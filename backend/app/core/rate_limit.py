@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Statuses that mean "back off and try again later"
+THROTTLE_STATUSES = (429, 503)
+# Gateway errors that are usually transient
+RETRY_STATUSES = (502, 504)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After is either delta-seconds or an HTTP date."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class HostLimiter:
+    """
+    Adaptive concurrency window for one upstream host (AIMD).
+    The window grows while responses stay fast and halves on throttling,
+    gateway errors or network failures. A Retry-After blocks the whole host.
+    """
+    def __init__(
+        self,
+        host: str,
+        initial_limit: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 32,
+        target_latency: float = 2.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 30.0
+    ):
+        self.host = host
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self._cond: Optional[asyncio.Condition] = None
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def _acquire(self):
+        cond = self._condition()
+        async with cond:
+            while True:
+                delay = self.blocked_until - time.monotonic()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(cond.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.in_flight < int(self.limit):
+                    break
+                await cond.wait()
+            self.in_flight += 1
+
+    async def _release(self, latency: Optional[float], ok: Optional[bool]):
+        """Free a slot; ok=None leaves the window alone (the host told us nothing)."""
+        cond = self._condition()
+        async with cond:
+            self.in_flight -= 1
+            if ok is None:
+                pass
+            elif ok and latency is not None and latency <= self.target_latency:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            elif ok:
+                # Slow but successful: shrink gently
+                self.limit = max(self.min_limit, self.limit * 0.9)
+            else:
+                self.limit = max(self.min_limit, self.limit / 2)
+            cond.notify_all()
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter keeps retrying clients from synchronising
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    async def request(self, send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        attempt = 0
+        while True:
+            await self._acquire()
+            started = time.monotonic()
+            try:
+                response = await send()
+            except (httpx.TimeoutException, httpx.NetworkError) as e:
+                await self._release(None, ok=False)
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(f"{self.host}: {type(e).__name__}, retrying in {delay:.1f}s")
+            except BaseException as e:
+                # Cancelled mid-flight (fetch timeout, /cancel) or failed outright:
+                # the slot must still be freed, even if the caller is cancelled again
+                ok = None if isinstance(e, asyncio.CancelledError) else False
+                await asyncio.shield(self._release(None, ok=ok))
+                raise
+            else:
+                latency = time.monotonic() - started
+                if response.status_code in THROTTLE_STATUSES:
+                    retry_after = parse_retry_after(response.headers.get("retry-after"))
+                    if retry_after is not None:
+                        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+                    await self._release(latency, ok=False)
+                    if attempt >= self.max_retries:
+                        return response
+                    delay = retry_after if retry_after is not None else self._backoff(attempt)
+                elif response.status_code in RETRY_STATUSES:
+                    await self._release(latency, ok=False)
+                    if attempt >= self.max_retries:
+                        return response
+                    delay = self._backoff(attempt)
+                else:
+                    await self._release(latency, ok=True)
+                    return response
+                logger.warning(f"{self.host}: HTTP {response.status_code}, retrying in {delay:.1f}s")
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+class HostLimiterRegistry:
+    def __init__(self):
+        self._limiters: Dict[str, HostLimiter] = {}
+
+    def get(self, base_url: str) -> HostLimiter:
+        host = base_url.rstrip("/")
+        limiter = self._limiters.get(host)
+        if limiter is None:
+            limiter = HostLimiter(
+                host,
+                initial_limit=int(os.getenv("GITEA_INITIAL_CONCURRENCY", "8")),
+                max_limit=int(os.getenv("GITEA_MAX_CONCURRENCY", "32")),
+                target_latency=float(os.getenv("GITEA_TARGET_LATENCY", "2.0")),
+                max_retries=int(os.getenv("GITEA_MAX_RETRIES", "3"))
+            )
+            self._limiters[host] = limiter
+        return limiter
+
+    def clear(self):
+        self._limiters.clear()
+
+
+host_limiters = HostLimiterRegistry()
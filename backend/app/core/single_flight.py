@@ -0,0 +1,56 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller starts the
+    request in its own task, everyone arriving while it is in flight awaits the
+    same task. Cancelling a caller only detaches that caller; the work is
+    cancelled once nobody is waiting for it any more.
+    """
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self.stats = {"executed": 0, "coalesced": 0}
+
+    def _finished(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Avoid "exception was never retrieved" when every caller detached
+        task.cancelled() or task.exception()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Returns (result, shared); shared is True when another caller did the work."""
+        while True:
+            task = self._calls.get(key)
+            if task is not None and task.done():
+                # Finished, but its done callback hasn't run yet
+                task = None
+            shared = task is not None
+            if shared:
+                self.stats["coalesced"] += 1
+            else:
+                task = asyncio.ensure_future(fn())
+                task.add_done_callback(lambda t, key=key: self._finished(key, t))
+                self._calls[key] = task
+                self.stats["executed"] += 1
+
+            self._waiters[key] = self._waiters.get(key, 0) + 1
+            try:
+                return await asyncio.shield(task), shared
+            except asyncio.CancelledError:
+                if task.cancelled() and not asyncio.current_task().cancelling():
+                    # The work was cancelled under us, not this caller: start over
+                    continue
+                raise
+            finally:
+                self._waiters[key] -= 1
+                if not self._waiters[key]:
+                    del self._waiters[key]
+                    if not task.done():
+                        # Last one out: nobody wants the result any more
+                        task.cancel()
+
+
+gitea_requests = SingleFlight()
@@ -1,28 +1,91 @@
-from sqlalchemy import create_engine
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+import asyncio
+import functools
 import os
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./gitea_reporter.db")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False} if SQLALCHEMY_DATABASE_URL.startswith("sqlite") else {}
-)
+# Applied to every new SQLite connection. WAL lets API readers run alongside
+# the single writer instead of blocking on it; synchronous=NORMAL is durable
+# across application crashes in WAL mode (only a power loss can drop the last
+# commits); busy_timeout makes writers queue for the lock instead of failing
+# with "database is locked". SQLITE_JOURNAL_MODE=DELETE is the escape hatch
+# for filesystems without shared memory (e.g. network mounts).
+SQLITE_PRAGMAS = {
+    # Only takes effect while the file has no tables: new databases start in
+    # incremental mode, so log maintenance can hand freed pages back without
+    # a full VACUUM. Must come before journal_mode, which initialises the file.
+    "auto_vacuum": "INCREMENTAL",
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "15000")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-32000")),  # negative: KiB, per connection
+}
+
+def is_sqlite_file(url: str) -> bool:
+    return url.startswith("sqlite") and url not in ("sqlite://", "sqlite:///:memory:") and "mode=memory" not in url
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record=None):
+    cursor = dbapi_connection.cursor()
+    try:
+        # journal_mode is stored in the file, the rest are per connection
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+    finally:
+        cursor.close()
+
+def create_db_engine(url: str):
+    if not url.startswith("sqlite"):
+        return create_engine(url)
+    if not is_sqlite_file(url):
+        return create_engine(url, connect_args={"check_same_thread": False})
+    sqlite_engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        # Sync endpoints run on a 40-thread pool and DB work on db_executor:
+        # under WAL readers don't queue behind each other, so hold enough
+        # connections (each keeping its page cache and mmap warm) to serve them
+        pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "30")),
+        pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    )
+    event.listen(sqlite_engine, "connect", apply_sqlite_pragmas)
+    return sqlite_engine
+
+engine = create_db_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+# Blocking database work from async code runs here instead of on the event
+# loop. Kept separate from the default threadpool so slow HTTP-bound work
+# there can't starve commits; SQLite has a single writer anyway.
+db_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("DB_EXECUTOR_WORKERS", "4")),
+    thread_name_prefix="db"
+)
+
+async def run_in_db(fn, *args, **kwargs):
+    """Run a blocking DB call on the DB executor. A Session must only be used by one call at a time."""
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(db_executor, functools.partial(fn, *args, **kwargs))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        # The thread can't be interrupted: let the call finish before the
+        # cancellation propagates, so the caller never reuses (or closes)
+        # a session that is still busy in the executor.
+        await asyncio.wait([future])
+        raise
+
 def init_db():
-    # Create tables if they don't exist
-    Base.metadata.create_all(bind=engine)
-    
-    # Simple migration: Add last_run_at to report_tasks if missing (SQLite specific)
-    from sqlalchemy import inspect, text
-    inspector = inspect(engine)
-    columns = [c['name'] for c in inspector.get_columns('report_tasks')]
-    if 'last_run_at' not in columns:
-        with engine.begin() as conn:
-            conn.execute(text("ALTER TABLE report_tasks ADD COLUMN last_run_at DATETIME"))
+    """Create or migrate the schema; cheap when it is already current."""
+    from .migrations import migrate
+    migrate(engine)
 
 def get_db():
     db = SessionLocal()
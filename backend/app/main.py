@@ -1,15 +1,11 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from .database import get_db, init_db
+from .database import init_db, run_in_db
 from .services.scheduler import scheduler_service
-from .models import ReportTask
 from .routers import auth, gitea, notify, tasks, logs, ai
 
 import os
 
-# Initialize DB with migrations
-init_db()
-
 app = FastAPI(title="Gitea Daily Reporter API")
 
 # CORS
@@ -19,21 +15,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Startup
 @app.on_event("startup")
 async def startup_event():
+    # Migrate before anything touches the schema; a no-op once it is current
+    await run_in_db(init_db)
+    # Active tasks are loaded by whichever worker wins the scheduler lease
     scheduler_service.start()
-    # Reload active tasks into scheduler
-    db = next(get_db())
-    active_tasks = db.query(ReportTask).filter(ReportTask.is_active).all()
-    for task in active_tasks:
-        try:
-            scheduler_service.add_or_update_task(task.id, task.cron_expression)
-        except Exception as e:
-            print(f"Failed to load task {task.id}: {e}")
-    db.close()
 
 @app.on_event("shutdown")
 def shutdown_event():
@@ -0,0 +1,183 @@
+"""
+Versioned schema migrations.
+
+The applied version is recorded in schema_version. A worker whose database is
+already current reads that one row and moves on; otherwise it takes the
+migration lock, re-checks, and applies the missing steps in one transaction,
+so concurrent workers booting together migrate exactly once.
+
+A new, empty database is built straight from the models and stamped with the
+latest version. Steps therefore also run against tables create_all may have
+already brought up to date, and must be written to tolerate that (use the
+helpers below). To change the schema: update the models, then append a step.
+"""
+import logging
+import os
+import time
+from typing import Callable, List, Optional, Tuple
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+LOCK_TIMEOUT_SECONDS = float(os.getenv("MIGRATION_LOCK_TIMEOUT_SECONDS", "600"))
+# pg_advisory_xact_lock key, only used on PostgreSQL
+ADVISORY_LOCK_ID = 7_140_425
+
+
+def _columns(conn: Connection, table: str) -> List[str]:
+    return [c["name"] for c in inspect(conn).get_columns(table)]
+
+
+def _add_column(conn: Connection, table: str, name: str, ddl: str):
+    if name not in _columns(conn, table):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+
+def create_missing_tables(conn: Connection):
+    from .database import Base
+    from . import models  # noqa: F401  (registers the tables on Base)
+    Base.metadata.create_all(bind=conn)
+
+
+def add_last_run_at(conn: Connection):
+    _add_column(conn, "report_tasks", "last_run_at", "DATETIME")
+
+
+def add_run_checkpoints(conn: Connection):
+    _add_column(conn, "task_logs", "stage", "VARCHAR")
+    _add_column(conn, "task_logs", "report_markdown", "TEXT")
+    _add_column(conn, "task_logs", "ai_summary", "TEXT")
+    _add_column(conn, "task_logs", "attempts", "INTEGER DEFAULT 1")
+
+
+def move_raw_data_to_blobs(conn: Connection):
+    # Schema-wise task_log_blobs comes from step 1. Copying the payloads can take
+    # far longer than booting workers should wait on this lock, so the elected
+    # scheduler leader does it in batches (LogMaintenance.move_inline_raw).
+    pass
+
+
+def add_listing_indexes(conn: Connection):
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_report_tasks_user_id ON report_tasks (user_id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_task_logs_task_id_created_at ON task_logs (task_id, created_at, id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_task_logs_created_at ON task_logs (created_at, id)"))
+
+
+def pad_created_at(conn: Connection):
+    if conn.dialect.name == "sqlite":
+        # CURRENT_TIMESTAMP stores no fractional seconds while bound datetimes
+        # do; pad old rows so keyset comparisons on created_at are exact
+        conn.execute(text(
+            "UPDATE task_logs SET created_at = created_at || '.000000' "
+            "WHERE length(created_at) = 19"
+        ))
+
+
+def seed_schedule_changes(conn: Connection):
+    # Tasks created before the schedule changelog existed
+    conn.execute(text(
+        "INSERT INTO schedule_changes (task_id, action) "
+        "SELECT id, 'upsert' FROM report_tasks "
+        "WHERE id NOT IN (SELECT task_id FROM schedule_changes)"
+    ))
+
+
+# Append only: a step's number is recorded in every deployed database
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "create tables missing from unversioned databases", create_missing_tables),
+    (2, "report_tasks.last_run_at", add_last_run_at),
+    (3, "task_logs run checkpoint columns", add_run_checkpoints),
+    (4, "move inline raw_data into task_log_blobs (in the background)", move_raw_data_to_blobs),
+    (5, "logs listing indexes", add_listing_indexes),
+    (6, "pad second-precision task_logs.created_at", pad_created_at),
+    (7, "seed schedule_changes with existing tasks", seed_schedule_changes),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn: Connection) -> Optional[int]:
+    """Applied version, or None when the database predates versioning (or is empty)."""
+    if not inspect(conn).has_table("schema_version"):
+        return None
+    return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar()
+
+
+def _record(conn: Connection, version: int, description: str):
+    conn.execute(
+        text("INSERT INTO schema_version (version, description, applied_at) VALUES (:v, :d, CURRENT_TIMESTAMP)"),
+        {"v": version, "d": description}
+    )
+
+
+def _begin_locked(conn: Connection):
+    """Open the migration transaction, holding a lock no other worker can share."""
+    if conn.dialect.name == "postgresql":
+        conn.exec_driver_sql("BEGIN")
+        conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": ADVISORY_LOCK_ID})
+        return
+    if conn.dialect.name != "sqlite":
+        conn.exec_driver_sql("BEGIN")
+        return
+    # SQLite: the database write lock is the migration lock. Each attempt
+    # already waits busy_timeout; keep retrying while another worker migrates.
+    deadline = time.monotonic() + LOCK_TIMEOUT_SECONDS
+    while True:
+        try:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+            return
+        except OperationalError as e:
+            if "locked" not in str(e) or time.monotonic() > deadline:
+                raise
+            logger.info("Waiting for another worker to finish migrating the database")
+            time.sleep(0.5)
+
+
+def migrate(engine: Engine) -> int:
+    """Bring the schema to LATEST_VERSION; returns the number of steps applied."""
+    with engine.connect() as conn:
+        if current_version(conn) == LATEST_VERSION:
+            return 0
+
+    # Transactions are issued by hand so the whole migration holds one lock
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        _begin_locked(conn)
+        try:
+            applied = _apply(conn)
+            conn.exec_driver_sql("COMMIT")
+        except BaseException:
+            conn.exec_driver_sql("ROLLBACK")
+            raise
+    return applied
+
+
+def _apply(conn: Connection) -> int:
+    # Re-read under the lock: another worker may have just finished
+    version = current_version(conn)
+    if version == LATEST_VERSION:
+        return 0
+    if version is not None and version > LATEST_VERSION:
+        raise RuntimeError(f"Database schema version {version} is newer than this build ({LATEST_VERSION})")
+
+    fresh = version is None and not [t for t in inspect(conn).get_table_names() if t != "schema_version"]
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, description VARCHAR NOT NULL, applied_at TIMESTAMP)"
+    ))
+    if fresh:
+        create_missing_tables(conn)
+        _record(conn, LATEST_VERSION, "created from models")
+        logger.info("Created database schema at version %s", LATEST_VERSION)
+        return 1
+
+    applied = 0
+    for number, description, step in MIGRATIONS:
+        if version is not None and number <= version:
+            continue
+        logger.info("Applying migration %s: %s", number, description)
+        step(conn)
+        _record(conn, number, description)
+        applied += 1
+    return applied
@@ -1,8 +1,14 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, JSON, DateTime, Text
+from datetime import datetime, timezone
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, JSON, Date, DateTime, Text, LargeBinary, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
 
+def _utcnow() -> datetime:
+    # Same value as the CURRENT_TIMESTAMP server default (naive UTC), but with
+    # microseconds, so every stored created_at compares consistently as text
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 class User(Base):
     __tablename__ = "users"
 
@@ -56,7 +62,7 @@ class ReportTask(Base):
     __tablename__ = "report_tasks"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     gitea_config_id = Column(Integer, ForeignKey("gitea_configs.id"))
     notify_config_id = Column(Integer, ForeignKey("notify_configs.id"))
     ai_config_id = Column(Integer, ForeignKey("ai_configs.id"), nullable=True)
@@ -78,6 +84,11 @@ class ReportTask(Base):
 
 class TaskLog(Base):
     __tablename__ = "task_logs"
+    # Newest-first listing per task, and across tasks, walked with a (created_at, id) keyset
+    __table_args__ = (
+        Index("ix_task_logs_task_id_created_at", "task_id", "created_at", "id"),
+        Index("ix_task_logs_created_at", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     task_id = Column(Integer, ForeignKey("report_tasks.id"))
@@ -85,8 +96,66 @@ class TaskLog(Base):
     commit_count = Column(Integer, default=0)
     summary = Column(Text, nullable=True)
     log_details = Column(Text, nullable=True)
-    raw_data = Column(Text, nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Run checkpoints: last completed pipeline stage and the outputs a retry resumes from.
+    # The fetch stage's raw payload is kept compressed in task_log_blobs.
+    stage = Column(String, nullable=True)  # "fetch", "render", "summarize" or "deliver"
+    report_markdown = Column(Text, nullable=True)
+    ai_summary = Column(Text, nullable=True)
+    attempts = Column(Integer, default=1)
+    created_at = Column(DateTime(timezone=True), default=_utcnow, server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     task = relationship("ReportTask", back_populates="logs")
+
+class TaskLogBlob(Base):
+    __tablename__ = "task_log_blobs"
+
+    log_id = Column(Integer, ForeignKey("task_logs.id", ondelete="CASCADE"), primary_key=True)
+    codec = Column(String, nullable=False)  # "gzip" or "zstd"
+    data = Column(LargeBinary, nullable=False)
+    size = Column(Integer, nullable=False)  # uncompressed bytes
+
+class TaskLogDaily(Base):
+    """Per-task, per-day (UTC) totals of logs removed by retention."""
+    __tablename__ = "task_log_daily"
+
+    task_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    runs = Column(Integer, nullable=False, default=0)
+    succeeded = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    commit_count = Column(Integer, nullable=False, default=0)
+
+class RepoSyncState(Base):
+    __tablename__ = "repo_sync_states"
+    __table_args__ = (UniqueConstraint("gitea_config_id", "repo_full_name"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    gitea_config_id = Column(Integer, ForeignKey("gitea_configs.id"), index=True, nullable=False)
+    repo_full_name = Column(String, nullable=False)
+    last_commit_sha = Column(String, nullable=True)
+    last_commit_at = Column(DateTime(timezone=True), nullable=True)
+    # Commits are complete for [window_start, synced_until]
+    window_start = Column(DateTime(timezone=True), nullable=True)
+    synced_until = Column(DateTime(timezone=True), nullable=True)
+    commits = Column(JSON, nullable=True)
+    # Open issues / PRs as of issues_synced_at
+    issues = Column(JSON, nullable=True)
+    prs = Column(JSON, nullable=True)
+    issues_synced_at = Column(DateTime(timezone=True), nullable=True)
+
+class SchedulerLease(Base):
+    __tablename__ = "scheduler_leases"
+
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=True)
+    expires_at = Column(DateTime, nullable=True)  # naive UTC
+    heartbeat_at = Column(DateTime, nullable=True)  # naive UTC
+
+class ScheduleChange(Base):
+    __tablename__ = "schedule_changes"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    task_id = Column(Integer, index=True, nullable=False)  # no FK: deleted tasks are logged too
+    action = Column(String, nullable=False)  # "upsert" or "delete"
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from typing import List
-from ..database import get_db
+from ..database import get_db, run_in_db
 from ..models import AIConfig, User
 from ..schemas import AIConfigCreate, AIConfigResponse
 from .auth import get_current_user
@@ -22,7 +22,9 @@ def get_ai_configs(db: Session = Depends(get_db), current_user: User = Depends(g
 
 @router.post("/{config_id}/test")
 async def test_ai_connection(config_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    cfg = db.query(AIConfig).filter(AIConfig.id == config_id, AIConfig.user_id == current_user.id).first()
+    cfg = await run_in_db(
+        lambda: db.query(AIConfig).filter(AIConfig.id == config_id, AIConfig.user_id == current_user.id).first()
+    )
     if not cfg:
         raise HTTPException(status_code=404, detail="Config not found")
     
@@ -2,7 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from jose import JWTError, jwt
-from ..database import get_db
+from ..database import get_db, run_in_db
 from ..models import User
 from ..schemas import UserCreate, UserResponse, Token
 from ..core.security import get_password_hash, verify_password, create_access_token, SECRET_KEY, ALGORITHM
@@ -23,7 +23,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = db.query(User).filter(User.username == username).first()
+    user = await run_in_db(lambda: db.query(User).filter(User.username == username).first())
     if user is None:
         raise credentials_exception
     return user
@@ -1,10 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from typing import List
-from ..database import get_db
+from ..database import get_db, run_in_db
 from ..models import GiteaConfig, User
 from ..schemas import GiteaConfigCreate, GiteaConfigResponse
+from ..core.http_cache import response_cache
+from ..core.single_flight import gitea_requests
 from ..services.gitea import GiteaService
+from ..services.repo_cache import repo_listing_cache
 from .auth import get_current_user
 
 router = APIRouter()
@@ -21,15 +24,38 @@ def create_gitea_config(config: GiteaConfigCreate, db: Session = Depends(get_db)
 def get_gitea_configs(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     return db.query(GiteaConfig).filter(GiteaConfig.user_id == current_user.id).all()
 
+@router.get("/stats")
+def get_gitea_request_stats(current_user: User = Depends(get_current_user)):
+    return {
+        "single_flight": gitea_requests.stats,
+        "response_cache_entries": len(response_cache)
+    }
+
 @router.post("/{config_id}/test")
 async def test_gitea_connection(config_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    cfg = db.query(GiteaConfig).filter(GiteaConfig.id == config_id, GiteaConfig.user_id == current_user.id).first()
+    cfg = await run_in_db(
+        lambda: db.query(GiteaConfig).filter(GiteaConfig.id == config_id, GiteaConfig.user_id == current_user.id).first()
+    )
     if not cfg:
         raise HTTPException(status_code=404, detail="Config not found")
     service = GiteaService(cfg.base_url, cfg.token)
     success = await service.test_connection()
     return {"success": success}
 
+@router.post("/{config_id}/repos/refresh")
+async def refresh_gitea_repos(config_id: int, scope: str = "all", db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    cfg = await run_in_db(
+        lambda: db.query(GiteaConfig).filter(GiteaConfig.id == config_id, GiteaConfig.user_id == current_user.id).first()
+    )
+    if not cfg:
+        raise HTTPException(status_code=404, detail="Config not found")
+    repo_listing_cache.invalidate(config_id=cfg.id)
+    try:
+        repos = await repo_listing_cache.get_repos(cfg.id, scope, GiteaService(cfg.base_url, cfg.token))
+    except RuntimeError:
+        raise HTTPException(status_code=502, detail="Failed to list repositories from Gitea")
+    return {"repo_count": len(repos)}
+
 @router.delete("/{config_id}")
 def delete_gitea_config(config_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     cfg = db.query(GiteaConfig).filter(GiteaConfig.id == config_id, GiteaConfig.user_id == current_user.id).first()
@@ -37,4 +63,5 @@ def delete_gitea_config(config_id: int, db: Session = Depends(get_db), current_u
         raise HTTPException(status_code=404, detail="Config not found")
     db.delete(cfg)
     db.commit()
+    repo_listing_cache.invalidate(config_id=config_id)
     return {"message": "Config deleted"}
@@ -1,32 +1,126 @@
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
-from typing import List
-from ..database import get_db
-from ..models import TaskLog, ReportTask, User
-from ..schemas import TaskLogResponse
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session, load_only
+from typing import List, Tuple
+from datetime import datetime
+import base64
+from ..database import get_db, run_in_db
+from ..models import TaskLog, TaskLogBlob, TaskLogDaily, ReportTask, User
+from ..schemas import TaskLogDailyResponse, TaskLogResponse
+from ..services.log_blobs import LogBlobStore
+from ..services.pipeline import ReportPipeline
+from ..services.scheduler import scheduler_service
 from .auth import get_current_user
 
 router = APIRouter()
 
+def _encode_cursor(log: TaskLog) -> str:
+    raw = f"{log.created_at.replace(tzinfo=None).isoformat()}|{log.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, log_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(log_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @router.get("/", response_model=List[TaskLogResponse])
 def get_logs(
+    response: Response,
     task_id: int = Query(None),
     start_date: str = Query(None),
     end_date: str = Query(None),
-    limit: int = Query(50),
+    limit: int = Query(50, ge=1, le=500),
     offset: int = Query(0),
+    after: str = Query(None, description="Opaque cursor from X-Next-Cursor; replaces offset"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    query = db.query(TaskLog).join(ReportTask).filter(ReportTask.user_id == current_user.id)
+    # Summary columns only: checkpointed reports and raw payloads are fetched per log
+    query = (
+        db.query(TaskLog)
+        .options(load_only(
+            TaskLog.id, TaskLog.task_id, TaskLog.status, TaskLog.commit_count, TaskLog.summary,
+            TaskLog.log_details, TaskLog.stage, TaskLog.attempts, TaskLog.created_at
+        ))
+        .join(ReportTask)
+        .filter(ReportTask.user_id == current_user.id)
+    )
     if task_id:
         query = query.filter(TaskLog.task_id == task_id)
     
     if start_date:
-        from datetime import datetime
         query = query.filter(TaskLog.created_at >= datetime.fromisoformat(start_date))
     if end_date:
-        from datetime import datetime
         query = query.filter(TaskLog.created_at <= datetime.fromisoformat(end_date))
-    
-    return query.order_by(TaskLog.created_at.desc()).offset(offset).limit(limit).all()
+
+    # Keyset pagination: each page starts right after the last row of the
+    # previous one, so deep pages cost the same as the first
+    query = query.order_by(TaskLog.created_at.desc(), TaskLog.id.desc())
+    if after:
+        created_at, log_id = _decode_cursor(after)
+        query = query.filter(or_(
+            TaskLog.created_at < created_at,
+            and_(TaskLog.created_at == created_at, TaskLog.id < log_id)
+        ))
+    else:
+        query = query.offset(offset)
+
+    logs = query.limit(limit).all()
+    if len(logs) == limit:
+        response.headers["X-Next-Cursor"] = _encode_cursor(logs[-1])
+    return logs
+
+@router.get("/daily", response_model=List[TaskLogDailyResponse])
+def get_daily_totals(
+    task_id: int = Query(None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Per-day totals of logs that retention has already removed."""
+    query = (
+        db.query(TaskLogDaily)
+        .join(ReportTask, ReportTask.id == TaskLogDaily.task_id)
+        .filter(ReportTask.user_id == current_user.id)
+    )
+    if task_id:
+        query = query.filter(TaskLogDaily.task_id == task_id)
+    return query.order_by(TaskLogDaily.day.desc()).limit(1000).all()
+
+@router.get("/{log_id}/raw")
+def get_log_raw(log_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    blob = (
+        db.query(TaskLogBlob)
+        .join(TaskLog, TaskLog.id == TaskLogBlob.log_id)
+        .join(ReportTask)
+        .filter(TaskLogBlob.log_id == log_id, ReportTask.user_id == current_user.id)
+        .first()
+    )
+    if not blob:
+        raise HTTPException(status_code=404, detail="Raw data not found")
+    # Decompressed chunk by chunk while it is sent
+    return StreamingResponse(
+        LogBlobStore.iter_decompressed(blob.codec, blob.data),
+        media_type="application/json",
+        headers={"X-Raw-Size": str(blob.size)}
+    )
+
+@router.post("/{log_id}/retry")
+async def retry_log(log_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    log = await run_in_db(
+        lambda: db.query(TaskLog).join(ReportTask).filter(TaskLog.id == log_id, ReportTask.user_id == current_user.id).first()
+    )
+    if not log:
+        raise HTTPException(status_code=404, detail="Log not found")
+    if log.status not in ("failed", "cancelled"):
+        raise HTTPException(status_code=400, detail="Only failed or cancelled runs can be retried")
+    if not await run_in_db(scheduler_service.checkpoints_intact, db, log):
+        raise HTTPException(status_code=409, detail="Checkpoints of this run were purged by log retention")
+
+    # Resumes from the first stage without a checkpoint
+    if not await scheduler_service.retry_run(log.task_id, log.id):
+        raise HTTPException(status_code=409, detail="Task is already queued or running, or the queue is full")
+    return {"message": "Retry triggered", "resume_from": ReportPipeline.STAGES[ReportPipeline.next_stage(log.stage)]}
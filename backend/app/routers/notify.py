@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from typing import List
-from ..database import get_db
+from ..database import get_db, run_in_db
 from ..models import NotifyConfig, User
 from ..schemas import NotifyConfigCreate, NotifyConfigResponse
 from ..services.webhook import WebhookService
@@ -23,7 +23,9 @@ def get_notify_configs(db: Session = Depends(get_db), current_user: User = Depen
 
 @router.post("/{config_id}/test")
 async def test_notify_connection(config_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    cfg = db.query(NotifyConfig).filter(NotifyConfig.id == config_id, NotifyConfig.user_id == current_user.id).first()
+    cfg = await run_in_db(
+        lambda: db.query(NotifyConfig).filter(NotifyConfig.id == config_id, NotifyConfig.user_id == current_user.id).first()
+    )
     if not cfg:
         raise HTTPException(status_code=404, detail="Config not found")
     success = await WebhookService.send_wecom_markdown(cfg.webhook_url, "这是一条来自 Gitea Daily Reporter 的测试消息。")
@@ -1,33 +1,55 @@
 from fastapi import APIRouter, Depends, HTTPException
-from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
-from ..database import get_db
-from ..models import ReportTask, User, GiteaConfig, NotifyConfig, AIConfig
-from ..schemas import ReportTaskCreate, ReportTaskResponse
+from typing import List, Optional
+import asyncio
+import logging
+import uuid
+from ..database import get_db, run_in_db
+from ..models import ReportTask, TaskLog, User, GiteaConfig, NotifyConfig, AIConfig
+from ..schemas import BackfillRequest, ReportTaskCreate, ReportTaskResponse
 from ..services.scheduler import scheduler_service
+from ..services.gitea import GiteaService
+from ..services.pipeline import ReportPipeline, shared_collections
+from ..services.progress import SSE_HEADERS, Progress, run_events
 from .auth import get_current_user
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
+def _validate_cron(cron_expression: str):
+    try:
+        scheduler_service.validate_cron(cron_expression)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid cron expression: {e}")
+
+def _task_response(task: ReportTask) -> ReportTaskResponse:
+    response = ReportTaskResponse.model_validate(task)
+    if task.is_active:
+        response.next_run_at = scheduler_service.next_fire_time(task.id, task.cron_expression)
+    return response
+
 @router.post("/", response_model=ReportTaskResponse)
 def create_task(task: ReportTaskCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if task.is_active:
+        _validate_cron(task.cron_expression)
     new_task = ReportTask(**task.dict(), user_id=current_user.id)
     db.add(new_task)
+    db.flush()
+    scheduler_service.record_change(db, new_task.id)
     db.commit()
     db.refresh(new_task)
-    
-    if new_task.is_active:
-        try:
-            scheduler_service.add_or_update_task(new_task.id, new_task.cron_expression)
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Invalid cron expression: {e}")
-            
-    return new_task
+    scheduler_service.request_sync()
+    return _task_response(new_task)
 
 @router.get("/", response_model=List[ReportTaskResponse])
 def get_tasks(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    return db.query(ReportTask).filter(ReportTask.user_id == current_user.id).all()
+    return [_task_response(t) for t in db.query(ReportTask).filter(ReportTask.user_id == current_user.id).all()]
+
+@router.get("/queue")
+def get_queue_stats(current_user: User = Depends(get_current_user)):
+    return {**scheduler_service.queue.stats(), "collections": shared_collections.stats}
 
 @router.put("/{task_id}", response_model=ReportTaskResponse)
 def update_task(task_id: int, task_data: ReportTaskCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
@@ -35,120 +57,101 @@ def update_task(task_id: int, task_data: ReportTaskCreate, db: Session = Depends
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     
+    if task_data.is_active:
+        _validate_cron(task_data.cron_expression)
     for key, value in task_data.dict().items():
         setattr(task, key, value)
     
+    scheduler_service.record_change(db, task.id)
     db.commit()
     db.refresh(task)
-    
-    if task.is_active:
-        try:
-            scheduler_service.add_or_update_task(task.id, task.cron_expression)
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Invalid cron expression: {e}")
-    else:
-        scheduler_service.remove_task(task.id)
-        
-    return task
-
-@router.post("/test-run")
-async def test_run_task(task_data: ReportTaskCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    # Get the actual configs from DB to get the tokens/urls
-    gitea_cfg = await run_in_threadpool(
-        lambda: db.query(GiteaConfig).filter(GiteaConfig.id == task_data.gitea_config_id, GiteaConfig.user_id == current_user.id).first()
-    )
-    notify_cfg = await run_in_threadpool(
-        lambda: db.query(NotifyConfig).filter(NotifyConfig.id == task_data.notify_config_id, NotifyConfig.user_id == current_user.id).first()
-    )
-    
+    scheduler_service.request_sync()
+    return _task_response(task)
+
+async def _load_test_configs(db: Session, task_data: ReportTaskCreate, user_id: int):
+    def load():
+        # Get the actual configs from DB to get the tokens/urls
+        gitea_cfg = db.query(GiteaConfig).filter(GiteaConfig.id == task_data.gitea_config_id, GiteaConfig.user_id == user_id).first()
+        notify_cfg = db.query(NotifyConfig).filter(NotifyConfig.id == task_data.notify_config_id, NotifyConfig.user_id == user_id).first()
+        ai_cfg = None
+        if task_data.is_ai_enabled and task_data.ai_config_id:
+            ai_cfg = db.query(AIConfig).filter(AIConfig.id == task_data.ai_config_id, AIConfig.user_id == user_id).first()
+        return gitea_cfg, notify_cfg, ai_cfg
+
+    gitea_cfg, notify_cfg, ai_cfg = await run_in_db(load)
     if not gitea_cfg or not notify_cfg:
         raise HTTPException(status_code=404, detail="Gitea or Notify config not found")
+    return gitea_cfg, notify_cfg, ai_cfg
 
-    from ..services.gitea import GiteaService
-    from ..services.webhook import WebhookService
-    from datetime import datetime, timedelta
-
+async def _test_run(task_data: ReportTaskCreate, gitea_cfg, notify_cfg, ai_cfg, progress: Optional[Progress] = None):
+    report = progress or (lambda event, data: None)
     gitea_service = GiteaService(gitea_cfg.base_url, gitea_cfg.token)
-    
-    # Use Aware Local Time
-    now = datetime.now().astimezone()
-    since = (now - timedelta(days=task_data.report_days)).replace(hour=0, minute=0, second=0, microsecond=0)
-    until = now
-
-    markdown_report = ""
-    data_by_repo = {}
-    if task_data.scope_type == "user":
-        user_info = await gitea_service.get_my_info()
-        username = user_info.get("login")
-        user_id = user_info.get("id")
-        full_name = user_info.get("full_name") or username
-        activities = await gitea_service.get_user_activities(username, since, user_id=user_id)
-        
-        # Group activities by repo for generate_activity_report
-        for act in activities:
-            repo_name = act["repo"]["full_name"]
-            if repo_name not in data_by_repo:
-                data_by_repo[repo_name] = {"activities": [], "detailed_commits": []}
-            data_by_repo[repo_name]["activities"].append(act)
-            
-        markdown_report = gitea_service.generate_activity_report(since, data_by_repo, full_name)
-    else:
-        repos_to_check = []
-        if task_data.scope_type in ["all", "owner"]:
-            repos_to_check = await gitea_service.get_all_repos(scope=task_data.scope_type)
-        else:
-            repos_to_check = task_data.target_repos or []
-
-        import asyncio
-        semaphore = asyncio.Semaphore(10)
-
-        async def fetch_repo_data(repo):
-            async with semaphore:
-                c, i, p = await asyncio.gather(
-                    gitea_service.get_commits_for_repo(repo, since, until),
-                    gitea_service.get_open_issues(repo),
-                    gitea_service.get_open_prs(repo)
-                )
-                return repo, c, i, p
-
-        results = await asyncio.gather(*(fetch_repo_data(repo) for repo in repos_to_check))
-
-        data_by_repo = {}
-        for repo, repo_commits, repo_issues, repo_prs in results:
-            if repo_commits or repo_issues or repo_prs:
-                data_by_repo[repo] = {
-                    "commits": repo_commits,
-                    "issues": repo_issues,
-                    "prs": repo_prs
-                }
-
-        markdown_report = gitea_service.generate_markdown_report(since, data_by_repo)
+    since, until = ReportPipeline.report_window(task_data.report_days)
+
+    # Test runs are stateless: no high-water marks, no log checkpoints
+    report("stage", {"stage": "fetch"})
+    fetched = await ReportPipeline.fetch(
+        gitea_service, gitea_cfg.id, task_data.scope_type, task_data.target_repos, since, until, progress=progress
+    )
+    report("fetched", {"commit_count": fetched["total_commits"], "repo_count": len(fetched["repo_data"])})
+    markdown_report = ReportPipeline.render(fetched)
+    report("rendered", {"report": markdown_report})
     
     # AI Summary in test run
-    if task_data.is_ai_enabled and task_data.ai_config_id:
-        ai_cfg = await run_in_threadpool(
-            lambda: db.query(AIConfig).filter(AIConfig.id == task_data.ai_config_id, AIConfig.user_id == current_user.id).first()
-        )
-        if ai_cfg:
-            from ..services.ai import AIService
-            # Priority: Incoming task_data prompt > AI Config prompt
-            system_prompt = task_data.ai_system_prompt or ai_cfg.system_prompt
-            
-            ai_summary = await AIService.summarize_report(
-                api_base=ai_cfg.api_base,
-                api_key=ai_cfg.api_key,
-                model=ai_cfg.model,
-                content=markdown_report,
-                system_prompt=system_prompt
-            )
-            markdown_report = f"{ai_summary}\n\n{markdown_report}"
-
-    success = await WebhookService.send_wecom_markdown(notify_cfg.webhook_url, f"【配置测试】\n{markdown_report}")
+    ai_summary = None
+    if ai_cfg:
+        report("stage", {"stage": "summarize"})
+        # Priority: Incoming task_data prompt > AI Config prompt
+        ai_summary = await ReportPipeline.summarize(markdown_report, ai_cfg, task_data.ai_system_prompt, progress=progress)
+    markdown_report = ReportPipeline.compose(markdown_report, ai_summary)
+
+    report("stage", {"stage": "deliver"})
+    success = await ReportPipeline.deliver(notify_cfg.webhook_url, f"【配置测试】\n{markdown_report}")
+    report("delivered", {"success": success})
     
     if not success:
         raise HTTPException(status_code=400, detail="Failed to send notification to Webhook")
         
-    return {"message": "Test report sent successfully", "commit_count": sum(len(d.get("commits", [])) for d in data_by_repo.values())}
+    return {
+        "message": "Test report sent successfully",
+        "commit_count": fetched["total_commits"],
+        "cache_stats": gitea_service.cache_stats,
+        "fetch_errors": gitea_service.fetch_errors
+    }
+
+@router.post("/test-run")
+async def test_run_task(task_data: ReportTaskCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    gitea_cfg, notify_cfg, ai_cfg = await _load_test_configs(db, task_data, current_user.id)
+    return await _test_run(task_data, gitea_cfg, notify_cfg, ai_cfg)
+
+@router.post("/test-run/stream")
+async def test_run_task_stream(task_data: ReportTaskCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Same as /test-run, reported as Server-Sent Events while it runs."""
+    gitea_cfg, notify_cfg, ai_cfg = await _load_test_configs(db, task_data, current_user.id)
+    key = f"test:{uuid.uuid4().hex}"
+    queue = run_events.subscribe(key)
+
+    async def run():
+        try:
+            result = await _test_run(task_data, gitea_cfg, notify_cfg, ai_cfg, progress=run_events.reporter(key))
+            run_events.publish(key, "done", result)
+        except HTTPException as e:
+            run_events.publish(key, "error", {"message": e.detail})
+        except Exception as e:
+            logger.error(f"Streaming test run failed: {e}")
+            run_events.publish(key, "error", {"message": str(e)})
+
+    async def events():
+        job = asyncio.create_task(run())
+        try:
+            async for chunk in run_events.stream(key, queue):
+                yield chunk
+        finally:
+            # The client went away: nobody is left to see the result
+            if not job.done():
+                job.cancel()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 @router.delete("/{task_id}")
 def delete_task(task_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
@@ -156,26 +159,75 @@ def delete_task(task_id: int, db: Session = Depends(get_db), current_user: User
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    scheduler_service.remove_task(task.id)
+    scheduler_service.record_change(db, task.id, action="delete")
     db.delete(task)
     db.commit()
+    scheduler_service.request_sync()
     return {"message": "Task deleted"}
 
 @router.post("/{task_id}/run")
 async def run_task_immediately(task_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    task = db.query(ReportTask).filter(ReportTask.id == task_id, ReportTask.user_id == current_user.id).first()
+    task = await run_in_db(
+        lambda: db.query(ReportTask).filter(ReportTask.id == task_id, ReportTask.user_id == current_user.id).first()
+    )
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    # We can use the scheduler to run it once immediately
-    import uuid
-    from ..services.scheduler import scheduler_service
-    
-    # Generate a unique job id for this manual run
-    job_id = f"manual_{task_id}_{uuid.uuid4().hex[:8]}"
-    scheduler_service.scheduler.add_job(
-        scheduler_service.execute_task,
-        args=[task_id],
-        id=job_id
-    )
+    # Manual runs jump ahead of queued cron runs
+    if not scheduler_service.enqueue_task(task_id, manual=True):
+        raise HTTPException(status_code=409, detail="Task is already queued or running, or the queue is full")
     return {"message": "Task execution triggered"}
+
+@router.post("/{task_id}/run/stream")
+async def run_task_stream(task_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Queue a manual run and follow it as Server-Sent Events until it finishes."""
+    task = await run_in_db(
+        lambda: db.query(ReportTask).filter(ReportTask.id == task_id, ReportTask.user_id == current_user.id).first()
+    )
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    # Subscribe before queueing so no event can be missed
+    queue = run_events.subscribe(task_id)
+    if not scheduler_service.enqueue_task(task_id, manual=True):
+        run_events.unsubscribe(task_id, queue)
+        raise HTTPException(status_code=409, detail="Task is already queued or running, or the queue is full")
+    queue.put_nowait(("queued", {"depth": scheduler_service.queue.stats()["depth"]}))
+    return StreamingResponse(run_events.stream(task_id, queue), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.post("/{task_id}/backfill")
+async def backfill_task(task_id: int, request: BackfillRequest, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Regenerate the last `days` daily reports from a single fetch, in the background."""
+    task = await run_in_db(
+        lambda: db.query(ReportTask).filter(ReportTask.id == task_id, ReportTask.user_id == current_user.id).first()
+    )
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    if not scheduler_service.enqueue_backfill(task_id, request.days, deliver=request.deliver, ai=request.ai):
+        raise HTTPException(status_code=409, detail="Task is already queued or running, or the queue is full")
+    return {"message": "Backfill triggered", "days": request.days}
+
+@router.post("/{task_id}/cancel")
+async def cancel_task_run(task_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    def mark_cancelling():
+        task = db.query(ReportTask).filter(ReportTask.id == task_id, ReportTask.user_id == current_user.id).first()
+        if not task:
+            raise HTTPException(status_code=404, detail="Task not found")
+        log = (
+            db.query(TaskLog)
+            .filter(TaskLog.task_id == task_id, TaskLog.status == "running")
+            .order_by(TaskLog.id.desc())
+            .first()
+        )
+        if not log:
+            raise HTTPException(status_code=409, detail="Task is not running")
+        # Runs on other workers see this between stages
+        log.status = "cancelling"
+        db.commit()
+        return log.id
+
+    log_id = await run_in_db(mark_cancelling)
+    # A run in this process is stopped right away, mid-request if need be
+    cancelled = scheduler_service.cancel_task(task_id)
+    return {"message": "Task cancellation requested", "log_id": log_id, "status": "cancelled" if cancelled else "cancelling"}
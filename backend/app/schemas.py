@@ -1,6 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
-from datetime import datetime
+from datetime import date, datetime
 
 # Auth
 class UserBase(BaseModel):
@@ -81,9 +81,15 @@ class ReportTaskCreate(ReportTaskBase):
 class ReportTaskResponse(ReportTaskBase):
     id: int
     last_run_at: Optional[datetime] = None
+    next_run_at: Optional[datetime] = None  # effective fire time, including any spread offset
     class Config:
         from_attributes = True
 
+class BackfillRequest(BaseModel):
+    days: int = Field(30, ge=1, le=90)  # complete days to regenerate, ending yesterday
+    deliver: bool = False
+    ai: bool = False  # only used when the task has AI enabled
+
 # Task Log
 class TaskLogResponse(BaseModel):
     id: int
@@ -92,7 +98,18 @@ class TaskLogResponse(BaseModel):
     commit_count: int
     summary: str
     log_details: Optional[str] = None
-    raw_data: Optional[str] = None
+    stage: Optional[str] = None
+    attempts: int = 1
     created_at: datetime
     class Config:
         from_attributes = True
+
+class TaskLogDailyResponse(BaseModel):
+    task_id: int
+    day: date
+    runs: int
+    succeeded: int
+    failed: int
+    commit_count: int
+    class Config:
+        from_attributes = True
@@ -1,5 +1,5 @@
 import re
-from typing import Optional
+from typing import Callable, Optional
 from openai import AsyncOpenAI
 from ..core.http_client import HttpClientManager
 
@@ -10,7 +10,8 @@ class AIService:
         api_key: str, 
         model: str, 
         content: str, 
-        system_prompt: Optional[str] = None
+        system_prompt: Optional[str] = None,
+        on_token: Optional[Callable[[str], None]] = None
     ) -> str:
         if not system_prompt:
             system_prompt = (
@@ -40,17 +41,34 @@ class AIService:
 
         print(f"DEBUG: AI Request - Base: {api_base}, Model: {model}")
         try:
-            response = await client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"请总结以下内容：\n\n{content}"}
-                ],
-                timeout=120.0 # Reasoning models take longer
-            )
-            
-            # Extract content
-            res_content = response.choices[0].message.content or ""
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"请总结以下内容：\n\n{content}"}
+            ]
+            if on_token is None:
+                response = await client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    timeout=120.0 # Reasoning models take longer
+                )
+
+                # Extract content
+                res_content = response.choices[0].message.content or ""
+            else:
+                # Stream the answer so callers can show it as it is generated
+                stream = await client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    timeout=120.0,
+                    stream=True
+                )
+                parts = []
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        parts.append(delta)
+                        on_token(delta)
+                res_content = "".join(parts)
             
             # Handle "Think" mode: 
             # 1. Some providers put thinking in reasoning_content (ignored for the final summary)
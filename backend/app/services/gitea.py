@@ -1,16 +1,70 @@
+import asyncio
 import json
-from datetime import datetime
-from typing import List, Dict, Any
+import logging
+import os
+import time
+import httpx
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, AsyncIterator, Callable
 from ..core.http_client import HttpClientManager
+from ..core.http_cache import response_cache
+from ..core.rate_limit import host_limiters
+from ..core.single_flight import gitea_requests
+from .sync_state import commit_fetch_window, merge_commits, merge_open_items
+
+logger = logging.getLogger(__name__)
 
 class GiteaService:
-    def __init__(self, base_url: str, token: str):
+    def __init__(self, base_url: str, token: str, commits_page_size: Optional[int] = None):
         self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.commits_page_size = commits_page_size or int(os.getenv("GITEA_COMMITS_PAGE_SIZE", "50"))
+        self.page_concurrency = int(os.getenv("GITEA_PAGE_CONCURRENCY", "4"))
+        # Above this many repos, open issues/PRs come from /repos/issues/search instead of per repo
+        self.bulk_threshold = int(os.getenv("GITEA_BULK_ISSUES_THRESHOLD", "10"))
+        self._max_page_size: Optional[int] = None
         self.headers = {"Authorization": f"token {token}"}
+        # Request counters for this service instance (i.e. one task run):
+        # 304 revalidations, full downloads, and requests joined from another task
+        self.cache_stats = {"hits": 0, "misses": 0, "coalesced": 0}
+        # Requests that still failed after retries; their data is missing from the report
+        self.fetch_errors: List[Dict[str, Any]] = []
+        self.limiter = host_limiters.get(self.base_url)
+
+    async def _get(self, path: str, params: Optional[Dict[str, Any]] = None) -> httpx.Response:
+        """
+        GET an API path. Identical concurrent GETs (same token, URL and query)
+        share one in-flight request; each request revalidates against the
+        shared response cache and a 304 is turned back into a 200.
+        """
+        url = f"{self.base_url}/api/v1{path}"
+        key = response_cache.make_key(self.token, url, params)
+        response, shared = await gitea_requests.do(key, lambda: self._fetch(url, key, path, params))
+        if shared:
+            self.cache_stats["coalesced"] += 1
+        if response.status_code != 200:
+            self.fetch_errors.append({"path": path, "status": response.status_code})
+        return response
+
+    async def _fetch(self, url: str, key: str, path: str, params: Optional[Dict[str, Any]]) -> httpx.Response:
+        cached = response_cache.lookup(key)
+        headers = {**self.headers, **response_cache.conditional_headers(cached)}
 
-    async def get_my_info(self) -> Dict[str, Any]:
         client = HttpClientManager.get_client()
-        response = await client.get(f"{self.base_url}/api/v1/user", headers=self.headers)
+        response = await self.limiter.request(lambda: client.get(url, headers=headers, params=params))
+        if response.status_code == 304 and cached is not None:
+            self.cache_stats["hits"] += 1
+            return cached.to_response(response.request)
+
+        self.cache_stats["misses"] += 1
+        if response.status_code == 200:
+            response_cache.store(key, response)
+        else:
+            logger.warning(f"Gitea GET {path} returned HTTP {response.status_code}")
+        return response
+
+    async def get_my_info(self) -> Dict[str, Any]:
+        response = await self._get("/user")
         if response.status_code == 200:
             return response.json()
         return {}
@@ -19,35 +73,90 @@ class GiteaService:
         info = await self.get_my_info()
         return bool(info)
 
-    async def get_all_repos(self, scope: str = "all") -> List[str]:
-        repos = []
-        page = 1
-        client = HttpClientManager.get_client()
+    async def get_max_page_size(self) -> int:
+        """Largest `limit` the server accepts (Gitea's MAX_RESPONSE_ITEMS, 50 by default)."""
+        if self._max_page_size is None:
+            self._max_page_size = 50
+            response = await self._get("/settings/api")
+            if response.status_code == 200:
+                self._max_page_size = response.json().get("max_response_items") or 50
+        return self._max_page_size
+
+    async def _get_all_pages(self, path: str, params: Dict[str, Any], limit: int) -> Optional[List[Any]]:
+        """
+        Fetch every page of a list endpoint. When the first response carries
+        X-Total-Count the remaining pages are requested concurrently (bounded),
+        otherwise we fall back to walking pages until a short one.
+        Returns None if the endpoint itself is unavailable.
+        """
+        response = await self._get(path, params={**params, "page": 1, "limit": limit})
+        if response.status_code != 200:
+            return None
+        first = response.json()
+        if not first:
+            return []
+
+        total = response.headers.get("x-total-count")
+        if total is None or not total.isdigit():
+            items = list(first)
+            page = 1
+            while len(items) == page * limit:
+                page += 1
+                response = await self._get(path, params={**params, "page": page, "limit": limit})
+                if response.status_code != 200 or not response.json():
+                    break
+                items.extend(response.json())
+            return items
+
+        # The server may still clamp the limit, trust the size of the first page
+        per_page = max(len(first), 1) if len(first) < limit else limit
+        page_count = -(-int(total) // per_page)
+        semaphore = asyncio.Semaphore(self.page_concurrency)
+
+        async def fetch_page(page: int) -> List[Any]:
+            async with semaphore:
+                resp = await self._get(path, params={**params, "page": page, "limit": limit})
+                return resp.json() if resp.status_code == 200 else []
+
+        rest = await asyncio.gather(*(fetch_page(page) for page in range(2, page_count + 1)))
+        items = list(first)
+        for page_items in rest:
+            items.extend(page_items)
+        return items
+
+    async def get_all_repo_details(self, scope: str = "all") -> List[Dict[str, Any]]:
+        """
+        Repo listing trimmed to the metadata the report pipeline needs. Raises
+        RuntimeError when the listing fails, rather than passing an outage off
+        as "no repositories".
+        """
         gitea_type = "all" if scope == "all" else "individual"
-        while True:
-            response = await client.get(
-                f"{self.base_url}/api/v1/user/repos",
-                headers=self.headers,
-                params={"page": page, "limit": 50, "type": gitea_type}
-            )
-            if response.status_code != 200:
-                break
-            data = response.json()
-            if not data:
-                break
-            for repo in data:
-                repos.append(repo["full_name"])
-            page += 1
-        return repos
+        limit = await self.get_max_page_size()
+        data = await self._get_all_pages("/user/repos", {"type": gitea_type}, limit)
+        if data is None:
+            raise RuntimeError("获取 Gitea 仓库列表失败")
+        return [
+            {
+                "full_name": repo["full_name"],
+                "updated_at": repo.get("updated_at"),
+                "default_branch": repo.get("default_branch"),
+                "archived": repo.get("archived", False),
+                "empty": repo.get("empty", False),
+                "open_issues_count": repo.get("open_issues_count"),
+                "open_pr_counter": repo.get("open_pr_counter")
+            }
+            for repo in data
+        ]
+
+    async def get_all_repos(self, scope: str = "all") -> List[str]:
+        return [repo["full_name"] for repo in await self.get_all_repo_details(scope)]
 
     async def get_user_activities(self, username: str, since: datetime, user_id: int = None) -> List[Dict[str, Any]]:
         activities = []
         page = 1
-        client = HttpClientManager.get_client()
         while True:
-            response = await client.get(
-                f"{self.base_url}/api/v1/users/{username}/activities/feeds",
-                headers=self.headers,
+            response = await self._get(
+                f"/users/{username}/activities/feeds",
                 params={"page": page, "limit": 50}
             )
             if response.status_code != 200:
@@ -74,70 +183,366 @@ class GiteaService:
             page += 1
         return activities
 
-    async def get_commits_for_repo(self, repo_full_name: str, since: datetime, until: datetime) -> List[Dict[str, Any]]:
-        commits = []
-        client = HttpClientManager.get_client()
-        response = await client.get(
-            f"{self.base_url}/api/v1/repos/{repo_full_name}/commits",
-            headers=self.headers,
-            params={"since": since.isoformat(), "stat": "false"}
-        )
-        if response.status_code == 200:
+    async def get_commits_for_repo(
+        self,
+        repo_full_name: str,
+        since: datetime,
+        until: datetime,
+        sha: Optional[str] = None,
+        page_size: Optional[int] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield the commits of a repo authored inside [since, until], newest first.
+        The window is passed to the server and paging stops as soon as a page
+        reaches past `since`, so quiet repos cost a single small request.
+        An `until` of "now" is filtered here only: sent along, it would make
+        every run's URL unique and defeat the response cache and request sharing.
+        """
+        limit = page_size or self.commits_page_size
+        params = {
+            "since": since.isoformat(),
+            "stat": "false",
+            "verification": "false",
+            "files": "false",
+            "limit": limit
+        }
+        if until < datetime.now(until.tzinfo) - timedelta(minutes=1):
+            params["until"] = until.isoformat()
+        if sha:
+            params["sha"] = sha
+
+        page = 1
+        while True:
+            response = await self._get(f"/repos/{repo_full_name}/commits", params={**params, "page": page})
+            if response.status_code != 200:
+                break
             data = response.json()
+            if not data:
+                break
+
+            reached_since = False
             for commit_item in data:
                 commit_date = datetime.fromisoformat(commit_item["commit"]["author"]["date"].replace("Z", "+00:00"))
-                if since <= commit_date <= until:
-                    author_info = commit_item.get("author")
-                    author_name = (author_info.get("full_name") if author_info else None) or \
-                                 commit_item["commit"]["author"]["name"]
-                    commits.append({
-                        "repo": repo_full_name,
-                        "author": author_name,
-                        "message": commit_item["commit"]["message"].split("\n")[0],
-                        "sha": commit_item["sha"][:7],
-                        "url": commit_item["html_url"],
-                        "date": commit_date
-                    })
-        return commits
+                if commit_date < since:
+                    reached_since = True
+                    continue
+                if commit_date > until:
+                    continue
+                author_info = commit_item.get("author")
+                author_name = (author_info.get("full_name") if author_info else None) or \
+                             commit_item["commit"]["author"]["name"]
+                yield {
+                    "repo": repo_full_name,
+                    "author": author_name,
+                    "message": commit_item["commit"]["message"].split("\n")[0],
+                    "sha": commit_item["sha"][:7],
+                    "url": commit_item["html_url"],
+                    "date": commit_date
+                }
+
+            if reached_since or len(data) < limit:
+                break
+            page += 1
+
+    @staticmethod
+    def _issue_summary(item: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": item["number"],
+            "title": item["title"],
+            "url": item["html_url"],
+            "user": item["user"]["full_name"] or item["user"]["login"],
+            "state": item.get("state", "open")
+        }
 
     async def get_open_issues(self, repo_full_name: str) -> List[Dict[str, Any]]:
         issues = []
-        client = HttpClientManager.get_client()
-        response = await client.get(
-            f"{self.base_url}/api/v1/repos/{repo_full_name}/issues",
-            headers=self.headers,
+        response = await self._get(
+            f"/repos/{repo_full_name}/issues",
             params={"state": "open", "type": "issues"}
         )
         if response.status_code == 200:
             data = response.json()
             for item in data:
-                issues.append({
-                    "id": item["number"],
-                    "title": item["title"],
-                    "url": item["html_url"],
-                    "user": item["user"]["full_name"] or item["user"]["login"]
-                })
+                issues.append(self._issue_summary(item))
         return issues
 
     async def get_open_prs(self, repo_full_name: str) -> List[Dict[str, Any]]:
         prs = []
-        client = HttpClientManager.get_client()
-        response = await client.get(
-            f"{self.base_url}/api/v1/repos/{repo_full_name}/pulls",
-            headers=self.headers,
+        response = await self._get(
+            f"/repos/{repo_full_name}/pulls",
             params={"state": "open"}
         )
         if response.status_code == 200:
             data = response.json()
             for item in data:
-                prs.append({
-                    "id": item["number"],
-                    "title": item["title"],
-                    "url": item["html_url"],
-                    "user": item["user"]["full_name"] or item["user"]["login"]
-                })
+                prs.append(self._issue_summary(item))
         return prs
 
+    async def search_items(
+        self,
+        item_type: str,
+        since: Optional[datetime] = None,
+        owner: Optional[str] = None
+    ) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+        """
+        Open issues (item_type="issues") or PRs ("pulls") across every repo the
+        token can see (or only `owner`'s repos), via the paginated
+        /repos/issues/search endpoint, grouped by repo full name. With `since`,
+        returns every item updated after it in any state instead. Returns None
+        when the endpoint is unavailable.
+        """
+        limit = await self.get_max_page_size()
+        params = {"state": "open", "type": item_type}
+        if since is not None:
+            params.update({"state": "all", "since": since.isoformat()})
+        if owner:
+            params["owner"] = owner
+        data = await self._get_all_pages("/repos/issues/search", params, limit)
+        if data is None:
+            return None
+        by_repo: Dict[str, List[Dict[str, Any]]] = {}
+        for item in data:
+            repo_name = (item.get("repository") or {}).get("full_name")
+            if repo_name:
+                by_repo.setdefault(repo_name, []).append(self._issue_summary(item))
+        return by_repo
+
+    async def get_item_updates(self, repo_full_name: str, item_type: str, since: datetime) -> List[Dict[str, Any]]:
+        """Issues or PRs of one repo updated after `since`, in any state."""
+        limit = await self.get_max_page_size()
+        data = await self._get_all_pages(
+            f"/repos/{repo_full_name}/issues",
+            {"state": "all", "type": item_type, "since": since.isoformat()},
+            limit
+        )
+        return [self._issue_summary(item) for item in data or []]
+
+    @staticmethod
+    def plan_repo_fetches(repo_infos: List[Dict[str, Any]], since: datetime) -> Dict[str, Dict[str, bool]]:
+        """
+        Decide which calls each listed repo needs. Commits are only queried for
+        repos updated inside the window (and not archived/empty); issue and PR
+        lists are skipped when the listing already says there are none open.
+        """
+        plan = {}
+        for info in repo_infos:
+            needs_commits = not (info.get("archived") or info.get("empty"))
+            updated_at = info.get("updated_at")
+            if needs_commits and updated_at:
+                updated = datetime.fromisoformat(updated_at.replace("Z", "+00:00"))
+                needs_commits = updated >= since
+            plan[info["full_name"]] = {
+                "commits": needs_commits,
+                "issues": info.get("open_issues_count") != 0,
+                "prs": info.get("open_pr_counter") != 0
+            }
+        return plan
+
+    async def collect_repo_data(
+        self,
+        repos: List[str],
+        since: datetime,
+        until: datetime,
+        repo_infos: Optional[List[Dict[str, Any]]] = None,
+        marks: Optional[Dict[str, Dict[str, Any]]] = None,
+        timeout: Optional[float] = None,
+        progress: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+        search_owner: Optional[str] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Fetch commits, open issues and open PRs for each repo. Request concurrency
+        is bounded by the shared per-host limiter, not per call. When the repo
+        listing metadata is given, dormant repos skip the calls they don't need.
+        Listing-backed or large repo sets take issues/PRs from the bulk search,
+        falling back to per-repo calls if the search endpoint is unavailable.
+        `search_owner` limits that search to one owner's repos, for listings
+        that only cover them; without it the search spans the whole instance.
+
+        With `marks` (see sync_state), only the delta since each repo's stored
+        high-water mark is fetched and the marks are updated in place.
+
+        With a `timeout`, repos still unfinished when it runs out are dropped from
+        the result (and recorded in fetch_errors) instead of failing the whole call.
+        A bulk search that runs out is recorded the same way; the run then goes on
+        without issues and PRs, keeping any stored snapshots as they were.
+        `progress` is told the repo count up front and each repo as it completes.
+        """
+        started = time.monotonic()
+        if progress:
+            progress("repos", {"total": len(repos)})
+        done_count = 0
+        plan = self.plan_repo_fetches(repo_infos, since) if repo_infos else {}
+        updated_at = {
+            info["full_name"]: datetime.fromisoformat(info["updated_at"].replace("Z", "+00:00"))
+            for info in repo_infos or [] if info.get("updated_at")
+        }
+        full = {"commits": True, "issues": True, "prs": True}
+        if marks is not None:
+            for repo in repos:
+                marks.setdefault(repo, {})
+
+        # Many repos: a few paged search calls beat two requests per repo.
+        # If every repo already has an issue snapshot, only ask for what changed.
+        issues_by_repo = prs_by_repo = None
+        bulk_since = None
+        items_timed_out = False
+        if repo_infos is not None or len(repos) > self.bulk_threshold:
+            if marks is not None and repos and all(marks[r].get("issues_synced_at") for r in repos):
+                bulk_since = min(marks[r]["issues_synced_at"] for r in repos)
+            try:
+                # At most half the budget, so commits still get time if the search stalls
+                issues_by_repo, prs_by_repo = await asyncio.wait_for(asyncio.gather(
+                    self.search_items("issues", since=bulk_since, owner=search_owner),
+                    self.search_items("pulls", since=bulk_since, owner=search_owner)
+                ), timeout / 2 if timeout is not None else None)
+            except asyncio.TimeoutError:
+                items_timed_out = True
+                self.fetch_errors.append({"path": "/repos/issues/search", "status": "timeout"})
+
+        async def fetch_commits(repo, needs, mark):
+            if not needs["commits"]:
+                return []
+            if mark is None:
+                return [c async for c in self.get_commits_for_repo(repo, since, until)]
+            start, is_delta = commit_fetch_window(mark, since, updated_at.get(repo))
+            fetched = [] if start is None else [c async for c in self.get_commits_for_repo(repo, start, until)]
+            return merge_commits(mark, fetched, is_delta, since, until, skipped=start is None)
+
+        async def fetch_items(repo, item_type, needed, bulk, mark):
+            key = "issues" if item_type == "issues" else "prs"
+            if items_timed_out:
+                return (mark.get(key) or []) if mark is not None else []
+            if bulk is not None:
+                if bulk_since is not None:
+                    return merge_open_items(mark.get(key) or [], bulk.get(repo, []))
+                return bulk.get(repo, [])
+            if not needed:
+                return []
+            if mark is not None and mark.get("issues_synced_at"):
+                updates = await self.get_item_updates(repo, item_type, mark["issues_synced_at"])
+                return merge_open_items(mark.get(key) or [], updates)
+            if item_type == "issues":
+                return await self.get_open_issues(repo)
+            return await self.get_open_prs(repo)
+
+        async def fetch_repo_data(repo):
+            needs = plan.get(repo, full)
+            mark = marks[repo] if marks is not None else None
+            c, i, p = await asyncio.gather(
+                fetch_commits(repo, needs, mark),
+                fetch_items(repo, "issues", needs["issues"], issues_by_repo, mark),
+                fetch_items(repo, "pulls", needs["prs"], prs_by_repo, mark)
+            )
+            if mark is not None and not items_timed_out:
+                mark.update({"issues": i, "prs": p, "issues_synced_at": until})
+            if progress:
+                nonlocal done_count
+                done_count += 1
+                progress("repo", {"repo": repo, "done": done_count, "total": len(repos)})
+            return repo, c, i, p
+
+        if timeout is None or not repos:
+            results = await asyncio.gather(*(fetch_repo_data(repo) for repo in repos))
+        else:
+            tasks = {asyncio.ensure_future(fetch_repo_data(repo)): repo for repo in repos}
+            done, pending = await asyncio.wait(tasks, timeout=max(0.0, timeout - (time.monotonic() - started)))
+            for t in pending:
+                t.cancel()
+                self.fetch_errors.append({"path": f"/repos/{tasks[t]}", "status": "timeout"})
+            await asyncio.gather(*pending, return_exceptions=True)
+            results = [t.result() for t in tasks if t in done]
+
+        data_by_repo = {}
+        for repo, repo_commits, repo_issues, repo_prs in results:
+            if repo_commits or repo_issues or repo_prs:
+                data_by_repo[repo] = {
+                    "commits": repo_commits,
+                    "issues": repo_issues,
+                    "prs": repo_prs
+                }
+        return data_by_repo
+
+    @staticmethod
+    def parse_push_commits(act: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """
+        Commits listed in a push activity's content JSON. Returns None when the
+        feed truncated the list (Gitea keeps only FeedMaxCommitNum of them) or
+        the content can't be parsed, meaning the commit listing is still needed.
+        """
+        try:
+            content = json.loads(act.get("content") or "")
+        except ValueError:
+            return None
+        commits = content.get("Commits") or []
+        if content.get("Len", len(commits)) > len(commits):
+            return None
+        return commits
+
+    async def collect_activity_data(
+        self,
+        activities: List[Dict[str, Any]],
+        since: datetime,
+        until: datetime,
+        user_info: Dict[str, Any]
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Group activities by repo and attach the user's own commits. Commits come
+        from the push payloads themselves; only repos with truncated pushes fall
+        back to listing the pushed branch, and those listings run concurrently.
+        Gitea's commit listing has no author filter, so that path still filters locally.
+        """
+        username = user_info.get("login")
+        full_name = user_info.get("full_name") or username
+        email = user_info.get("email")
+
+        data_by_repo: Dict[str, Dict[str, Any]] = {}
+        for act in activities:
+            repo_name = act["repo"]["full_name"]
+            if repo_name not in data_by_repo:
+                data_by_repo[repo_name] = {"activities": [], "detailed_commits": []}
+            data_by_repo[repo_name]["activities"].append(act)
+
+        def is_mine(author_name: Optional[str], author_email: Optional[str]) -> bool:
+            return author_name in (full_name, username) or (bool(email) and author_email == email)
+
+        async def repo_commits(repo_name: str, repo_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+            commits: Dict[str, Dict[str, Any]] = {}
+            branches = set()
+            for act in repo_data["activities"]:
+                if act["op_type"] not in ["commit_repo", "push_repo"]:
+                    continue
+                pushed = self.parse_push_commits(act)
+                if pushed is None:
+                    branches.add((act.get("ref_name") or "").replace("refs/heads/", "") or None)
+                    continue
+                for c in pushed:
+                    sha = c.get("Sha1") or ""
+                    date = datetime.fromisoformat(c["Timestamp"].replace("Z", "+00:00")) if c.get("Timestamp") else None
+                    if not sha or not is_mine(c.get("AuthorName"), c.get("AuthorEmail")):
+                        continue
+                    if date is not None and not since <= date <= until:
+                        continue
+                    commits[sha[:7]] = {
+                        "repo": repo_name,
+                        "author": c.get("AuthorName"),
+                        "message": (c.get("Message") or "").strip().split("\n")[0],
+                        "sha": sha[:7],
+                        "url": f"{self.base_url}/{repo_name}/commit/{sha}",
+                        "date": date
+                    }
+
+            for branch in branches:
+                async for c in self.get_commits_for_repo(repo_name, since, until, sha=branch):
+                    if c["author"] == full_name or c["author"] == username:
+                        commits.setdefault(c["sha"], c)
+            return list(commits.values())
+
+        repo_names = list(data_by_repo)
+        results = await asyncio.gather(*(repo_commits(name, data_by_repo[name]) for name in repo_names))
+        for name, commits in zip(repo_names, results):
+            data_by_repo[name]["detailed_commits"] = commits
+        return data_by_repo
+
     @staticmethod
     def generate_markdown_report(report_date: datetime, data_by_repo: Dict[str, Dict[str, Any]]) -> str:
         date_str = report_date.strftime("%Y-%m-%d")
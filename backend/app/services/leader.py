@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+from sqlalchemy import update, or_
+from sqlalchemy.exc import IntegrityError
+from ..database import SessionLocal, run_in_db
+from ..models import SchedulerLease
+
+logger = logging.getLogger(__name__)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class LeaderElector:
+    """
+    Lease-based leader election on the application database. The holder renews
+    its row every heartbeat; if it stops (crash, shutdown) the lease expires and
+    another process takes it over on its next attempt.
+    on_elected and on_heartbeat are coroutines, so they can move their DB work
+    off the loop; on_demoted is plain, it also runs from the synchronous release().
+    """
+    def __init__(
+        self,
+        name: str = "scheduler",
+        lease_seconds: int = 30,
+        heartbeat_seconds: int = 10,
+        on_elected: Optional[Callable[[], Awaitable[None]]] = None,
+        on_demoted: Optional[Callable[[], None]] = None,
+        on_heartbeat: Optional[Callable[[], Awaitable[None]]] = None,
+        session_factory=SessionLocal
+    ):
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.on_heartbeat = on_heartbeat
+        self.session_factory = session_factory
+        self.holder_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.is_leader = False
+        self._task: Optional[asyncio.Task] = None
+
+    def try_acquire(self) -> bool:
+        """Take or renew the lease. Atomic: only one holder's UPDATE can match."""
+        now = _utcnow()
+        with self.session_factory() as db:
+            if db.get(SchedulerLease, self.name) is None:
+                try:
+                    db.add(SchedulerLease(name=self.name))
+                    db.commit()
+                except IntegrityError:
+                    db.rollback()
+            result = db.execute(
+                update(SchedulerLease)
+                .where(SchedulerLease.name == self.name)
+                .where(or_(
+                    SchedulerLease.holder == self.holder_id,
+                    SchedulerLease.holder.is_(None),
+                    SchedulerLease.expires_at < now
+                ))
+                .values(
+                    holder=self.holder_id,
+                    expires_at=now + timedelta(seconds=self.lease_seconds),
+                    heartbeat_at=now
+                )
+            )
+            db.commit()
+            return result.rowcount == 1
+
+    def release(self):
+        if not self.is_leader:
+            return
+        with self.session_factory() as db:
+            db.execute(
+                update(SchedulerLease)
+                .where(SchedulerLease.name == self.name)
+                .where(SchedulerLease.holder == self.holder_id)
+                .values(holder=None, expires_at=None)
+            )
+            db.commit()
+        self._set_leader(False)
+
+    def _set_leader(self, leader: bool) -> bool:
+        """Record the new state; True when it changed. Runs on_demoted, the caller awaits on_elected."""
+        if leader == self.is_leader:
+            return False
+        self.is_leader = leader
+        logger.info(f"{self.holder_id} {'acquired' if leader else 'lost'} the '{self.name}' lease")
+        if not leader and self.on_demoted:
+            self.on_demoted()
+        return True
+
+    def _attempt(self) -> bool:
+        try:
+            return self.try_acquire()
+        except Exception as e:
+            # Can't reach the DB: we can't prove we still hold the lease
+            logger.error(f"Lease heartbeat failed: {e}")
+            return False
+
+    async def _apply(self, acquired: bool):
+        if self._set_leader(acquired):
+            if acquired and self.on_elected:
+                await self.on_elected()
+        elif acquired and self.on_heartbeat:
+            await self.on_heartbeat()
+
+    async def tick(self):
+        # The lease write runs on the DB executor, never on the loop
+        await self._apply(await run_in_db(self._attempt))
+
+    async def _run(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                # A failing callback must not end the heartbeat
+                logger.error(f"Leader callback failed: {e}")
+            await asyncio.sleep(self.heartbeat_seconds)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.release()
@@ -0,0 +1,68 @@
+import gzip
+import zlib
+from typing import Iterator, Optional, Tuple
+from sqlalchemy.orm import Session
+from ..models import TaskLogBlob
+
+try:
+    import zstandard
+except ImportError:  # optional: gzip is always available
+    zstandard = None
+
+# New payloads use zstd when the package is installed; old rows keep their codec
+DEFAULT_CODEC = "zstd" if zstandard is not None else "gzip"
+CHUNK_SIZE = 64 * 1024
+
+
+class LogBlobStore:
+    """
+    Raw run payloads (the fetch stage's JSON), compressed and kept out of the
+    task_logs rows so listing logs never reads them.
+    """
+    @staticmethod
+    def compress(text: str, codec: str = DEFAULT_CODEC) -> Tuple[str, bytes]:
+        raw = text.encode("utf-8")
+        if codec == "zstd":
+            return codec, zstandard.ZstdCompressor(level=3).compress(raw)
+        return "gzip", gzip.compress(raw, compresslevel=6)
+
+    @staticmethod
+    def iter_decompressed(codec: str, data: bytes) -> Iterator[bytes]:
+        if codec == "zstd":
+            if zstandard is None:
+                raise RuntimeError("zstandard is required to read this payload")
+            reader = zstandard.ZstdDecompressor().stream_reader(data)
+            while chunk := reader.read(CHUNK_SIZE):
+                yield chunk
+            return
+        # wbits 16+: gzip container
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        pending = data
+        while pending:
+            # Bounded output: JSON compresses well, one input chunk can be huge
+            chunk = decompressor.decompress(pending, CHUNK_SIZE)
+            if chunk:
+                yield chunk
+            pending = decompressor.unconsumed_tail
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+    @staticmethod
+    def save(db: Session, log_id: int, text: str):
+        """Add or replace a log's payload; the caller commits."""
+        codec, data = LogBlobStore.compress(text)
+        blob = db.get(TaskLogBlob, log_id)
+        if blob is None:
+            blob = TaskLogBlob(log_id=log_id)
+            db.add(blob)
+        blob.codec = codec
+        blob.data = data
+        blob.size = len(text.encode("utf-8"))
+
+    @staticmethod
+    def load_text(db: Session, log_id: int) -> Optional[str]:
+        blob = db.get(TaskLogBlob, log_id)
+        if blob is None:
+            return None
+        return b"".join(LogBlobStore.iter_decompressed(blob.codec, blob.data)).decode("utf-8")
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session
+from ..database import SessionLocal, engine, run_in_db
+from ..models import TaskLog, TaskLogBlob, TaskLogDaily
+from .log_blobs import LogBlobStore
+
+logger = logging.getLogger(__name__)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class LogMaintenance:
+    """
+    Retention for task logs, run as a leader-only scheduled job:
+      - after `raw_days`, a log's raw payload and checkpointed report/summary are dropped
+      - after `keep_days`, the log itself is folded into task_log_daily and deleted
+    Work is done in small batches, each its own short transaction, with a pause
+    in between so request handlers get the SQLite write lock back quickly.
+    """
+    def __init__(
+        self,
+        raw_days: int = 14,
+        keep_days: int = 180,
+        batch_size: int = 500,
+        pause_seconds: float = 0.2,
+        vacuum_pages: int = 2000,
+        vacuum_steps: int = 50
+    ):
+        self.raw_days = raw_days
+        self.keep_days = keep_days
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self.vacuum_pages = vacuum_pages
+        self.vacuum_steps = vacuum_steps
+        self.last_run: Dict[str, int] = {}
+
+    @staticmethod
+    def expire_raw_batch(db: Session, cutoff: datetime, batch_size: int) -> int:
+        """Drop the payloads of up to batch_size logs older than cutoff; returns how many."""
+        ids = [
+            log_id for (log_id,) in
+            db.query(TaskLogBlob.log_id)
+            .join(TaskLog, TaskLog.id == TaskLogBlob.log_id)
+            .filter(TaskLog.created_at < cutoff)
+            .limit(batch_size)
+        ]
+        if not ids:
+            return 0
+        db.query(TaskLogBlob).filter(TaskLogBlob.log_id.in_(ids)).delete(synchronize_session=False)
+        db.query(TaskLog).filter(TaskLog.id.in_(ids)).update(
+            {TaskLog.report_markdown: None, TaskLog.ai_summary: None}, synchronize_session=False
+        )
+        db.commit()
+        return len(ids)
+
+    @staticmethod
+    def rollup_batch(db: Session, cutoff: datetime, batch_size: int) -> int:
+        """
+        Fold up to batch_size logs older than cutoff into daily totals and delete them.
+        Logs of deleted tasks (task_id NULL) have no task to total under and are just deleted.
+        """
+        rows = (
+            db.query(TaskLog.id, TaskLog.task_id, TaskLog.status, TaskLog.commit_count, TaskLog.created_at)
+            .filter(TaskLog.created_at < cutoff)
+            .order_by(TaskLog.created_at)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            return 0
+
+        totals: Dict[Tuple[int, object], List[int]] = {}
+        for row in rows:
+            if row.task_id is None:
+                continue
+            t = totals.setdefault((row.task_id, row.created_at.date()), [0, 0, 0, 0])
+            t[0] += 1
+            t[1] += row.status == "success"
+            t[2] += row.status == "failed"
+            t[3] += row.commit_count or 0
+
+        for (task_id, day), (runs, succeeded, failed, commits) in totals.items():
+            daily = db.get(TaskLogDaily, (task_id, day))
+            if daily is None:
+                daily = TaskLogDaily(task_id=task_id, day=day, runs=0, succeeded=0, failed=0, commit_count=0)
+                db.add(daily)
+            daily.runs += runs
+            daily.succeeded += succeeded
+            daily.failed += failed
+            daily.commit_count += commits
+
+        ids = [row.id for row in rows]
+        db.query(TaskLogBlob).filter(TaskLogBlob.log_id.in_(ids)).delete(synchronize_session=False)
+        db.query(TaskLog).filter(TaskLog.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+        return len(ids)
+
+    @staticmethod
+    def has_inline_raw(db: Session) -> bool:
+        return "raw_data" in [c["name"] for c in inspect(db.connection()).get_columns("task_logs")]
+
+    @staticmethod
+    def move_inline_raw_batch(db: Session, after_id: int, batch_size: int) -> Tuple[int, int]:
+        """
+        Move up to batch_size payloads older versions kept inline in task_logs.raw_data
+        (ids above after_id) into task_log_blobs. Returns (moved, last id seen).
+        """
+        rows = db.execute(
+            text("SELECT id, raw_data FROM task_logs WHERE id > :after AND raw_data IS NOT NULL ORDER BY id LIMIT :n"),
+            {"after": after_id, "n": batch_size}
+        ).fetchall()
+        for log_id, raw_data in rows:
+            LogBlobStore.save(db, log_id, raw_data)
+            db.execute(text("UPDATE task_logs SET raw_data = NULL WHERE id = :id"), {"id": log_id})
+        db.commit()
+        return len(rows), rows[-1][0] if rows else after_id
+
+    async def move_inline_raw(self) -> int:
+        """
+        Data half of migration 4, kept out of the startup migration lock: on a large
+        database it can take far longer than workers should wait to boot. Idempotent
+        and resumable, so a restart simply carries on with the rows still inline.
+        """
+        with SessionLocal() as db:
+            if not await run_in_db(self.has_inline_raw, db):
+                return 0
+            total, after = 0, 0
+            while True:
+                moved, after = await run_in_db(self.move_inline_raw_batch, db, after, self.batch_size)
+                total += moved
+                if moved < self.batch_size:
+                    if total:
+                        logger.info(f"Moved {total} inline raw payloads into task_log_blobs")
+                    return total
+                await asyncio.sleep(self.pause_seconds)
+
+    def _autocommit(self):
+        return engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+
+    def vacuum_step(self) -> bool:
+        """Return up to vacuum_pages free pages to the OS; True while more remain (SQLite only)."""
+        with self._autocommit() as conn:
+            if conn.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+                if os.getenv("SQLITE_CONVERT_AUTO_VACUUM") == "1":
+                    # One-off: switching an existing file to incremental mode needs a full VACUUM
+                    logger.info("Converting the database to incremental auto_vacuum (full VACUUM)")
+                    conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+                    conn.execute(text("VACUUM"))
+                return False
+            free = conn.execute(text("PRAGMA freelist_count")).scalar()
+            target = max(0, free - self.vacuum_pages)
+            # pysqlite steps a pragma statement once, and each step of
+            # incremental_vacuum frees a single page: keep stepping, in one
+            # transaction, until this slice's pages are gone
+            conn.execute(text("BEGIN"))
+            try:
+                while free > target:
+                    conn.execute(text(f"PRAGMA incremental_vacuum({free - target})"))
+                    remaining = conn.execute(text("PRAGMA freelist_count")).scalar()
+                    if remaining >= free:
+                        break
+                    free = remaining
+                conn.execute(text("COMMIT"))
+            except BaseException:
+                conn.execute(text("ROLLBACK"))
+                raise
+            return free > 0
+
+    def analyze(self):
+        with self._autocommit() as conn:
+            # Runs ANALYZE only on tables whose statistics are stale
+            conn.execute(text("PRAGMA optimize"))
+
+    async def _drain(self, step, cutoff: datetime) -> int:
+        total = 0
+        while True:
+            with SessionLocal() as db:
+                done = await run_in_db(step, db, cutoff, self.batch_size)
+            total += done
+            if done < self.batch_size:
+                return total
+            await asyncio.sleep(self.pause_seconds)
+
+    async def run(self):
+        now = _utcnow()
+        try:
+            # Normally done right after the leader is elected; catches up after a failure
+            await self.move_inline_raw()
+            expired = await self._drain(self.expire_raw_batch, now - timedelta(days=self.raw_days)) if self.raw_days > 0 else 0
+            rolled = await self._drain(self.rollup_batch, now - timedelta(days=self.keep_days)) if self.keep_days > 0 else 0
+            if engine.dialect.name == "sqlite":
+                # A bounded number of slices per run; the next run picks up the rest
+                for _ in range(self.vacuum_steps):
+                    if not await run_in_db(self.vacuum_step):
+                        break
+                    await asyncio.sleep(self.pause_seconds)
+                await run_in_db(self.analyze)
+        except Exception as e:
+            logger.error(f"Log maintenance failed: {e}")
+            return
+        self.last_run = {"expired_payloads": expired, "rolled_up_logs": rolled}
+        logger.info(f"Log maintenance: dropped {expired} payloads, rolled up {rolled} logs")
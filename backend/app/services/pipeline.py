@@ -0,0 +1,267 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from ..core.single_flight import SingleFlight
+from ..database import run_in_db
+from ..models import AIConfig
+from .ai import AIService
+from .gitea import GiteaService
+from .progress import Progress
+from .repo_cache import repo_listing_cache
+from .sync_state import RepoSyncStore
+from .webhook import WebhookService
+
+logger = logging.getLogger(__name__)
+
+SEARCH_PATH = "/repos/issues/search"
+# Failed requests whose data still arrives another way (default page size, per-repo calls)
+RECOVERED_PATHS = ("/settings/api", SEARCH_PATH)
+
+
+def datetime_handler(x):
+    if isinstance(x, datetime):
+        return x.isoformat()
+    raise TypeError("Unknown type")
+
+
+class SharedCollections:
+    """
+    Shares one fetch between runs with the same fingerprint. Runs overlapping
+    in time join the in-flight fetch; runs starting within `ttl` seconds after
+    it finished (e.g. spread over a cron slot) reuse the finished result.
+    """
+    def __init__(self, ttl: int = 300):
+        self.ttl = ttl
+        self._flights = SingleFlight()
+        self._results: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self.stats = {"collected": 0, "shared": 0}
+
+    @staticmethod
+    def fingerprint(gitea_config_id: int, scope_type: str, target_repos: Optional[List[str]], report_days: int, since: datetime) -> str:
+        # Only a "specific" scope is defined by its repo list
+        repos = "" if scope_type in ("all", "owner", "user") else ",".join(sorted(target_repos or []))
+        return f"{gitea_config_id}|{scope_type}|{repos}|{report_days}|{since.date().isoformat()}"
+
+    def _prune(self, now: float):
+        for key in [k for k, (at, _) in self._results.items() if now - at > self.ttl]:
+            del self._results[key]
+
+    async def collect(self, key: str, fn: Callable[[], Awaitable[Dict[str, Any]]]) -> Tuple[Dict[str, Any], bool]:
+        """Returns (fetched, shared); shared is True when another run did the fetch."""
+        now = time.monotonic()
+        self._prune(now)
+        if key in self._results:
+            self.stats["shared"] += 1
+            return self._results[key][1], True
+
+        fetched, shared = await self._flights.do(key, fn)
+        if shared:
+            self.stats["shared"] += 1
+        else:
+            self.stats["collected"] += 1
+            if self.ttl > 0:
+                self._results[key] = (time.monotonic(), fetched)
+        return fetched, shared
+
+    def clear(self):
+        self._results.clear()
+
+
+shared_collections = SharedCollections(ttl=int(os.getenv("COLLECTION_SHARE_SECONDS", "300")))
+
+
+class ReportPipeline:
+    """
+    A report run split into stages. Each stage's output is small enough to be
+    checkpointed on the TaskLog, so a retry can resume where the last run stopped:
+      fetch     -> raw payload (JSON, compressed in task_log_blobs)
+      render    -> report_markdown
+      summarize -> ai_summary
+      deliver   -> status
+    """
+    STAGES = ("fetch", "render", "summarize", "deliver")
+
+    @staticmethod
+    def report_window(report_days: int, now: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+        # Use Aware Local Time for calculations
+        now = now or datetime.now().astimezone()
+        since = (now - timedelta(days=report_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+        return since, now
+
+    @staticmethod
+    def backfill_periods(days: int, now: Optional[datetime] = None) -> List[Tuple[datetime, datetime]]:
+        """The last `days` complete calendar days as (start, end) pairs, oldest first."""
+        now = now or datetime.now().astimezone()
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        return [(today - timedelta(days=i), today - timedelta(days=i - 1)) for i in range(days, 0, -1)]
+
+    @staticmethod
+    def partition(fetched: Dict[str, Any], since: datetime, until: datetime) -> Dict[str, Any]:
+        """
+        Cut one period [since, until) out of a fetch covering a longer range.
+        Open issues/PRs are a snapshot of today, so past periods leave them out.
+        """
+        repo_data: Dict[str, Dict[str, Any]] = {}
+        if fetched["scope"] == "user":
+            for repo, data in fetched["repo_data"].items():
+                acts = [
+                    a for a in data["activities"]
+                    if since <= datetime.fromisoformat(a["created"].replace("Z", "+00:00")) < until
+                ]
+                commits = [c for c in data["detailed_commits"] if c["date"] is not None and since <= c["date"] < until]
+                if acts:
+                    repo_data[repo] = {"activities": acts, "detailed_commits": commits}
+            total = sum(len(d["detailed_commits"]) for d in repo_data.values())
+        else:
+            for repo, data in fetched["repo_data"].items():
+                commits = [c for c in data["commits"] if since <= c["date"] < until]
+                if commits:
+                    repo_data[repo] = {"commits": commits, "issues": [], "prs": []}
+            total = sum(len(d["commits"]) for d in repo_data.values())
+        return {**fetched, "window": {"since": since, "until": until}, "repo_data": repo_data, "total_commits": total}
+
+    @staticmethod
+    def next_stage(done_stage: Optional[str]) -> int:
+        """Index of the first stage still to run after `done_stage`."""
+        return ReportPipeline.STAGES.index(done_stage) + 1 if done_stage else 0
+
+    @staticmethod
+    async def fetch(
+        gitea_service: GiteaService,
+        gitea_config_id: int,
+        scope_type: str,
+        target_repos: Optional[List[str]],
+        since: datetime,
+        until: datetime,
+        db: Optional[Session] = None,
+        timeout: Optional[float] = None,
+        progress: Optional[Progress] = None
+    ) -> Dict[str, Any]:
+        """
+        Collect the data for one report. With a db session, repo scopes use the
+        stored high-water marks. With a timeout, repo scopes return what finished
+        in time (see collect_repo_data); the user scope, and a repo listing that
+        alone runs out of time, raise asyncio.TimeoutError.
+        """
+        fetched: Dict[str, Any] = {
+            "scope": scope_type,
+            "window": {"since": since, "until": until}
+        }
+
+        if scope_type == "user":
+            async def collect_user():
+                user_info = await gitea_service.get_my_info()
+                username = user_info.get("login")
+                user_id = user_info.get("id")
+                activities = await gitea_service.get_user_activities(username, since, user_id=user_id)
+                return user_info, await gitea_service.collect_activity_data(activities, since, until, user_info)
+
+            user_info, data_by_repo = await asyncio.wait_for(collect_user(), timeout)
+            if progress:
+                progress("repos", {"total": len(data_by_repo)})
+            fetched["user_full_name"] = user_info.get("full_name") or user_info.get("login")
+            fetched["total_commits"] = sum(len(d["detailed_commits"]) for d in data_by_repo.values())
+        else:
+            async def prepare():
+                repo_infos = None
+                search_owner = None
+                if scope_type in ["all", "owner"]:
+                    repo_infos = await repo_listing_cache.get_repos(gitea_config_id, scope_type, gitea_service)
+                    repos_to_check = [r["full_name"] for r in repo_infos]
+                    if scope_type == "owner":
+                        # Keep the bulk issue/PR search to the user's own repos, not the whole instance
+                        search_owner = (await gitea_service.get_my_info()).get("login")
+                else:
+                    repos_to_check = target_repos or []
+
+                marks = None
+                if db is not None:
+                    # Only the delta since each repo's high-water mark is fetched
+                    marks = await run_in_db(RepoSyncStore.load, db, gitea_config_id, repos_to_check)
+                return repo_infos, search_owner, repos_to_check, marks
+
+            # The listing counts against the same budget; only what is left goes to the repos
+            started = time.monotonic()
+            repo_infos, search_owner, repos_to_check, marks = await asyncio.wait_for(prepare(), timeout)
+            remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - started))
+            data_by_repo = await gitea_service.collect_repo_data(
+                repos_to_check, since, until, repo_infos=repo_infos, marks=marks, timeout=remaining, progress=progress,
+                search_owner=search_owner
+            )
+            if marks is not None:
+                await run_in_db(RepoSyncStore.save, db, gitea_config_id, marks)
+            fetched["total_commits"] = sum(len(d["commits"]) for d in data_by_repo.values())
+
+        fetched["repo_data"] = data_by_repo
+        fetched["cache_stats"] = gitea_service.cache_stats
+        if gitea_service.fetch_errors:
+            fetched["fetch_errors"] = gitea_service.fetch_errors
+        return fetched
+
+    @staticmethod
+    def fetch_gaps(fetched: Dict[str, Any]) -> str:
+        """Summary suffix naming the data missing from a fetch; empty when it is complete."""
+        errors = fetched.get("fetch_errors") or []
+        notes = []
+        timed_out = [e["path"] for e in errors if e["status"] == "timeout"]
+        repos_timed_out = [p for p in timed_out if p != SEARCH_PATH]
+        if repos_timed_out:
+            notes.append(f"{len(repos_timed_out)} 个仓库超时未统计")
+        if len(repos_timed_out) < len(timed_out):
+            notes.append("议题和 PR 拉取超时，未包含在报告中")
+
+        failed: List[str] = []
+        for e in errors:
+            if e["status"] == "timeout" or e["path"] in RECOVERED_PATHS:
+                continue
+            parts = e["path"].split("/")
+            name = "/".join(parts[2:4]) if parts[1] == "repos" and len(parts) >= 4 else e["path"]
+            if name not in failed:
+                failed.append(name)
+        if failed:
+            shown = "、".join(failed[:5]) + (" 等" if len(failed) > 5 else "")
+            notes.append(f"{len(failed)} 处请求失败，数据不完整：{shown}")
+        return "".join(f"（{note}）" for note in notes)
+
+    @staticmethod
+    def dump(fetched: Dict[str, Any]) -> str:
+        return json.dumps(fetched, default=datetime_handler, ensure_ascii=False)
+
+    @staticmethod
+    def render(fetched: Dict[str, Any]) -> str:
+        since = fetched["window"]["since"]
+        if isinstance(since, str):
+            since = datetime.fromisoformat(since)
+        if fetched["scope"] == "user":
+            return GiteaService.generate_activity_report(since, fetched["repo_data"], fetched["user_full_name"])
+        return GiteaService.generate_markdown_report(since, fetched["repo_data"])
+
+    @staticmethod
+    async def summarize(
+        report: str,
+        ai_cfg: AIConfig,
+        system_prompt: Optional[str] = None,
+        progress: Optional[Progress] = None
+    ) -> str:
+        """With `progress`, the answer is streamed and reported as "token" events."""
+        return await AIService.summarize_report(
+            api_base=ai_cfg.api_base,
+            api_key=ai_cfg.api_key,
+            model=ai_cfg.model,
+            content=report,
+            system_prompt=system_prompt or ai_cfg.system_prompt,
+            on_token=(lambda text: progress("token", {"text": text})) if progress else None
+        )
+
+    @staticmethod
+    def compose(report: str, ai_summary: Optional[str]) -> str:
+        return f"{ai_summary}\n\n{report}" if ai_summary else report
+
+    @staticmethod
+    async def deliver(webhook_url: str, content: str) -> bool:
+        return await WebhookService.send_wecom_markdown(webhook_url, content)
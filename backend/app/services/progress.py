@@ -0,0 +1,68 @@
+import asyncio
+import json
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, Optional, Set, Tuple
+
+# progress(event, data): called by the pipeline as a run advances
+Progress = Callable[[str, Dict[str, Any]], None]
+
+# Events after which a run's stream is closed
+TERMINAL_EVENTS = ("done", "error", "cancelled", "skipped")
+
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+class RunEvents:
+    """
+    In-process fan-out of run progress to Server-Sent Events subscribers.
+    Keyed by task id for real runs, by a one-off key for test runs. Publishing
+    with no subscribers is a no-op, so runs report progress unconditionally.
+    """
+    def __init__(self, keepalive_seconds: float = 15):
+        self.keepalive_seconds = keepalive_seconds
+        self._subscribers: Dict[Hashable, Set[asyncio.Queue]] = {}
+
+    def subscribe(self, key: Hashable) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(key, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, key: Hashable, queue: asyncio.Queue):
+        queues = self._subscribers.get(key)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[key]
+
+    def listening(self, key: Hashable) -> bool:
+        return bool(self._subscribers.get(key))
+
+    def publish(self, key: Hashable, event: str, data: Optional[Dict[str, Any]] = None):
+        for queue in self._subscribers.get(key, ()):
+            queue.put_nowait((event, data or {}))
+
+    def reporter(self, key: Hashable) -> Progress:
+        return lambda event, data: self.publish(key, event, data)
+
+    async def stream(self, key: Hashable, queue: asyncio.Queue) -> AsyncIterator[str]:
+        """SSE body for one subscriber; ends after a terminal event or when the client goes away."""
+        try:
+            while True:
+                try:
+                    item: Tuple[str, Dict[str, Any]] = await asyncio.wait_for(queue.get(), self.keepalive_seconds)
+                except asyncio.TimeoutError:
+                    # Comment line: keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                event, data = item
+                yield format_sse(event, data)
+                if event in TERMINAL_EVENTS:
+                    return
+        finally:
+            self.unsubscribe(key, queue)
+
+
+run_events = RunEvents()
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
@@ -0,0 +1,49 @@
+import asyncio
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from .gitea import GiteaService
+
+class RepoListingCache:
+    """
+    Process-wide TTL cache of repository listings keyed by (gitea config id, scope).
+    Concurrent misses for the same key wait on a single fetch. A failed listing
+    raises out of get_repos and is never cached.
+    """
+    def __init__(self, ttl_seconds: int = 300):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[Tuple[int, str], Tuple[float, List[Dict[str, Any]]]] = {}
+        self._locks: Dict[Tuple[int, str], asyncio.Lock] = {}
+
+    async def get_repos(self, config_id: int, scope: str, gitea_service: GiteaService) -> List[Dict[str, Any]]:
+        key = (config_id, scope)
+        cached = self._fresh(key)
+        if cached is not None:
+            return cached
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # Another task may have filled the entry while we were waiting
+            cached = self._fresh(key)
+            if cached is not None:
+                return cached
+            repos = await gitea_service.get_all_repo_details(scope=scope)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, repos)
+            return repos
+
+    def invalidate(self, config_id: Optional[int] = None, scope: Optional[str] = None):
+        for key in list(self._entries):
+            if (config_id is None or key[0] == config_id) and (scope is None or key[1] == scope):
+                del self._entries[key]
+
+    def _fresh(self, key: Tuple[int, str]) -> Optional[List[Dict[str, Any]]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, repos = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        return repos
+
+repo_listing_cache = RepoListingCache(ttl_seconds=int(os.getenv("REPO_CACHE_TTL", "300")))
@@ -1,20 +1,150 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.base import BaseTrigger
 from apscheduler.triggers.cron import CronTrigger
-from datetime import datetime, timedelta
-from sqlalchemy import update, or_
+from apscheduler.triggers.date import DateTrigger
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+from sqlalchemy import update, or_, select, delete, func
+from sqlalchemy.orm import Session, joinedload
 import json
 import traceback
 import tzlocal
 import logging
 import asyncio
-from ..database import SessionLocal
-from ..models import ReportTask, TaskLog
+import hashlib
+import itertools
+import os
+import time
+from ..database import SessionLocal, run_in_db
+from ..models import ReportTask, TaskLog, TaskLogBlob, ScheduleChange
 from .gitea import GiteaService
-from .webhook import WebhookService
-from .ai import AIService
+from .leader import LeaderElector
+from .log_blobs import LogBlobStore
+from .maintenance import LogMaintenance
+from .pipeline import ReportPipeline, shared_collections
+from .progress import run_events
 
 logger = logging.getLogger(__name__)
 
+CHANGELOG_LOOKBACK = 50
+
+class RunCancelled(Exception):
+    """A cancel was requested for the run (possibly from another process)."""
+
+class QueuedRun:
+    __slots__ = ("task_id", "enqueued_at", "run", "deadline")
+
+    def __init__(self, task_id: int, run: Callable[[], Awaitable[None]], deadline: Optional[float] = None):
+        self.task_id = task_id
+        self.enqueued_at = time.monotonic()
+        self.run = run
+        self.deadline = deadline
+
+class OffsetTrigger(BaseTrigger):
+    """Wraps a trigger and shifts every fire time by a fixed number of seconds."""
+    def __init__(self, trigger: BaseTrigger, offset_seconds: int):
+        self.trigger = trigger
+        self.offset = timedelta(seconds=offset_seconds)
+
+    def get_next_fire_time(self, previous_fire_time, now):
+        previous = previous_fire_time - self.offset if previous_fire_time else None
+        next_time = self.trigger.get_next_fire_time(previous, now - self.offset)
+        return next_time + self.offset if next_time else None
+
+    def __str__(self):
+        return f"{self.trigger} +{int(self.offset.total_seconds())}s"
+
+class TaskQueue:
+    """
+    Bounded priority queue of task runs drained by a fixed pool of workers,
+    so a burst of due tasks can't all fan out at once on the event loop.
+    Lower priority values run first; FIFO within a priority.
+    """
+    PRIORITY_MANUAL = 0
+    PRIORITY_CRON = 10
+
+    def __init__(self, concurrency: int = 4, max_size: int = 1000):
+        self.concurrency = concurrency
+        self.max_size = max_size
+        self.running = 0
+        self.processed = 0
+        self.missed_deadlines = 0
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: List[asyncio.Task] = []
+        self._queued_task_ids: Set[int] = set()
+        self._running_task_ids: Set[int] = set()
+        self._seq = itertools.count()
+        self._waits: Deque[float] = deque(maxlen=200)
+
+    def start(self):
+        if self._workers:
+            return
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue(maxsize=self.max_size)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+    def submit(
+        self,
+        task_id: int,
+        run: Callable[[], Awaitable[None]],
+        priority: int = PRIORITY_CRON,
+        deadline: Optional[float] = None
+    ) -> bool:
+        """
+        Queue a run; False if that task is already waiting or running, or the queue is full.
+        Within a priority, runs with the earliest deadline (epoch seconds) go first.
+        """
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue(maxsize=self.max_size)
+        if task_id in self._queued_task_ids or task_id in self._running_task_ids:
+            return False
+        try:
+            job = QueuedRun(task_id, run, deadline)
+            self._queue.put_nowait((priority, deadline or float("inf"), next(self._seq), job))
+        except asyncio.QueueFull:
+            logger.warning(f"Task queue full ({self.max_size}), dropping run of task {task_id}")
+            return False
+        self._queued_task_ids.add(task_id)
+        return True
+
+    async def _worker(self):
+        while True:
+            *_, job = await self._queue.get()
+            self._queued_task_ids.discard(job.task_id)
+            self._running_task_ids.add(job.task_id)
+            self._waits.append(time.monotonic() - job.enqueued_at)
+            self.running += 1
+            try:
+                await job.run()
+            except Exception as e:
+                logger.error(f"Queued run of task {job.task_id} failed: {e}")
+            finally:
+                if job.deadline is not None and time.time() > job.deadline:
+                    self.missed_deadlines += 1
+                    logger.warning(f"Run of task {job.task_id} finished after its delivery deadline")
+                self._running_task_ids.discard(job.task_id)
+                self.running -= 1
+                self.processed += 1
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        waits = list(self._waits)
+        return {
+            "depth": self._queue.qsize() if self._queue else 0,
+            "running": self.running,
+            "concurrency": self.concurrency,
+            "processed": self.processed,
+            "missed_deadlines": self.missed_deadlines,
+            "avg_wait_seconds": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            "max_wait_seconds": round(max(waits), 3) if waits else 0.0
+        }
+
 class SchedulerService:
     def __init__(self):
         # Use system local timezone
@@ -29,206 +159,609 @@ class SchedulerService:
             'max_instances': 1
         }
         self.scheduler = AsyncIOScheduler(timezone=local_tz, job_defaults=job_defaults)
+        self.queue = TaskQueue(
+            concurrency=int(os.getenv("TASK_RUN_CONCURRENCY", "4")),
+            max_size=int(os.getenv("TASK_QUEUE_MAX_SIZE", "1000"))
+        )
+        # Every worker serves HTTP and runs queued work, but only the lease
+        # holder keeps cron jobs, so each tick fires once across processes.
+        self.elector = LeaderElector(
+            lease_seconds=int(os.getenv("SCHEDULER_LEASE_SECONDS", "30")),
+            heartbeat_seconds=int(os.getenv("SCHEDULER_HEARTBEAT_SECONDS", "10")),
+            on_elected=self._on_elected,
+            on_demoted=self._on_demoted,
+            on_heartbeat=self._on_heartbeat
+        )
+        # Opt-in smoothing: tasks sharing a cron slot fire spread over this many
+        # seconds, each at a stable per-task offset, and are queued earliest-deadline-first
+        self.spread_seconds = int(os.getenv("SCHEDULER_SPREAD_SECONDS", "0"))
+        self.delivery_deadline_seconds = int(os.getenv(
+            "SCHEDULER_DELIVERY_DEADLINE_SECONDS", str(self.spread_seconds + 600) if self.spread_seconds else "0"
+        ))
+        # Failed runs are resumed automatically this many times, after a growing delay
+        self.max_auto_retries = int(os.getenv("TASK_MAX_AUTO_RETRIES", "2"))
+        self.retry_delay_seconds = int(os.getenv("TASK_RETRY_DELAY_SECONDS", "60"))
+        # Per-stage time budgets in seconds (0 = unlimited). A fetch that runs out
+        # reports the repos it finished; an AI summary that runs out is skipped.
+        self.stage_timeouts = {
+            stage: float(os.getenv(f"TASK_{stage.upper()}_TIMEOUT_SECONDS", default)) or None
+            for stage, default in (("fetch", "600"), ("summarize", "90"), ("deliver", "30"))
+        }
+        self._running: Dict[int, asyncio.Task] = {}
+        # Runs stopped through cancel_task(), as opposed to their worker being cancelled
+        self._cancel_requested: Set[asyncio.Task] = set()
+        # Log retention: raw payloads after LOG_RAW_RETENTION_DAYS, whole logs
+        # (rolled into daily totals) after LOG_RETENTION_DAYS; 0 keeps forever
+        self.maintenance = LogMaintenance(
+            raw_days=int(os.getenv("LOG_RAW_RETENTION_DAYS", "14")),
+            keep_days=int(os.getenv("LOG_RETENTION_DAYS", "180")),
+            batch_size=int(os.getenv("LOG_MAINTENANCE_BATCH_SIZE", "500")),
+            pause_seconds=float(os.getenv("LOG_MAINTENANCE_PAUSE_SECONDS", "0.2"))
+        )
+        self.maintenance_cron = os.getenv("LOG_MAINTENANCE_CRON", "30 3 * * *")
+        self._change_cursor = 0
+        # Syncs await the DB; one at a time so an older read can't be applied last
+        self._sync_lock = asyncio.Lock()
+        self._job_crons: Dict[int, str] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self.elector.is_leader
 
     def start(self):
+        self._loop = asyncio.get_running_loop()
         if not self.scheduler.running:
             self.scheduler.start()
+        self.queue.start()
+        self.elector.start()
 
     def stop(self):
+        self.elector.stop()
         if self.scheduler.running:
             self.scheduler.shutdown()
+        self.queue.stop()
+
+    async def _on_elected(self):
+        # A new leader has no jobs: replay the (compacted) changelog
+        self._change_cursor = 0
+        await run_in_db(self.compact_changes)
+        await self.sync_changes()
+        # Once now: finish moving payloads older versions stored inline (migration 4)
+        self.scheduler.add_job(self.maintenance.move_inline_raw, id="move_inline_raw", replace_existing=True)
+        if self.maintenance_cron:
+            self.scheduler.add_job(
+                self.maintenance.run,
+                CronTrigger.from_crontab(self.maintenance_cron, timezone=self.scheduler.timezone),
+                id="log_maintenance",
+                replace_existing=True
+            )
+
+    def _on_demoted(self):
+        for task_id in list(self._job_crons):
+            self.remove_task(task_id)
+        if self.scheduler.get_job("log_maintenance"):
+            self.scheduler.remove_job("log_maintenance")
+
+    async def _on_heartbeat(self):
+        await self.sync_changes()
+
+    @staticmethod
+    def validate_cron(cron_expression: str):
+        CronTrigger.from_crontab(cron_expression)
+
+    @staticmethod
+    def record_change(db: Session, task_id: int, action: str = "upsert"):
+        """Log a schedule change; the caller commits it together with the task."""
+        db.add(ScheduleChange(task_id=task_id, action=action))
+
+    @staticmethod
+    def compact_changes():
+        """Only the latest change per task matters for reconciling."""
+        with SessionLocal() as db:
+            latest = select(func.max(ScheduleChange.id)).group_by(ScheduleChange.task_id)
+            db.execute(delete(ScheduleChange).where(ScheduleChange.id.not_in(latest)))
+            db.commit()
+
+    def request_sync(self):
+        """Apply recorded changes now if this worker is the leader (callable from any thread)."""
+        if self._loop is not None and self.is_leader:
+            asyncio.run_coroutine_threadsafe(self.sync_changes(), self._loop)
+
+    @staticmethod
+    def _load_changes(cursor: int) -> Tuple[int, List[int], Dict[int, str]]:
+        """Changelog entries past `cursor`: (last id, changed task ids, cron of those still active)."""
+        with SessionLocal() as db:
+            # Re-read a few ids behind the cursor: on databases with concurrent
+            # writers, a lower id can commit after a higher one.
+            rows = (
+                db.query(ScheduleChange.id, ScheduleChange.task_id)
+                .filter(ScheduleChange.id > cursor - CHANGELOG_LOOKBACK)
+                .order_by(ScheduleChange.id)
+                .all()
+            )
+            if not rows:
+                return cursor, [], {}
+            task_ids = list({row.task_id for row in rows})
+            crons = {}
+            for i in range(0, len(task_ids), 500):
+                for task in db.query(ReportTask).filter(ReportTask.id.in_(task_ids[i:i + 500])).all():
+                    if task.is_active:
+                        crons[task.id] = task.cron_expression
+            return rows[-1].id, task_ids, crons
+
+    async def sync_changes(self):
+        """Reconcile the cron jobs of tasks that changed since the last poll."""
+        async with self._sync_lock:
+            if not self.is_leader:
+                return
+            last_id, task_ids, crons = await run_in_db(self._load_changes, self._change_cursor)
+            if not self.is_leader:
+                return
+            self._change_cursor = max(self._change_cursor, last_id)
+            self._apply_changes(task_ids, crons)
+
+    def _apply_changes(self, task_ids: List[int], crons: Dict[int, str]):
+        # APScheduler is only touched from the loop
+        for task_id in task_ids:
+            cron_expression = crons.get(task_id)
+            if cron_expression is None:
+                self.remove_task(task_id)
+            elif self._job_crons.get(task_id) != cron_expression:
+                try:
+                    self.add_or_update_task(task_id, cron_expression)
+                except Exception as e:
+                    logger.error(f"Failed to load task {task_id}: {e}")
+
+    def enqueue_task(self, task_id: int, manual: bool = False, deadline: Optional[float] = None) -> bool:
+        priority = TaskQueue.PRIORITY_MANUAL if manual else TaskQueue.PRIORITY_CRON
+        return self.queue.submit(task_id, lambda: self.execute_task(task_id, manual=manual), priority, deadline)
+
+    async def _enqueue_scheduled(self, task_id: int, offset_seconds: int = 0):
+        # Cron jobs only hand the run to the queue; the workers do the actual work.
+        # The deadline counts from the nominal cron slot, before any spreading.
+        deadline = None
+        if self.delivery_deadline_seconds:
+            deadline = time.time() - offset_seconds + self.delivery_deadline_seconds
+        self.enqueue_task(task_id, deadline=deadline)
+
+    def fire_offset(self, task_id: int) -> int:
+        """Deterministic per-task delay inside the spread window (0 when spreading is off)."""
+        if self.spread_seconds <= 0:
+            return 0
+        digest = hashlib.sha256(f"task:{task_id}".encode()).hexdigest()
+        return int(digest, 16) % self.spread_seconds
+
+    def build_trigger(self, task_id: int, cron_expression: str) -> BaseTrigger:
+        trigger = CronTrigger.from_crontab(cron_expression, timezone=self.scheduler.timezone)
+        offset = self.fire_offset(task_id)
+        return OffsetTrigger(trigger, offset) if offset else trigger
+
+    def next_fire_time(self, task_id: int, cron_expression: str) -> Optional[datetime]:
+        """Effective next fire time, including the spread offset."""
+        try:
+            trigger = self.build_trigger(task_id, cron_expression)
+        except ValueError:
+            return None
+        return trigger.get_next_fire_time(None, datetime.now(self.scheduler.timezone))
 
     def add_or_update_task(self, task_id: int, cron_expression: str):
+        # Parse first so invalid expressions are rejected on every worker
+        trigger = self.build_trigger(task_id, cron_expression)
+        if not self.is_leader:
+            return
+
         job_id = f"task_{task_id}"
         if self.scheduler.get_job(job_id):
             self.scheduler.remove_job(job_id)
         
         self.scheduler.add_job(
-            self.execute_task,
-            CronTrigger.from_crontab(cron_expression),
+            self._enqueue_scheduled,
+            trigger,
             id=job_id,
-            args=[task_id],
+            args=[task_id, self.fire_offset(task_id)],
             misfire_grace_time=60  # If missed by > 60s, don't run
         )
+        self._job_crons[task_id] = cron_expression
 
     def remove_task(self, task_id: int):
         job_id = f"task_{task_id}"
         if self.scheduler.get_job(job_id):
             self.scheduler.remove_job(job_id)
+        self._job_crons.pop(task_id, None)
 
-    async def execute_task(self, task_id: int):
-        # We use a context manager to ensure session is closed and transactions are handled
-        with SessionLocal() as db:
-            log_id = None
+    async def execute_task(self, task_id: int, manual: bool = False, resume_log_id: Optional[int] = None):
+        # Every blocking DB call goes through the DB executor so commits never stall
+        # the loop serving HTTP. Objects stay loaded across commits (no lazy refresh
+        # on the loop); the session is only ever used by one call at a time.
+        with SessionLocal(expire_on_commit=False) as db:
+            log_id = resume_log_id
+            run = None
+            requested = False
             try:
-                # 1. Acquire Distributed Lock (Atomic Update)
-                now = datetime.now().astimezone()
-                lock_threshold = now - timedelta(seconds=50)
-
-                # Attempt to claim this task run
-                stmt = (
-                    update(ReportTask)
-                    .where(ReportTask.id == task_id)
-                    .where(ReportTask.is_active)
-                    .where(or_(
-                        ReportTask.last_run_at.is_(None),
-                        ReportTask.last_run_at < lock_threshold
-                    ))
-                    .values(last_run_at=now)
-                )
-                result = db.execute(stmt)
+                log_id = await run_in_db(self._claim_run, db, task_id, manual, resume_log_id)
+                if log_id is None:
+                    run_events.publish(task_id, "skipped", {"message": "任务未启用或刚刚执行过"})
+                    return
+                run_events.publish(task_id, "started", {"log_id": log_id})
+
+                # The stages run as their own asyncio task so cancel_task() can stop
+                # this run without cancelling the queue worker awaiting it
+                run = asyncio.create_task(self._load_and_run(db, task_id, log_id))
+                self._running[task_id] = run
+                try:
+                    await run
+                finally:
+                    self._running.pop(task_id, None)
+                    requested = run in self._cancel_requested
+                    self._cancel_requested.discard(run)
+                    if not run.done():
+                        # The worker itself was cancelled (shutdown)
+                        run.cancel()
+                        await asyncio.wait([run])
+
+            except (asyncio.CancelledError, RunCancelled) as e:
+                if isinstance(e, asyncio.CancelledError) and (not requested or asyncio.current_task().cancelling()):
+                    # The worker itself is being cancelled (shutdown): not a user cancel
+                    raise
+                logger.info(f"Run of task {task_id} was cancelled")
+                await run_in_db(self._record_cancelled, db, log_id)
+                run_events.publish(task_id, "cancelled", {"log_id": log_id})
+
+            except Exception as e:
+                logger.error(f"Error executing task {task_id}: {e}")
+                error_details = traceback.format_exc()
+                attempts = await run_in_db(self._record_failure, db, task_id, log_id, str(e), error_details)
+                if attempts is not None:
+                    self._schedule_retry(task_id, log_id, attempts)
+                run_events.publish(task_id, "error", {"log_id": log_id, "message": str(e)})
+
+    async def _load_and_run(self, db: Session, task_id: int, log_id: int):
+        # 3. Fetch task and its configs (for the rest of the operation)
+        task = await run_in_db(self._load_task, db, task_id)
+        if task:
+            await self._run_stages(db, task, log_id)
+        else:
+            run_events.publish(task_id, "skipped", {"message": "任务不存在"})
+
+    def cancel_task(self, task_id: int) -> bool:
+        """Cancel the task's run if it is executing in this process."""
+        run = self._running.get(task_id)
+        if run is None or run.done():
+            return False
+        self._cancel_requested.add(run)
+        run.cancel()
+        return True
+
+    @staticmethod
+    def _claim_run(db: Session, task_id: int, manual: bool, resume_log_id: Optional[int]) -> Optional[int]:
+        """Claim a new run or reopen a failed one; returns the log id, None if there is nothing to run."""
+        if resume_log_id is not None:
+            # Resume a failed or cancelled run from its first incomplete stage
+            log = db.query(TaskLog).filter(TaskLog.id == resume_log_id, TaskLog.task_id == task_id).first()
+            if not log or log.status not in ("failed", "cancelled"):
+                return None
+            log.status = "running"
+            log.attempts = (log.attempts or 1) + 1
+            db.commit()
+            return log.id
+
+        # 1. Claim the run (Atomic Update). Cron ticks only fire on the leader;
+        # the short window still guards against a double fire during failover.
+        now = datetime.now().astimezone()
+        lock_threshold = now - timedelta(seconds=50)
+
+        stmt = (
+            update(ReportTask)
+            .where(ReportTask.id == task_id)
+            .where(ReportTask.is_active)
+            .values(last_run_at=now)
+        )
+        if not manual:
+            stmt = stmt.where(or_(
+                ReportTask.last_run_at.is_(None),
+                ReportTask.last_run_at < lock_threshold
+            ))
+        result = db.execute(stmt)
+        db.commit()
+
+        if result.rowcount == 0:
+            # Locked by another worker or already run
+            return None
+
+        # 2. Create initial log entry
+        new_log = TaskLog(
+            task_id=task_id,
+            status="running",
+            summary="任务执行中...",
+            commit_count=0,
+            attempts=1
+        )
+        db.add(new_log)
+        db.commit()
+        return new_log.id
+
+    @staticmethod
+    def checkpoints_intact(db: Session, log: TaskLog) -> bool:
+        """False when log retention has purged outputs a resumed run would start from."""
+        start = ReportPipeline.next_stage(log.stage)
+        if start >= 1 and db.query(TaskLogBlob.log_id).filter(TaskLogBlob.log_id == log.id).first() is None:
+            return False
+        if start >= 2 and log.report_markdown is None:
+            return False
+        return True
+
+    @staticmethod
+    def _load_task(db: Session, task_id: int) -> Optional[ReportTask]:
+        # Load the configs eagerly so the stages never lazy-load on the loop
+        return (
+            db.query(ReportTask)
+            .options(
+                joinedload(ReportTask.gitea_config),
+                joinedload(ReportTask.notify_config),
+                joinedload(ReportTask.ai_config)
+            )
+            .filter(ReportTask.id == task_id)
+            .with_for_update()
+            .first()
+        )
+
+    @staticmethod
+    def _checkpoint(db: Session, log: TaskLog, **values):
+        for key, value in values.items():
+            setattr(log, key, value)
+        db.commit()
+
+    @staticmethod
+    def _ensure_not_cancelled(db: Session, log_id: int):
+        """Between stages: honour a cancel requested from another process."""
+        if db.query(TaskLog.status).filter(TaskLog.id == log_id).scalar() == "cancelling":
+            raise RunCancelled()
+
+    @staticmethod
+    def _record_cancelled(db: Session, log_id: int):
+        db.rollback()
+        log = db.query(TaskLog).filter(TaskLog.id == log_id).first()
+        if log:
+            log.status = "cancelled"
+            log.summary = "任务已取消"
+            db.commit()
+
+    @staticmethod
+    def _record_failure(db: Session, task_id: int, log_id: Optional[int], error: str, error_details: str) -> Optional[int]:
+        """Mark the run failed; returns its attempt count when it may be retried."""
+        db.rollback()
+        if log_id:
+            log = db.query(TaskLog).filter(TaskLog.id == log_id).first()
+            if log:
+                log.status = "failed"
+                log.summary = f"执行异常: {error}"
+                log.log_details = error_details
                 db.commit()
+                return log.attempts or 1
+        else:
+            db.add(TaskLog(
+                task_id=task_id,
+                status="failed",
+                summary=f"初始化异常: {error}",
+                log_details=error_details
+            ))
+            db.commit()
+        return None
 
-                if result.rowcount == 0:
-                    # Locked by another worker or already run
-                    return
+    async def _run_stages(self, db: Session, task: ReportTask, log_id: int):
+        """Run every stage after the log's last checkpoint, committing each one."""
+        log = await run_in_db(lambda: db.query(TaskLog).filter(TaskLog.id == log_id).first())
+        start = ReportPipeline.next_stage(log.stage)
+        if not await run_in_db(self.checkpoints_intact, db, log):
+            raise RuntimeError("该运行的检查点已被日志保留策略清理，无法续跑")
+        # Progress for SSE subscribers (a no-op when nobody is watching)
+        progress = run_events.reporter(task.id)
 
-                # 2. Fetch task with row-level lock (for the rest of the operation)
-                task = db.query(ReportTask).filter(ReportTask.id == task_id).with_for_update().first()
-                if not task:
-                    return
+        if start <= 0:
+            progress("stage", {"stage": "fetch"})
+            gitea_cfg = task.gitea_config
+            gitea_service = GiteaService(gitea_cfg.base_url, gitea_cfg.token)
+            since, until = ReportPipeline.report_window(task.report_days)
+            # Tasks that differ only in AI prompt or notify target share one collection
+            key = shared_collections.fingerprint(
+                gitea_cfg.id, task.scope_type, task.target_repos, task.report_days, since
+            )
 
-                # 3. Create initial log entry
-                new_log = TaskLog(
-                    task_id=task.id,
-                    status="running",
-                    summary="任务执行中...",
-                    commit_count=0
+            async def collect():
+                # Outlives this run if it is cancelled while others still wait on
+                # it, so it must not borrow this run's session for the marks
+                with SessionLocal() as marks_db:
+                    return await ReportPipeline.fetch(
+                        gitea_service, gitea_cfg.id, task.scope_type, task.target_repos, since, until,
+                        db=marks_db, timeout=self.stage_timeouts["fetch"], progress=progress
+                    )
+
+            try:
+                fetched, shared = await shared_collections.collect(key, collect)
+            except asyncio.TimeoutError:
+                raise RuntimeError(f"拉取 Gitea 数据超时（{self.stage_timeouts['fetch']:.0f} 秒）")
+            if shared:
+                logger.info(f"Task {task.id} reused the collection for {key}")
+            else:
+                logger.info(
+                    f"Task {task.id} Gitea cache: {gitea_service.cache_stats['hits']} hits, "
+                    f"{gitea_service.cache_stats['misses']} misses, "
+                    f"{gitea_service.cache_stats['coalesced']} coalesced"
                 )
-                db.add(new_log)
-                db.commit()
-                db.refresh(new_log)
-                log_id = new_log.id
+            # The raw payload is the largest write of a run: serialise and compress it off the loop too
+            def save_fetch():
+                LogBlobStore.save(db, log.id, ReportPipeline.dump(fetched))
+                self._checkpoint(db, log, commit_count=fetched["total_commits"], stage="fetch")
+            await run_in_db(save_fetch)
+            progress("fetched", {"commit_count": fetched["total_commits"], "repo_count": len(fetched["repo_data"]), "shared": shared})
+        else:
+            fetched = await run_in_db(lambda: json.loads(LogBlobStore.load_text(db, log.id)))
+
+        if start <= 1:
+            await run_in_db(self._ensure_not_cancelled, db, log_id)
+            await run_in_db(self._checkpoint, db, log, report_markdown=ReportPipeline.render(fetched), stage="render")
+            progress("rendered", {"report": log.report_markdown})
+
+        if start <= 2:
+            await run_in_db(self._ensure_not_cancelled, db, log_id)
+            ai_summary = log.ai_summary
+            if task.is_ai_enabled and task.ai_config:
+                progress("stage", {"stage": "summarize"})
+                try:
+                    ai_summary = await asyncio.wait_for(
+                        ReportPipeline.summarize(
+                            log.report_markdown, task.ai_config, task.ai_system_prompt,
+                            progress=progress if run_events.listening(task.id) else None
+                        ),
+                        self.stage_timeouts["summarize"]
+                    )
+                except asyncio.TimeoutError:
+                    # Better a report without a summary than no report at all
+                    logger.warning(f"Task {task.id} AI summary timed out, sending the raw report")
+            await run_in_db(self._checkpoint, db, log, ai_summary=ai_summary, stage="summarize")
 
+        await run_in_db(self._ensure_not_cancelled, db, log_id)
+        progress("stage", {"stage": "deliver"})
+        markdown_report = ReportPipeline.compose(log.report_markdown, log.ai_summary)
+        try:
+            success = await asyncio.wait_for(
+                ReportPipeline.deliver(task.notify_config.webhook_url, markdown_report),
+                self.stage_timeouts["deliver"]
+            )
+        except asyncio.TimeoutError:
+            success = False
+
+        # Update log to success or failed (the fetch/render/summarize checkpoints are kept)
+        if success:
+            summary = f"执行完成：共统计到 {log.commit_count} 个提交{ReportPipeline.fetch_gaps(fetched)}"
+            await run_in_db(
+                self._checkpoint, db, log,
+                log_details=markdown_report[:5000],
+                stage="deliver",
+                status="success",
+                summary=summary
+            )
+        else:
+            await run_in_db(
+                self._checkpoint, db, log,
+                log_details=markdown_report[:5000],
+                status="failed",
+                summary="推送 Webhook 失败"
+            )
+            self._schedule_retry(task.id, log.id, log.attempts or 1)
+        progress("delivered", {"success": success})
+        progress("done", {"log_id": log.id, "status": log.status, "summary": log.summary})
+
+    def _schedule_retry(self, task_id: int, log_id: int, attempts: int):
+        if attempts > self.max_auto_retries:
+            return
+        delay = self.retry_delay_seconds * attempts
+        self.scheduler.add_job(
+            self.retry_run,
+            DateTrigger(run_date=datetime.now(self.scheduler.timezone) + timedelta(seconds=delay)),
+            args=[task_id, log_id],
+            id=f"retry_{log_id}",
+            replace_existing=True
+        )
+
+    async def retry_run(self, task_id: int, log_id: int) -> bool:
+        """Queue a failed run to resume from its first incomplete stage."""
+        return self.queue.submit(
+            task_id,
+            lambda: self.execute_task(task_id, manual=True, resume_log_id=log_id),
+            TaskQueue.PRIORITY_MANUAL
+        )
+
+    def enqueue_backfill(self, task_id: int, days: int, deliver: bool = False, ai: bool = False) -> bool:
+        return self.queue.submit(
+            task_id,
+            lambda: self.backfill_task(task_id, days, deliver=deliver, ai=ai),
+            TaskQueue.PRIORITY_MANUAL
+        )
+
+    async def backfill_task(self, task_id: int, days: int, deliver: bool = False, ai: bool = False):
+        """
+        Regenerate the task's reports for the last `days` days from a single fetch
+        of the whole range, writing one TaskLog per day (dated at the day's end).
+        """
+        with SessionLocal(expire_on_commit=False) as db:
+            progress = run_events.reporter(task_id)
+            try:
+                task = await run_in_db(self._load_task, db, task_id)
+                if not task:
+                    run_events.publish(task_id, "skipped", {"message": "任务不存在"})
+                    return
+                periods = ReportPipeline.backfill_periods(days)
                 gitea_cfg = task.gitea_config
-                notify_cfg = task.notify_config
                 gitea_service = GiteaService(gitea_cfg.base_url, gitea_cfg.token)
-                
-                # Use Aware Local Time for calculations
-                now = datetime.now().astimezone()
-                since = (now - timedelta(days=task.report_days)).replace(hour=0, minute=0, second=0, microsecond=0)
-                until = now
-
-                markdown_report = ""
-                total_commits = 0
-                raw_data_obj = {}
-
-                if task.scope_type == "user":
-                    user_info = await gitea_service.get_my_info()
-                    username = user_info.get("login")
-                    user_id = user_info.get("id")
-                    full_name = user_info.get("full_name") or username
-                    activities = await gitea_service.get_user_activities(username, since, user_id=user_id)
-                    
-                    raw_data_obj["activities"] = activities
-                    
-                    # Group activities and fetch detailed commits for pushes
-                    data_by_repo = {}
-                    for act in activities:
-                        repo_name = act["repo"]["full_name"]
-                        if repo_name not in data_by_repo:
-                            data_by_repo[repo_name] = {"activities": [], "detailed_commits": []}
-                        data_by_repo[repo_name]["activities"].append(act)
-                    
-                    # For repos with pushes, get actual commit messages
-                    for repo_name, repo_data in data_by_repo.items():
-                        if any(a["op_type"] in ["commit_repo", "push_repo"] for a in repo_data["activities"]):
-                            # Fetch commits by this user in this repo
-                            all_commits = await gitea_service.get_commits_for_repo(repo_name, since, until)
-                            # Filter by user (some instances might return all commits in range)
-                            my_commits = [c for c in all_commits if c["author"] == full_name or c["author"] == username]
-                            repo_data["detailed_commits"] = my_commits
-                            total_commits += len(my_commits)
-                    
-                    markdown_report = gitea_service.generate_activity_report(since, data_by_repo, full_name)
-                else:
-                    # ... existing repos logic ...
-                    # (I will wrap this part to store in raw_data_obj as well)
-                    repos_to_check = []
-                    if task.scope_type in ["all", "owner"]:
-                        repos_to_check = await gitea_service.get_all_repos(scope=task.scope_type)
-                    else:
-                        repos_to_check = task.target_repos or []
-
-                    semaphore = asyncio.Semaphore(10)
-
-                    async def fetch_repo_data(repo):
-                        async with semaphore:
-                            c, i, p = await asyncio.gather(
-                                gitea_service.get_commits_for_repo(repo, since, until),
-                                gitea_service.get_open_issues(repo),
-                                gitea_service.get_open_prs(repo)
+
+                # No db: a backfill must not move the incremental-sync high-water marks
+                progress("stage", {"stage": "fetch"})
+                fetched = await ReportPipeline.fetch(
+                    gitea_service, gitea_cfg.id, task.scope_type, task.target_repos,
+                    periods[0][0], periods[-1][1], timeout=self.stage_timeouts["fetch"], progress=progress
+                )
+                progress("fetched", {"commit_count": fetched["total_commits"], "repo_count": len(fetched["repo_data"])})
+
+                log_ids = []
+                for i, (since, until) in enumerate(periods):
+                    part = ReportPipeline.partition(fetched, since, until)
+                    report = ReportPipeline.render(part)
+                    ai_summary = None
+                    if ai and task.is_ai_enabled and task.ai_config:
+                        try:
+                            ai_summary = await asyncio.wait_for(
+                                ReportPipeline.summarize(report, task.ai_config, task.ai_system_prompt),
+                                self.stage_timeouts["summarize"]
                             )
-                            return repo, c, i, p
-
-                    results = await asyncio.gather(*(fetch_repo_data(repo) for repo in repos_to_check))
-
-                    data_by_repo = {}
-                    for repo, repo_commits, repo_issues, repo_prs in results:
-                        if repo_commits or repo_issues or repo_prs:
-                            data_by_repo[repo] = {
-                                "commits": repo_commits,
-                                "issues": repo_issues,
-                                "prs": repo_prs
-                            }
-                            total_commits += len(repo_commits)
-                    
-                    raw_data_obj["repo_data"] = data_by_repo
-                    markdown_report = gitea_service.generate_markdown_report(since, data_by_repo)
-                
-                if task.is_ai_enabled and task.ai_config:
-                    ai_cfg = task.ai_config
-                    system_prompt = task.ai_system_prompt or ai_cfg.system_prompt
-                    ai_summary = await AIService.summarize_report(
-                        api_base=ai_cfg.api_base,
-                        api_key=ai_cfg.api_key,
-                        model=ai_cfg.model,
-                        content=markdown_report,
-                        system_prompt=system_prompt
+                        except asyncio.TimeoutError:
+                            logger.warning(f"Task {task_id} backfill AI summary for {since.date()} timed out")
+                    content = ReportPipeline.compose(report, ai_summary)
+
+                    summary = (
+                        f"补录 {since.strftime('%Y-%m-%d')}：共统计到 {part['total_commits']} 个提交"
+                        f"{ReportPipeline.fetch_gaps(fetched)}"
                     )
-                    markdown_report = f"{ai_summary}\n\n{markdown_report}"
-
-                success = await WebhookService.send_wecom_markdown(notify_cfg.webhook_url, markdown_report)
-                
-                # 2. Update log to success or partial failed
-                status = "success" if success else "failed"
-                summary = f"执行完成：共统计到 {total_commits} 个提交" if success else "推送 Webhook 失败"
-                
-                def datetime_handler(x):
-                    if isinstance(x, datetime):
-                        return x.isoformat()
-                    raise TypeError("Unknown type")
-
-                log = db.query(TaskLog).filter(TaskLog.id == log_id).first()
-                if log:
-                    log.status = status
-                    log.commit_count = total_commits
-                    log.summary = summary
-                    log.log_details = markdown_report[:5000]
-                    log.raw_data = json.dumps(raw_data_obj, default=datetime_handler, ensure_ascii=False)
-                    db.commit()
-                
-            except Exception as e:
-                logger.error(f"Error executing task {task_id}: {e}")
-                error_details = traceback.format_exc()
-                
-                if log_id:
-                    log = db.query(TaskLog).filter(TaskLog.id == log_id).first()
-                    if log:
-                        log.status = "failed"
-                        log.summary = f"执行异常: {str(e)}"
-                        log.log_details = error_details
-                        db.commit()
-                else:
+                    status, stage = "success", "summarize"
+                    if deliver:
+                        try:
+                            delivered = await asyncio.wait_for(
+                                ReportPipeline.deliver(task.notify_config.webhook_url, content),
+                                self.stage_timeouts["deliver"]
+                            )
+                        except asyncio.TimeoutError:
+                            delivered = False
+                        if delivered:
+                            stage = "deliver"
+                        else:
+                            status, summary = "failed", f"{summary}，推送 Webhook 失败"
+
                     log = TaskLog(
                         task_id=task_id,
-                        status="failed",
-                        summary=f"初始化异常: {str(e)}",
-                        log_details=error_details
+                        status=status,
+                        summary=summary,
+                        commit_count=part["total_commits"],
+                        stage=stage,
+                        report_markdown=report,
+                        ai_summary=ai_summary,
+                        log_details=content[:5000],
+                        created_at=until.astimezone(timezone.utc).replace(tzinfo=None)
                     )
-                    db.add(log)
-                    db.commit()
-            finally:
-                db.close()
+                    await run_in_db(lambda: self._add_log(db, log, ReportPipeline.dump(part)))
+                    log_ids.append(log.id)
+                    progress("period", {"date": since.strftime("%Y-%m-%d"), "done": i + 1, "total": len(periods), "log_id": log.id})
+
+                progress("done", {"status": "success", "log_ids": log_ids, "summary": f"补录完成：{len(periods)} 天"})
+            except Exception as e:
+                logger.error(f"Backfill of task {task_id} failed: {e}")
+                run_events.publish(task_id, "error", {"message": str(e)})
+
+    @staticmethod
+    def _add_log(db: Session, log: TaskLog, raw_data: str):
+        db.add(log)
+        db.flush()
+        LogBlobStore.save(db, log.id, raw_data)
+        db.commit()
 
 scheduler_service = SchedulerService()
@@ -0,0 +1,127 @@
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from ..models import RepoSyncState
+
+# Commits are filtered by author date, which can trail the push by a while,
+# so delta fetches re-read a slice before the previous high-water mark.
+COMMIT_OVERLAP = timedelta(minutes=int(os.getenv("SYNC_COMMIT_OVERLAP_MINUTES", "360")))
+RETENTION = timedelta(days=int(os.getenv("SYNC_RETENTION_DAYS", "31")))
+# Fetch starts are rounded down to this step: the start is part of the request
+# URL, so runs with the same window then share cached and in-flight requests
+COMMIT_START_STEP = timedelta(minutes=int(os.getenv("SYNC_COMMIT_START_STEP_MINUTES", "15")))
+
+
+def _to_db(dt: Optional[datetime]) -> Optional[datetime]:
+    # SQLite drops tzinfo, so always persist naive UTC
+    if dt is None:
+        return None
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _from_db(dt: Optional[datetime]) -> Optional[datetime]:
+    if dt is None:
+        return None
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+
+def _floor(dt: datetime, step: timedelta) -> datetime:
+    return dt - timedelta(seconds=dt.timestamp() % step.total_seconds())
+
+
+def commit_fetch_window(mark: Dict[str, Any], since: datetime, updated_at: Optional[datetime] = None) -> Tuple[Optional[datetime], bool]:
+    """
+    Where the commit fetch for a repo has to start, given its stored mark.
+    Returns (start, is_delta); start is None when the repo has not been
+    pushed to since the mark, so the stored commits are already complete.
+    """
+    window_start, synced_until = mark.get("window_start"), mark.get("synced_until")
+    if window_start is None or synced_until is None or window_start > since or synced_until < since:
+        return _floor(since, COMMIT_START_STEP), False
+    if updated_at is not None and updated_at <= synced_until:
+        return None, True
+    return _floor(max(since, synced_until - COMMIT_OVERLAP), COMMIT_START_STEP), True
+
+
+def merge_commits(
+    mark: Dict[str, Any],
+    fetched: List[Dict[str, Any]],
+    is_delta: bool,
+    since: datetime,
+    until: datetime,
+    skipped: bool = False
+) -> List[Dict[str, Any]]:
+    """
+    Fold freshly fetched commits into the mark and return the ones inside [since, until].
+    `skipped` means commit_fetch_window found nothing to fetch: the decision rests on a
+    listing that may be minutes old, so the high-water mark is not moved forward.
+    """
+    by_sha = {}
+    if is_delta:
+        for c in mark.get("commits") or []:
+            by_sha[c["sha"]] = {**c, "date": datetime.fromisoformat(c["date"])}
+    for c in fetched:
+        by_sha[c["sha"]] = c
+
+    cutoff = min(until - RETENTION, since)
+    commits = sorted((c for c in by_sha.values() if c["date"] >= cutoff), key=lambda c: c["date"], reverse=True)
+
+    mark["window_start"] = max(mark["window_start"] if is_delta else since, cutoff)
+    if not skipped:
+        mark["synced_until"] = until
+    mark["commits"] = [{**c, "date": c["date"].isoformat()} for c in commits]
+    if commits:
+        mark["last_commit_sha"] = commits[0]["sha"]
+        mark["last_commit_at"] = commits[0]["date"]
+    return [c for c in commits if since <= c["date"] <= until]
+
+
+def merge_open_items(snapshot: List[Dict[str, Any]], updates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Apply issue/PR updates (any state) to a snapshot of open items."""
+    items = {item["id"]: item for item in snapshot}
+    for item in updates:
+        if item.get("state") == "open":
+            items[item["id"]] = item
+        else:
+            items.pop(item["id"], None)
+    return sorted(items.values(), key=lambda i: i["id"], reverse=True)
+
+
+class RepoSyncStore:
+    """Loads and saves per-(GiteaConfig, repo) high-water marks as plain dicts."""
+    FIELDS = ("last_commit_sha", "commits", "issues", "prs")
+    TIME_FIELDS = ("last_commit_at", "window_start", "synced_until", "issues_synced_at")
+
+    @staticmethod
+    def load(db: Session, gitea_config_id: int, repos: List[str]) -> Dict[str, Dict[str, Any]]:
+        wanted = set(repos)
+        marks = {}
+        for row in db.query(RepoSyncState).filter(RepoSyncState.gitea_config_id == gitea_config_id).all():
+            if row.repo_full_name not in wanted:
+                continue
+            mark = {f: getattr(row, f) for f in RepoSyncStore.FIELDS}
+            mark.update({f: _from_db(getattr(row, f)) for f in RepoSyncStore.TIME_FIELDS})
+            marks[row.repo_full_name] = mark
+        return marks
+
+    @staticmethod
+    def save(db: Session, gitea_config_id: int, marks: Dict[str, Dict[str, Any]]):
+        rows = {
+            row.repo_full_name: row
+            for row in db.query(RepoSyncState).filter(RepoSyncState.gitea_config_id == gitea_config_id).all()
+        }
+        for repo, mark in marks.items():
+            if not mark:
+                continue
+            row = rows.get(repo)
+            if row is None:
+                row = RepoSyncState(gitea_config_id=gitea_config_id, repo_full_name=repo)
+                db.add(row)
+            for f in RepoSyncStore.FIELDS:
+                if f in mark:
+                    setattr(row, f, mark[f])
+            for f in RepoSyncStore.TIME_FIELDS:
+                if f in mark:
+                    setattr(row, f, _to_db(mark[f]))
+        db.commit()
@@ -0,0 +1,51 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+import httpx
+from .core.http_client import HttpClientManager
+from .core.http_cache import response_cache
+from .core.rate_limit import host_limiters
+from .services.gitea import GiteaService
+
+SINCE = datetime(2024, 5, 9, tzinfo=timezone.utc)
+UNTIL = datetime(2024, 5, 10, tzinfo=timezone.utc)
+
+def _push(repo, commits, length=None, ref="refs/heads/main"):
+    content = {"Commits": commits, "Len": length if length is not None else len(commits)}
+    return {"op_type": "commit_repo", "repo": {"full_name": repo}, "ref_name": ref, "content": json.dumps(content)}
+
+def _pushed_commit(sha, author="Alice", message="fix"):
+    return {"Sha1": sha * 40, "Message": message + "\n", "AuthorName": author,
+            "AuthorEmail": "", "Timestamp": "2024-05-09T10:00:00Z"}
+
+def test_push_payload_commits_skip_the_listing():
+    listed = []
+
+    def handler(request: httpx.Request):
+        listed.append((request.url.path, request.url.params.get("sha")))
+        commit = {
+            "sha": "c" * 40, "html_url": "", "author": {"full_name": "Alice"},
+            "commit": {"message": "listed", "author": {"name": "alice", "date": "2024-05-09T11:00:00Z"}}
+        }
+        return httpx.Response(200, json=[commit])
+
+    activities = [
+        _push("o/complete", [_pushed_commit("a"), _pushed_commit("b", author="Mallory")]),
+        _push("o/truncated", [_pushed_commit("d")], length=8, ref="refs/heads/dev"),
+    ]
+
+    async def run():
+        HttpClientManager._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            service = GiteaService("https://git.example.com", "token")
+            return await service.collect_activity_data(activities, SINCE, UNTIL, {"login": "alice", "full_name": "Alice"})
+        finally:
+            await HttpClientManager.close_client()
+            HttpClientManager._client = None
+
+    response_cache.clear()
+    host_limiters.clear()
+    data = asyncio.run(run())
+    assert [c["sha"] for c in data["o/complete"]["detailed_commits"]] == ["aaaaaaa"]
+    assert [c["message"] for c in data["o/truncated"]["detailed_commits"]] == ["listed"]
+    assert listed == [("/api/v1/repos/o/truncated/commits", "dev")]
@@ -0,0 +1,44 @@
+import asyncio
+import threading
+import time
+from sqlalchemy import text
+from .database import create_db_engine, run_in_db
+
+def test_run_in_db_keeps_blocking_calls_off_the_loop():
+    ticks = []
+
+    def blocking_query():
+        time.sleep(0.05)
+        return threading.current_thread().name
+
+    async def heartbeat():
+        for _ in range(4):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def run():
+        result, _ = await asyncio.gather(run_in_db(blocking_query), heartbeat())
+        return result
+
+    thread_name = asyncio.run(run())
+    assert thread_name.startswith("db")
+    # The loop kept ticking while the "query" blocked its thread
+    assert len(ticks) == 4 and ticks[-1] - ticks[0] < 0.05
+
+def test_sqlite_profile_applies_to_every_connection(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'profile.db'}")
+    try:
+        with engine.connect() as first, engine.connect() as second:
+            for conn in (first, second):
+                assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+                assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+                assert conn.execute(text("PRAGMA busy_timeout")).scalar() > 0
+            # Set before the file was initialised, so it stuck
+            assert first.execute(text("PRAGMA auto_vacuum")).scalar() == 2
+    finally:
+        engine.dispose()
+
+    # In-memory databases keep the driver defaults
+    memory = create_db_engine("sqlite://")
+    with memory.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "memory"
@@ -0,0 +1,66 @@
+import asyncio
+import httpx
+from .core.http_client import HttpClientManager
+from .core.http_cache import response_cache
+from .core.rate_limit import host_limiters
+from .services.gitea import GiteaService
+
+def test_conditional_get_reuses_cached_body():
+    response_cache.clear()
+    host_limiters.clear()
+    seen_headers = []
+
+    def handler(request: httpx.Request):
+        seen_headers.append(dict(request.headers))
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304, headers={"ETag": '"v1"'})
+        return httpx.Response(200, headers={"ETag": '"v1"'}, json={"login": "alice", "id": 1})
+
+    async def run():
+        HttpClientManager._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            first = GiteaService("https://git.example.com", "token")
+            assert (await first.get_my_info())["login"] == "alice"
+            assert first.cache_stats == {"hits": 0, "misses": 1, "coalesced": 0}
+
+            second = GiteaService("https://git.example.com", "token")
+            assert (await second.get_my_info())["login"] == "alice"
+            assert second.cache_stats == {"hits": 1, "misses": 0, "coalesced": 0}
+
+            # A different token must never see another token's cached body
+            other = GiteaService("https://git.example.com", "other-token")
+            await other.get_my_info()
+            assert other.cache_stats == {"hits": 0, "misses": 1, "coalesced": 0}
+        finally:
+            await HttpClientManager.close_client()
+            HttpClientManager._client = None
+
+    asyncio.run(run())
+    assert "if-none-match" not in seen_headers[0]
+    assert seen_headers[1]["if-none-match"] == '"v1"'
+    assert "if-none-match" not in seen_headers[2]
+
+def test_identical_concurrent_gets_share_one_request():
+    response_cache.clear()
+    host_limiters.clear()
+    calls = []
+
+    async def handler(request: httpx.Request):
+        calls.append(request.url.path)
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={"login": "alice"})
+
+    async def run():
+        HttpClientManager._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            services = [GiteaService("https://git.example.com", "token") for _ in range(3)]
+            infos = await asyncio.gather(*(s.get_my_info() for s in services))
+            return services, infos
+        finally:
+            await HttpClientManager.close_client()
+            HttpClientManager._client = None
+
+    services, infos = asyncio.run(run())
+    assert all(info["login"] == "alice" for info in infos)
+    assert len(calls) == 1
+    assert sum(s.cache_stats["coalesced"] for s in services) == 2
@@ -0,0 +1,182 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import httpx
+from .core.http_client import HttpClientManager
+from .core.http_cache import response_cache
+from .core.rate_limit import host_limiters
+from .services.gitea import GiteaService
+from .services.repo_cache import RepoListingCache
+
+def _commit(sha: str, date: datetime):
+    return {
+        "sha": sha * 7,
+        "html_url": f"https://git.example.com/o/r/commit/{sha}",
+        "author": None,
+        "commit": {"message": f"change {sha}\nbody", "author": {"name": "bob", "date": date.isoformat()}}
+    }
+
+def _run_with_transport(handler, coro_factory):
+    async def run():
+        HttpClientManager._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            return await coro_factory()
+        finally:
+            await HttpClientManager.close_client()
+            HttpClientManager._client = None
+    response_cache.clear()
+    host_limiters.clear()
+    return asyncio.run(run())
+
+def test_commits_page_until_since_is_reached():
+    until = datetime(2024, 5, 10, 12, tzinfo=timezone.utc)
+    since = until - timedelta(days=1)
+    pages = {
+        1: [_commit("a", until - timedelta(hours=1)), _commit("b", until - timedelta(hours=2))],
+        2: [_commit("c", until - timedelta(hours=3)), _commit("d", since - timedelta(hours=1))],
+        3: [_commit("e", since - timedelta(hours=2)), _commit("f", since - timedelta(hours=3))],
+    }
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request.url.params)
+        return httpx.Response(200, json=pages[int(request.url.params["page"])])
+
+    async def collect():
+        service = GiteaService("https://git.example.com", "token", commits_page_size=2)
+        return [c async for c in service.get_commits_for_repo("o/r", since, until, sha="main")]
+
+    commits = _run_with_transport(handler, collect)
+    assert [c["message"] for c in commits] == ["change a", "change b", "change c"]
+    # Page 3 is never requested because page 2 already reached past `since`
+    assert [p["page"] for p in requests] == ["1", "2"]
+    assert requests[0]["until"] == until.isoformat()
+    assert requests[0]["sha"] == "main"
+    assert requests[0]["limit"] == "2"
+
+def test_same_slot_runs_share_one_commits_request():
+    now = datetime.now(timezone.utc)
+    since = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
+    commit_requests = []
+
+    async def handler(request: httpx.Request):
+        if not request.url.path.endswith("/commits"):
+            return httpx.Response(200, json=[])
+        commit_requests.append(request.url.params)
+        await asyncio.sleep(0.01)
+        if request.headers.get("if-none-match") == '"c1"':
+            return httpx.Response(304, headers={"ETag": '"c1"'})
+        return httpx.Response(200, json=[_commit("a", now - timedelta(hours=1))], headers={"ETag": '"c1"'})
+
+    async def collect():
+        # Each run takes its own "now" as the end of the window
+        def run():
+            service = GiteaService("https://git.example.com", "token")
+            return service, service.collect_repo_data(["o/r"], since, datetime.now(timezone.utc))
+        (first, a), (second, b) = run(), run()
+        await asyncio.gather(a, b)
+        third, c = run()
+        data = await c
+        return first, second, third, data
+
+    first, second, third, data = _run_with_transport(handler, collect)
+    assert [c["message"] for c in data["o/r"]["commits"]] == ["change a"]
+    # The two concurrent runs sent one request, the later run revalidated it
+    assert len(commit_requests) == 2 and "until" not in commit_requests[0]
+    assert first.cache_stats["coalesced"] + second.cache_stats["coalesced"] >= 1
+    assert third.cache_stats["hits"] == 1
+
+def test_repo_pages_fan_out_from_total_count():
+    repos = [{"full_name": f"o/repo{i}"} for i in range(7)]
+    requested_pages = []
+
+    def handler(request: httpx.Request):
+        if request.url.path == "/api/v1/settings/api":
+            return httpx.Response(200, json={"max_response_items": 3})
+        page = int(request.url.params["page"])
+        limit = int(request.url.params["limit"])
+        requested_pages.append(page)
+        chunk = repos[(page - 1) * limit:page * limit]
+        return httpx.Response(200, json=chunk, headers={"X-Total-Count": str(len(repos))})
+
+    async def collect():
+        return await GiteaService("https://git.example.com", "token").get_all_repos()
+
+    names = _run_with_transport(handler, collect)
+    assert names == [r["full_name"] for r in repos]
+    # No trailing empty page is requested
+    assert sorted(requested_pages) == [1, 2, 3]
+
+def test_failed_repo_listing_is_not_cached():
+    down = [True]
+
+    def handler(request: httpx.Request):
+        if request.url.path == "/api/v1/settings/api":
+            return httpx.Response(200, json={"max_response_items": 50})
+        if down[0]:
+            down[0] = False
+            return httpx.Response(500)
+        return httpx.Response(200, json=[{"full_name": "o/r"}])
+
+    async def collect():
+        cache = RepoListingCache(ttl_seconds=300)
+        service = GiteaService("https://git.example.com", "token")
+        try:
+            await cache.get_repos(1, "all", service)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("a failed listing must not look like an empty one")
+        return await cache.get_repos(1, "all", service)
+
+    repos = _run_with_transport(handler, collect)
+    assert [r["full_name"] for r in repos] == ["o/r"]
+
+def test_bulk_issue_search_replaces_per_repo_calls():
+    repos = [f"o/repo{i}" for i in range(12)]
+    paths = []
+
+    def handler(request: httpx.Request):
+        paths.append(request.url.path)
+        if request.url.path == "/api/v1/settings/api":
+            return httpx.Response(200, json={"max_response_items": 50})
+        if request.url.path == "/api/v1/repos/issues/search":
+            item = {
+                "number": 1 if request.url.params["type"] == "issues" else 2,
+                "title": request.url.params["type"],
+                "html_url": "https://git.example.com/o/repo3/issues/1",
+                "user": {"full_name": "", "login": "bob"},
+                "repository": {"full_name": "o/repo3"}
+            }
+            return httpx.Response(200, json=[item], headers={"X-Total-Count": "1"})
+        return httpx.Response(200, json=[])
+
+    async def collect():
+        service = GiteaService("https://git.example.com", "token")
+        now = datetime(2024, 5, 10, tzinfo=timezone.utc)
+        return await service.collect_repo_data(repos, now - timedelta(days=1), now)
+
+    data = _run_with_transport(handler, collect)
+    assert list(data) == ["o/repo3"]
+    assert data["o/repo3"]["issues"][0]["title"] == "issues"
+    assert data["o/repo3"]["prs"][0]["id"] == 2
+    assert not any(p.endswith("/pulls") or p.endswith("/repo3/issues") for p in paths)
+
+def test_owner_scope_search_is_limited_to_the_owner():
+    searches = []
+
+    def handler(request: httpx.Request):
+        if request.url.path == "/api/v1/settings/api":
+            return httpx.Response(200, json={"max_response_items": 50})
+        if request.url.path == "/api/v1/repos/issues/search":
+            searches.append(dict(request.url.params))
+        return httpx.Response(200, json=[])
+
+    async def collect():
+        service = GiteaService("https://git.example.com", "token")
+        now = datetime(2024, 5, 10, tzinfo=timezone.utc)
+        infos = [{"full_name": "bob/a", "updated_at": "2024-05-09T12:00:00Z"}]
+        return await service.collect_repo_data(["bob/a"], now - timedelta(days=1), now,
+                                               repo_infos=infos, search_owner="bob")
+
+    _run_with_transport(handler, collect)
+    assert len(searches) == 2 and all(p["owner"] == "bob" for p in searches)
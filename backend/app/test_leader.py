@@ -0,0 +1,38 @@
+import asyncio
+from datetime import timedelta
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import sessionmaker
+from .database import Base
+from .models import SchedulerLease
+from .services.leader import LeaderElector, _utcnow
+
+def test_single_leader_and_failover(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'lease.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    events = []
+
+    def elected(name):
+        async def on_elected():
+            events.append(name)
+        return on_elected
+
+    a = LeaderElector(session_factory=factory, on_elected=elected("a"))
+    b = LeaderElector(session_factory=factory, on_elected=elected("b"))
+    asyncio.run(a.tick())
+    asyncio.run(b.tick())
+    assert a.is_leader and not b.is_leader
+
+    # a stops heartbeating and its lease runs out
+    with factory() as db:
+        db.execute(update(SchedulerLease).values(expires_at=_utcnow() - timedelta(seconds=1)))
+        db.commit()
+    asyncio.run(b.tick())
+    asyncio.run(a.tick())
+    assert b.is_leader and not a.is_leader
+    assert events == ["a", "b"]
+
+    # A clean release hands over immediately
+    b.release()
+    asyncio.run(a.tick())
+    assert a.is_leader
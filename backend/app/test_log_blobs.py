@@ -0,0 +1,12 @@
+import json
+from .services.log_blobs import CHUNK_SIZE, LogBlobStore
+
+def test_gzip_payload_round_trips_in_chunks():
+    payload = json.dumps({"repo_data": {f"org/repo{i}": {"commits": ["提交"] * 50} for i in range(500)}}, ensure_ascii=False)
+    codec, data = LogBlobStore.compress(payload, codec="gzip")
+    assert codec == "gzip"
+    assert len(data) < len(payload.encode("utf-8")) / 10
+
+    chunks = list(LogBlobStore.iter_decompressed(codec, data))
+    assert len(chunks) > 1 and all(len(c) <= CHUNK_SIZE for c in chunks)
+    assert b"".join(chunks).decode("utf-8") == payload
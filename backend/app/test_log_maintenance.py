@@ -0,0 +1,131 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+from .database import Base, SessionLocal, create_db_engine, init_db
+from .models import ReportTask, TaskLog, TaskLogBlob, TaskLogDaily
+from .services.log_blobs import LogBlobStore
+from .services.maintenance import LogMaintenance
+from .services.scheduler import SchedulerService
+
+def test_retention_expires_payloads_and_rolls_up_old_logs():
+    init_db()
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    with SessionLocal() as db:
+        task = ReportTask(user_id=-23, gitea_config_id=0, notify_config_id=0, name="retention-test",
+                          cron_expression="0 9 * * *", scope_type="specific")
+        db.add(task)
+        db.commit()
+        task_id = task.id
+
+        def add_log(age_days, status="success", commits=1):
+            log = TaskLog(task_id=task_id, status=status, commit_count=commits, summary="s",
+                          report_markdown="report", created_at=now - timedelta(days=age_days))
+            db.add(log)
+            db.flush()
+            LogBlobStore.save(db, log.id, '{"repo_data": {}}')
+            return log
+
+        recent = add_log(1)
+        aging = add_log(30)
+        old_day = (now - timedelta(days=400)).date()
+        for status in ("success", "success", "failed"):
+            add_log(400, status=status, commits=2)
+        db.commit()
+        recent_id, aging_id = recent.id, aging.id
+
+    maintenance = LogMaintenance(raw_days=14, keep_days=365, batch_size=2, pause_seconds=0)
+    try:
+        asyncio.run(maintenance.run())
+        with SessionLocal() as db:
+            logs = {log.id: log for log in db.query(TaskLog).filter(TaskLog.task_id == task_id)}
+            assert set(logs) == {recent_id, aging_id}
+            assert db.get(TaskLogBlob, recent_id) is not None and logs[recent_id].report_markdown == "report"
+            assert db.get(TaskLogBlob, aging_id) is None and logs[aging_id].report_markdown is None
+
+            daily = db.get(TaskLogDaily, (task_id, old_day))
+            assert (daily.runs, daily.succeeded, daily.failed, daily.commit_count) == (3, 2, 1, 6)
+        assert maintenance.last_run["rolled_up_logs"] >= 3
+    finally:
+        with SessionLocal() as db:
+            ids = [log_id for (log_id,) in db.query(TaskLog.id).filter(TaskLog.task_id == task_id)]
+            db.query(TaskLogBlob).filter(TaskLogBlob.log_id.in_(ids)).delete()
+            db.query(TaskLog).filter(TaskLog.task_id == task_id).delete()
+            db.query(TaskLogDaily).filter(TaskLogDaily.task_id == task_id).delete()
+            db.query(ReportTask).filter(ReportTask.id == task_id).delete()
+            db.commit()
+
+def test_vacuum_step_returns_a_full_slice_of_pages(tmp_path, monkeypatch):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'vacuum.db'}")
+    monkeypatch.setattr("app.services.maintenance.engine", engine)
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE TABLE filler (body TEXT)"))
+            conn.execute(text("INSERT INTO filler VALUES (:body)"), [{"body": "x" * 3000} for _ in range(1500)])
+            conn.execute(text("DELETE FROM filler"))
+
+        def freelist():
+            with engine.connect() as conn:
+                return conn.execute(text("PRAGMA freelist_count")).scalar()
+
+        before = freelist()
+        assert before > 1000
+        maintenance = LogMaintenance(vacuum_pages=500)
+        assert maintenance.vacuum_step() is True
+        assert freelist() == before - 500
+        while maintenance.vacuum_step():
+            pass
+        assert freelist() == 0
+    finally:
+        engine.dispose()
+
+def test_purged_runs_are_not_resumable():
+    engine = create_db_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        log = TaskLog(task_id=1, status="failed", stage="render", report_markdown="report",
+                      created_at=datetime(2024, 1, 1))
+        db.add(log)
+        db.flush()
+        LogBlobStore.save(db, log.id, "{}")
+        db.commit()
+        assert SchedulerService.checkpoints_intact(db, log)
+
+        LogMaintenance.expire_raw_batch(db, datetime(2024, 2, 1), 10)
+        db.refresh(log)
+        assert not SchedulerService.checkpoints_intact(db, log)
+        # Nothing checkpointed yet: a retry starts from the fetch anyway
+        log.stage = None
+        assert SchedulerService.checkpoints_intact(db, log)
+
+def test_logs_of_deleted_tasks_are_purged_without_rollup():
+    init_db()
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    with SessionLocal() as db:
+        task = ReportTask(user_id=-23, gitea_config_id=0, notify_config_id=0, name="orphan-test",
+                          cron_expression="0 9 * * *", scope_type="specific")
+        db.add(task)
+        db.commit()
+        task_id = task.id
+        # What DELETE /api/tasks/{id} leaves behind, older than the task's own logs
+        orphan = TaskLog(task_id=None, status="success", commit_count=1, created_at=now - timedelta(days=401))
+        kept = TaskLog(task_id=task_id, status="success", commit_count=1, created_at=now - timedelta(days=400))
+        db.add_all([orphan, kept])
+        db.flush()
+        LogBlobStore.save(db, orphan.id, '{"repo_data": {}}')
+        db.commit()
+        orphan_id, kept_id = orphan.id, kept.id
+
+    maintenance = LogMaintenance(raw_days=0, keep_days=365, batch_size=1, pause_seconds=0)
+    try:
+        asyncio.run(maintenance.run())
+        with SessionLocal() as db:
+            assert db.get(TaskLog, orphan_id) is None and db.get(TaskLogBlob, orphan_id) is None
+            assert db.get(TaskLog, kept_id) is None
+            assert db.get(TaskLogDaily, (task_id, (now - timedelta(days=400)).date())).runs == 1
+        assert maintenance.last_run["rolled_up_logs"] >= 2
+    finally:
+        with SessionLocal() as db:
+            db.query(TaskLogDaily).filter(TaskLogDaily.task_id == task_id).delete()
+            db.query(ReportTask).filter(ReportTask.id == task_id).delete()
+            db.commit()
@@ -0,0 +1,49 @@
+from datetime import datetime
+from fastapi import Response
+from sqlalchemy import text
+from .database import SessionLocal, engine, init_db
+from .migrations import pad_created_at
+from .models import ReportTask, TaskLog, User
+from .routers import logs
+
+def get_logs(response, **kwargs):
+    # Called directly, so give every Query() parameter a plain value
+    params = {"task_id": None, "start_date": None, "end_date": None, "limit": 50, "offset": 0, "after": None}
+    return logs.get_logs(response, **{**params, **kwargs})
+
+def test_cursor_pages_cover_every_log_once():
+    init_db()
+    with SessionLocal() as db:
+        task = ReportTask(user_id=-22, gitea_config_id=0, notify_config_id=0, name="page-test",
+                          cron_expression="0 9 * * *", scope_type="specific")
+        db.add(task)
+        db.commit()
+        task_id = task.id
+        same_time = datetime(2024, 5, 1, 12, 0, 0)
+        db.add_all([TaskLog(task_id=task_id, status="success", created_at=same_time) for _ in range(3)])
+        db.add_all([TaskLog(task_id=task_id, status="success", created_at=datetime(2024, 5, d, 9, 30)) for d in (2, 3)])
+        db.commit()
+    # A row written by the server default, as older versions did, then migrated
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO task_logs (task_id, status) VALUES (:id, 'success')"), {"id": task_id})
+        pad_created_at(conn)
+
+    user = User(id=-22, username="page-test", password_hash="")
+    try:
+        with SessionLocal() as db:
+            expected = [log.id for log in get_logs(Response(), task_id=task_id, limit=100, db=db, current_user=user)]
+            seen, after = [], None
+            for _ in range(len(expected) + 1):
+                response = Response()
+                page = get_logs(response, task_id=task_id, limit=1, after=after, db=db, current_user=user)
+                seen.extend(log.id for log in page)
+                after = response.headers.get("X-Next-Cursor")
+                if not after:
+                    break
+        assert len(expected) == 6
+        assert seen == expected
+    finally:
+        with SessionLocal() as db:
+            db.query(TaskLog).filter(TaskLog.task_id == task_id).delete()
+            db.query(ReportTask).filter(ReportTask.id == task_id).delete()
+            db.commit()
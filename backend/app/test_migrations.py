@@ -0,0 +1,77 @@
+import multiprocessing
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import sessionmaker
+from .database import create_db_engine
+from .migrations import LATEST_VERSION, current_version, migrate
+from .services.log_blobs import LogBlobStore
+from .services.maintenance import LogMaintenance
+
+def _migrate_url(url, results):
+    engine = create_db_engine(url)
+    try:
+        results.put(migrate(engine))
+    finally:
+        engine.dispose()
+
+def test_fresh_database_is_created_at_latest_version(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    try:
+        assert migrate(engine) == 1
+        with engine.connect() as conn:
+            assert current_version(conn) == LATEST_VERSION
+            assert "task_log_daily" in inspect(conn).get_table_names()
+        # Already current: a single read, nothing applied
+        assert migrate(engine) == 0
+    finally:
+        engine.dispose()
+
+def test_unversioned_database_runs_every_step(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    try:
+        # The shape of a database from before checkpoints, blobs and versioning
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE report_tasks (id INTEGER PRIMARY KEY, user_id INTEGER, gitea_config_id INTEGER, "
+                "notify_config_id INTEGER, ai_config_id INTEGER, name VARCHAR NOT NULL, "
+                "cron_expression VARCHAR NOT NULL, scope_type VARCHAR NOT NULL, target_repos JSON, "
+                "report_days INTEGER, is_ai_enabled BOOLEAN, ai_system_prompt TEXT, is_active BOOLEAN)"
+            ))
+            conn.execute(text(
+                "CREATE TABLE task_logs (id INTEGER PRIMARY KEY, task_id INTEGER, status VARCHAR NOT NULL, "
+                "commit_count INTEGER, summary TEXT, log_details TEXT, raw_data TEXT, "
+                "created_at DATETIME DEFAULT CURRENT_TIMESTAMP, updated_at DATETIME)"
+            ))
+            conn.execute(text(
+                "INSERT INTO report_tasks (id, name, cron_expression, scope_type) VALUES (1, 'old', '0 9 * * *', 'all')"
+            ))
+            conn.execute(text("INSERT INTO task_logs (id, task_id, status, raw_data) VALUES (1, 1, 'success', '{\"a\": 1}')"))
+
+        assert migrate(engine) == LATEST_VERSION
+        # The payload copy is left to the scheduler leader, outside the migration lock
+        with sessionmaker(bind=engine)() as db:
+            assert LogMaintenance.has_inline_raw(db)
+            assert LogMaintenance.move_inline_raw_batch(db, 0, 10) == (1, 1)
+            assert LogMaintenance.move_inline_raw_batch(db, 0, 10) == (0, 0)
+        with engine.connect() as conn:
+            assert current_version(conn) == LATEST_VERSION
+            assert "last_run_at" in [c["name"] for c in inspect(conn).get_columns("report_tasks")]
+            assert "ix_task_logs_created_at" in [i["name"] for i in inspect(conn).get_indexes("task_logs")]
+            assert conn.execute(text("SELECT raw_data FROM task_logs")).scalar() is None
+            codec, data = conn.execute(text("SELECT codec, data FROM task_log_blobs WHERE log_id = 1")).one()
+            assert b"".join(LogBlobStore.iter_decompressed(codec, data)) == b'{"a": 1}'
+            assert len(conn.execute(text("SELECT created_at FROM task_logs")).scalar()) == 26
+            assert conn.execute(text("SELECT task_id FROM schedule_changes")).scalars().all() == [1]
+    finally:
+        engine.dispose()
+
+def test_concurrent_workers_migrate_once(tmp_path):
+    url = f"sqlite:///{tmp_path / 'race.db'}"
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    workers = [ctx.Process(target=_migrate_url, args=(url, results)) for _ in range(4)]
+    for w in workers:
+        w.start()
+    applied = sorted(results.get(timeout=60) for _ in workers)
+    for w in workers:
+        w.join()
+    assert applied == [0, 0, 0, 1]
@@ -0,0 +1,112 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+from .services.pipeline import ReportPipeline, SharedCollections
+
+def test_next_stage_resumes_after_last_checkpoint():
+    assert ReportPipeline.STAGES[ReportPipeline.next_stage(None)] == "fetch"
+    assert ReportPipeline.STAGES[ReportPipeline.next_stage("fetch")] == "render"
+    assert ReportPipeline.STAGES[ReportPipeline.next_stage("summarize")] == "deliver"
+    assert ReportPipeline.next_stage("deliver") == len(ReportPipeline.STAGES)
+
+def test_render_from_checkpointed_fetch():
+    since = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    fetched = {
+        "scope": "repos",
+        "window": {"since": since, "until": datetime(2024, 5, 2, tzinfo=timezone.utc)},
+        "repo_data": {},
+        "total_commits": 0
+    }
+    # A resumed run renders from the JSON stored on the log, not the live dict
+    restored = json.loads(ReportPipeline.dump(fetched))
+    assert ReportPipeline.render(restored) == ReportPipeline.render(fetched)
+
+def test_compose_puts_summary_first():
+    assert ReportPipeline.compose("report", None) == "report"
+    assert ReportPipeline.compose("report", "summary") == "summary\n\nreport"
+
+def test_fetch_gaps_name_what_the_report_is_missing():
+    assert ReportPipeline.fetch_gaps({"repo_data": {}}) == ""
+    fetched = {"fetch_errors": [
+        {"path": "/repos/o/slow", "status": "timeout"},
+        {"path": "/repos/o/gone/commits", "status": 404},
+        {"path": "/repos/o/busy/issues", "status": 429},
+        {"path": "/repos/o/busy/pulls", "status": 429},
+        # Both have fallbacks that still deliver the data
+        {"path": "/settings/api", "status": 404},
+        {"path": "/repos/issues/search", "status": 500},
+    ]}
+    assert ReportPipeline.fetch_gaps(fetched) == "（1 个仓库超时未统计）（2 处请求失败，数据不完整：o/gone、o/busy）"
+
+def test_same_fingerprint_collects_once():
+    since = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    fp = SharedCollections.fingerprint
+    assert fp(1, "specific", ["b/b", "a/a"], 1, since) == fp(1, "specific", ["a/a", "b/b"], 1, since)
+    assert fp(1, "all", ["a/a"], 1, since) == fp(1, "all", None, 1, since)
+    assert fp(1, "specific", ["a/a"], 1, since) != fp(2, "specific", ["a/a"], 1, since)
+
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"total_commits": 3}
+
+    async def run():
+        shared = SharedCollections(ttl=60)
+        key = fp(1, "all", None, 1, since)
+        concurrent = await asyncio.gather(shared.collect(key, fetch), shared.collect(key, fetch))
+        later = await shared.collect(key, fetch)
+        return shared, concurrent, later
+
+    shared, concurrent, later = asyncio.run(run())
+    assert len(calls) == 1
+    assert [flag for _, flag in concurrent] == [False, True]
+    assert later == ({"total_commits": 3}, True)
+    assert shared.stats == {"collected": 1, "shared": 2}
+
+def test_cancelling_one_run_does_not_cancel_shared_collection():
+    started = []
+
+    async def fetch():
+        started.append(1)
+        await asyncio.sleep(0.05)
+        return {"total_commits": 1}
+
+    async def run():
+        shared = SharedCollections(ttl=0)
+        a = asyncio.create_task(shared.collect("k", fetch))
+        b = asyncio.create_task(shared.collect("k", fetch))
+        await asyncio.sleep(0.01)
+        a.cancel()
+        result = await b
+        assert a.cancelled()
+
+        # Alone, a cancelled caller takes the fetch down with it
+        c = asyncio.create_task(shared.collect("k", fetch))
+        await asyncio.sleep(0.01)
+        c.cancel()
+        await asyncio.gather(c, return_exceptions=True)
+        await asyncio.sleep(0)
+        return result, shared
+
+    result, shared = asyncio.run(run())
+    assert result == ({"total_commits": 1}, True)
+    assert len(started) == 2
+    assert shared._flights._calls == {} and shared._flights._waiters == {}
+
+def test_followers_retry_when_the_shared_work_is_cancelled():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        if len(calls) == 1:
+            raise asyncio.CancelledError()
+        return {"total_commits": 2}
+
+    async def run():
+        shared = SharedCollections(ttl=0)
+        return await shared.collect("k", fetch)
+
+    assert asyncio.run(run()) == ({"total_commits": 2}, False)
+    assert len(calls) == 2
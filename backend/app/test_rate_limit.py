@@ -0,0 +1,63 @@
+import asyncio
+import httpx
+from .core.rate_limit import HostLimiter, parse_retry_after
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+def test_throttled_request_is_retried_and_window_shrinks():
+    limiter = HostLimiter("https://git.example.com", initial_limit=8, backoff_base=0.0)
+    responses = [
+        httpx.Response(429, headers={"Retry-After": "0"}),
+        httpx.Response(502),
+        httpx.Response(200, json=[]),
+    ]
+    calls = []
+
+    async def send():
+        calls.append(1)
+        return responses[len(calls) - 1]
+
+    response = asyncio.run(limiter.request(send))
+    assert response.status_code == 200
+    assert len(calls) == 3
+    assert limiter.in_flight == 0
+    assert limiter.limit < 8
+
+def test_gives_up_after_max_retries():
+    limiter = HostLimiter("https://git.example.com", max_retries=1, backoff_base=0.0)
+    calls = []
+
+    async def send():
+        calls.append(1)
+        return httpx.Response(503)
+
+    response = asyncio.run(limiter.request(send))
+    assert response.status_code == 503
+    assert len(calls) == 2
+
+def test_cancelled_request_frees_its_slot():
+    limiter = HostLimiter("https://git.example.com", initial_limit=2, min_limit=2)
+
+    async def hang():
+        await asyncio.sleep(60)
+
+    async def ok():
+        return httpx.Response(200, json=[])
+
+    async def run():
+        pending = [asyncio.create_task(limiter.request(hang)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        assert limiter.in_flight == 2
+        for t in pending:
+            t.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        assert limiter.in_flight == 0
+        # The window is usable again instead of blocking forever
+        return await asyncio.wait_for(limiter.request(ok), 1)
+
+    assert asyncio.run(run()).status_code == 200
+    assert limiter.in_flight == 0
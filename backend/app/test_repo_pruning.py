@@ -0,0 +1,18 @@
+from datetime import datetime, timezone
+from .services.gitea import GiteaService
+
+def test_plan_skips_dormant_and_empty_lists():
+    since = datetime(2024, 5, 9, tzinfo=timezone.utc)
+    infos = [
+        {"full_name": "o/active", "updated_at": "2024-05-09T08:00:00Z", "open_issues_count": 2, "open_pr_counter": 0},
+        {"full_name": "o/dormant", "updated_at": "2021-01-01T00:00:00Z", "open_issues_count": 0, "open_pr_counter": 1},
+        {"full_name": "o/archived", "updated_at": "2024-05-09T08:00:00Z", "archived": True,
+         "open_issues_count": 0, "open_pr_counter": 0},
+        {"full_name": "o/unknown"},
+    ]
+    plan = GiteaService.plan_repo_fetches(infos, since)
+    assert plan["o/active"] == {"commits": True, "issues": True, "prs": False}
+    assert plan["o/dormant"] == {"commits": False, "issues": False, "prs": True}
+    assert plan["o/archived"] == {"commits": False, "issues": False, "prs": False}
+    # Missing metadata never prunes anything
+    assert plan["o/unknown"] == {"commits": True, "issues": True, "prs": True}
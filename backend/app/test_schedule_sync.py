@@ -0,0 +1,48 @@
+import asyncio
+from .database import SessionLocal, init_db
+from .models import ReportTask, ScheduleChange
+from .services.scheduler import SchedulerService
+
+def test_changelog_reconciles_only_changed_tasks():
+    init_db()
+    service = SchedulerService()
+    service.elector.is_leader = True
+
+    with SessionLocal() as db:
+        task = ReportTask(user_id=0, gitea_config_id=0, notify_config_id=0, name="sync-test",
+                          cron_expression="0 9 * * *", scope_type="specific", is_active=True)
+        db.add(task)
+        db.flush()
+        SchedulerService.record_change(db, task.id)
+        db.commit()
+        task_id = task.id
+
+    try:
+        asyncio.run(service._on_elected())
+        assert service.scheduler.get_job(f"task_{task_id}") is not None
+        cursor = service._change_cursor
+
+        with SessionLocal() as db:
+            db.get(ReportTask, task_id).is_active = False
+            SchedulerService.record_change(db, task_id)
+            db.commit()
+        asyncio.run(service.sync_changes())
+        assert service.scheduler.get_job(f"task_{task_id}") is None
+        assert service._change_cursor > cursor
+    finally:
+        with SessionLocal() as db:
+            db.query(ScheduleChange).filter(ScheduleChange.task_id == task_id).delete()
+            db.query(ReportTask).filter(ReportTask.id == task_id).delete()
+            db.commit()
+
+def test_spread_offsets_are_deterministic_and_bounded():
+    service = SchedulerService()
+    service.spread_seconds = 600
+    offsets = [service.fire_offset(task_id) for task_id in range(1, 50)]
+    assert offsets == [service.fire_offset(task_id) for task_id in range(1, 50)]
+    assert all(0 <= o < 600 for o in offsets)
+    assert len(set(offsets)) > 40
+
+    fire = service.next_fire_time(7, "0 9 * * *")
+    offset = service.fire_offset(7)
+    assert (fire.hour * 3600 + fire.minute * 60 + fire.second) == 9 * 3600 + offset
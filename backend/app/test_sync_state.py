@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from .database import Base
+from .models import GiteaConfig
+from .services.sync_state import RepoSyncStore, commit_fetch_window, merge_commits, merge_open_items
+
+UNTIL = datetime(2024, 5, 10, 9, tzinfo=timezone.utc)
+
+def _commit(sha, hours_ago):
+    return {"repo": "o/r", "author": "bob", "message": sha, "sha": sha, "url": "", "date": UNTIL - timedelta(hours=hours_ago)}
+
+def test_weekly_window_only_fetches_delta():
+    week_ago = UNTIL - timedelta(days=7)
+    mark = {}
+    start, is_delta = commit_fetch_window(mark, week_ago)
+    assert (start, is_delta) == (week_ago, False)
+    merge_commits(mark, [_commit("a", 100), _commit("b", 30)], is_delta, week_ago, UNTIL)
+
+    next_until = UNTIL + timedelta(days=1)
+    next_since = next_until - timedelta(days=7)
+    start, is_delta = commit_fetch_window(mark, next_since)
+    assert is_delta and start == UNTIL - timedelta(minutes=360)
+    window = merge_commits(mark, [_commit("b", 30), _commit("c", -2)], is_delta, next_since, next_until)
+    assert [c["sha"] for c in window] == ["c", "b", "a"]
+    assert mark["last_commit_sha"] == "c"
+
+    # Repo not pushed since the mark: nothing to fetch at all
+    assert commit_fetch_window(mark, next_since, updated_at=next_until - timedelta(hours=1)) == (None, True)
+
+def test_skipped_fetch_keeps_the_high_water_mark():
+    week_ago = UNTIL - timedelta(days=7)
+    mark = {}
+    merge_commits(mark, [_commit("a", 30)], False, week_ago, UNTIL)
+
+    # 09:03 run skips on a 09:00 listing, missing a push at 09:01
+    listed = UNTIL - timedelta(minutes=5)
+    run_until = UNTIL + timedelta(minutes=3)
+    start, is_delta = commit_fetch_window(mark, week_ago, updated_at=listed)
+    assert start is None
+    merge_commits(mark, [], is_delta, week_ago, run_until, skipped=True)
+    assert mark["synced_until"] == UNTIL
+
+    # Next day the fresh listing shows the 09:01 push, which is now fetched
+    pushed = UNTIL + timedelta(minutes=1)
+    start, _ = commit_fetch_window(mark, week_ago + timedelta(days=1), updated_at=pushed)
+    assert start is not None
+
+def test_delta_starts_are_rounded_to_a_stable_step():
+    week_ago = UNTIL - timedelta(days=7)
+    starts = set()
+    # Two runs of the same slot, seconds apart, recorded slightly different marks
+    for offset in (timedelta(seconds=2, microseconds=1234), timedelta(seconds=41)):
+        mark = {}
+        merge_commits(mark, [], False, week_ago, UNTIL + offset)
+        starts.add(commit_fetch_window(mark, week_ago + timedelta(days=1))[0])
+    assert starts == {UNTIL - timedelta(minutes=360)}
+
+def test_issue_updates_close_and_open_items():
+    snapshot = [{"id": 1, "state": "open"}, {"id": 2, "state": "open"}]
+    updates = [{"id": 2, "state": "closed"}, {"id": 3, "state": "open"}]
+    assert [i["id"] for i in merge_open_items(snapshot, updates)] == [3, 1]
+
+def test_store_round_trip():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    cfg = GiteaConfig(user_id=1, name="g", base_url="https://git.example.com", token="t")
+    db.add(cfg)
+    db.commit()
+
+    mark = {}
+    merge_commits(mark, [_commit("a", 3)], False, UNTIL - timedelta(days=1), UNTIL)
+    mark.update({"issues": [{"id": 1, "state": "open"}], "prs": [], "issues_synced_at": UNTIL})
+    RepoSyncStore.save(db, cfg.id, {"o/r": mark, "o/empty": {}})
+
+    loaded = RepoSyncStore.load(db, cfg.id, ["o/r", "o/empty"])
+    assert list(loaded) == ["o/r"]
+    assert loaded["o/r"]["synced_until"] == UNTIL
+    assert loaded["o/r"]["commits"][0]["sha"] == "a"
+    db.close()
@@ -0,0 +1,60 @@
+import asyncio
+from .services.scheduler import TaskQueue
+
+def test_manual_runs_jump_ahead_and_concurrency_is_bounded():
+    order = []
+    peak = {"running": 0, "max": 0}
+
+    def job(name):
+        async def run():
+            peak["running"] += 1
+            peak["max"] = max(peak["max"], peak["running"])
+            await asyncio.sleep(0.01)
+            order.append(name)
+            peak["running"] -= 1
+        return run
+
+    async def main():
+        queue = TaskQueue(concurrency=1, max_size=10)
+        assert queue.submit(1, job("cron-1"), TaskQueue.PRIORITY_CRON)
+        assert queue.submit(2, job("cron-2"), TaskQueue.PRIORITY_CRON)
+        assert queue.submit(3, job("manual"), TaskQueue.PRIORITY_MANUAL)
+        # The same task can't be queued twice
+        assert not queue.submit(2, job("dup"), TaskQueue.PRIORITY_CRON)
+        assert queue.stats()["depth"] == 3
+        queue.start()
+        await queue._queue.join()
+        stats = queue.stats()
+        queue.stop()
+        return stats
+
+    stats = asyncio.run(main())
+    assert order == ["manual", "cron-1", "cron-2"]
+    assert peak["max"] == 1
+    assert stats["processed"] == 3 and stats["depth"] == 0
+
+def test_running_task_cannot_be_submitted_again():
+    started, release = asyncio.Event(), asyncio.Event()
+
+    async def long_run():
+        started.set()
+        await release.wait()
+
+    async def quick():
+        pass
+
+    async def main():
+        queue = TaskQueue(concurrency=2, max_size=10)
+        queue.start()
+        assert queue.submit(1, long_run, TaskQueue.PRIORITY_MANUAL)
+        await started.wait()
+        # Out of the queue but still running: a second run would race the first
+        rejected = not queue.submit(1, quick, TaskQueue.PRIORITY_MANUAL)
+        release.set()
+        await queue._queue.join()
+        accepted_after = queue.submit(1, quick, TaskQueue.PRIORITY_MANUAL)
+        await queue._queue.join()
+        queue.stop()
+        return rejected, accepted_after
+
+    assert asyncio.run(main()) == (True, True)
@@ -0,0 +1,425 @@
+import asyncio
+import json
+import time
+import httpx
+from datetime import datetime, timedelta, timezone
+from .core.http_client import HttpClientManager
+from .core.http_cache import response_cache
+from .core.rate_limit import host_limiters
+from .database import SessionLocal, init_db
+from .models import AIConfig, GiteaConfig, NotifyConfig, ReportTask, RepoSyncState, TaskLog, TaskLogBlob
+from .services.gitea import GiteaService
+from .services.pipeline import ReportPipeline, shared_collections
+from .services.progress import run_events
+from .services.sync_state import RepoSyncStore
+from .services.scheduler import SchedulerService
+
+def _make_task():
+    with SessionLocal() as db:
+        gitea = GiteaConfig(user_id=0, name="run-test", base_url="https://git.example.com", token="t")
+        notify = NotifyConfig(user_id=0, name="run-test", webhook_url="https://hook.example.com/send")
+        ai = AIConfig(user_id=0, name="run-test", api_base="https://ai.example.com/v1", api_key="k", model="m")
+        db.add_all([gitea, notify, ai])
+        db.flush()
+        task = ReportTask(user_id=0, gitea_config_id=gitea.id, notify_config_id=notify.id, ai_config_id=ai.id,
+                          name="run-test", cron_expression="0 9 * * *", scope_type="specific",
+                          target_repos=["run-test/repo"], is_ai_enabled=True, is_active=True)
+        db.add(task)
+        db.commit()
+        return task.id, (gitea.id, notify.id, ai.id)
+
+def _cleanup(task_id, config_ids):
+    gitea_id, notify_id, ai_id = config_ids
+    with SessionLocal() as db:
+        log_ids = [log_id for (log_id,) in db.query(TaskLog.id).filter(TaskLog.task_id == task_id)]
+        db.query(TaskLogBlob).filter(TaskLogBlob.log_id.in_(log_ids)).delete()
+        db.query(TaskLog).filter(TaskLog.task_id == task_id).delete()
+        db.query(ReportTask).filter(ReportTask.id == task_id).delete()
+        db.query(RepoSyncState).filter(RepoSyncState.gitea_config_id == gitea_id).delete()
+        db.query(GiteaConfig).filter(GiteaConfig.id == gitea_id).delete()
+        db.query(NotifyConfig).filter(NotifyConfig.id == notify_id).delete()
+        db.query(AIConfig).filter(AIConfig.id == ai_id).delete()
+        db.commit()
+
+def _run(service, task_id, handler, during=None):
+    async def run():
+        HttpClientManager._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            execution = asyncio.create_task(service.execute_task(task_id, manual=True))
+            if during:
+                await during()
+            await execution
+        finally:
+            await HttpClientManager.close_client()
+            HttpClientManager._client = None
+    asyncio.run(run())
+
+def _latest_log(task_id):
+    with SessionLocal() as db:
+        return db.query(TaskLog).filter(TaskLog.task_id == task_id).order_by(TaskLog.id.desc()).first()
+
+def _setup():
+    init_db()
+    response_cache.clear()
+    host_limiters.clear()
+    shared_collections.clear()
+
+def test_ai_timeout_sends_raw_report():
+    _setup()
+    task_id, config_ids = _make_task()
+    sent = []
+
+    async def handler(request: httpx.Request):
+        if request.url.host == "ai.example.com":
+            await asyncio.sleep(5)
+        if request.url.host == "hook.example.com":
+            sent.append(json.loads(request.content)["markdown"]["content"])
+            return httpx.Response(200, json={"errcode": 0})
+        if request.url.path.endswith("/settings/api"):
+            return httpx.Response(200, json={"max_response_items": 50})
+        return httpx.Response(200, json=[])
+
+    service = SchedulerService()
+    service.stage_timeouts["summarize"] = 0.05
+    try:
+        _run(service, task_id, handler)
+        log = _latest_log(task_id)
+        assert log.status == "success"
+        assert log.ai_summary is None
+        assert sent and sent[0] == log.report_markdown
+    finally:
+        _cleanup(task_id, config_ids)
+
+def test_cancel_stops_a_running_task():
+    _setup()
+    task_id, config_ids = _make_task()
+
+    delivering = []
+
+    async def handler(request: httpx.Request):
+        if request.url.host == "hook.example.com":
+            delivering.append(request)
+            await asyncio.sleep(5)
+        if request.url.path.endswith("/settings/api"):
+            return httpx.Response(200, json={"max_response_items": 50})
+        return httpx.Response(200, json=[])
+
+    service = SchedulerService()
+    service.stage_timeouts["summarize"] = 0.01
+
+    async def cancel_when_delivering():
+        for _ in range(500):
+            await asyncio.sleep(0.01)
+            if delivering:
+                break
+        assert service.cancel_task(task_id)
+
+    try:
+        _run(service, task_id, handler, during=cancel_when_delivering)
+        log = _latest_log(task_id)
+        assert log.status == "cancelled"
+        assert log.stage == "summarize"
+        assert task_id not in service._running
+    finally:
+        _cleanup(task_id, config_ids)
+
+def test_cancelled_worker_is_not_recorded_as_a_user_cancel():
+    _setup()
+    task_id, config_ids = _make_task()
+    delivering = []
+
+    async def handler(request: httpx.Request):
+        if request.url.host == "hook.example.com":
+            delivering.append(request)
+            await asyncio.sleep(5)
+        if request.url.path.endswith("/settings/api"):
+            return httpx.Response(200, json={"max_response_items": 50})
+        return httpx.Response(200, json=[])
+
+    service = SchedulerService()
+    service.stage_timeouts["summarize"] = 0.01
+
+    async def run():
+        HttpClientManager._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            # Stands in for a queue worker cancelled at shutdown
+            worker = asyncio.create_task(service.execute_task(task_id, manual=True))
+            for _ in range(500):
+                await asyncio.sleep(0.01)
+                if delivering:
+                    break
+            worker.cancel()
+            await asyncio.gather(worker, return_exceptions=True)
+            return worker
+        finally:
+            await HttpClientManager.close_client()
+            HttpClientManager._client = None
+
+    try:
+        worker = asyncio.run(run())
+        assert worker.cancelled()
+        assert _latest_log(task_id).status != "cancelled"
+    finally:
+        _cleanup(task_id, config_ids)
+
+def test_shared_fetch_outlives_the_cancelled_run_that_started_it(monkeypatch):
+    _setup()
+    mark_sessions, cancelled_sessions = [], []
+    save, record_cancelled = RepoSyncStore.save, SchedulerService._record_cancelled
+
+    def spy_save(db, *args):
+        mark_sessions.append(db)
+        return save(db, *args)
+
+    def spy_record_cancelled(db, log_id):
+        cancelled_sessions.append(db)
+        return record_cancelled(db, log_id)
+
+    monkeypatch.setattr(RepoSyncStore, "save", staticmethod(spy_save))
+    monkeypatch.setattr(SchedulerService, "_record_cancelled", staticmethod(spy_record_cancelled))
+    task_id, config_ids = _make_task()
+    with SessionLocal() as db:
+        first = db.get(ReportTask, task_id)
+        twin = ReportTask(user_id=0, gitea_config_id=first.gitea_config_id, notify_config_id=first.notify_config_id,
+                          name="run-test-twin", cron_expression="0 9 * * *", scope_type="specific",
+                          target_repos=["run-test/repo"], is_ai_enabled=False, is_active=True)
+        db.add(twin)
+        db.commit()
+        twin_id = twin.id
+    fetching, release = [], []
+    now = datetime.now(timezone.utc)
+
+    async def handler(request: httpx.Request):
+        if request.url.path.endswith("/settings/api"):
+            return httpx.Response(200, json={"max_response_items": 50})
+        if request.url.path.endswith("/commits"):
+            fetching.append(request)
+            # Held until the twin has joined and the first run is cancelled
+            await release[0].wait()
+            return httpx.Response(200, json=[{
+                "sha": "abc1234", "html_url": "",
+                "commit": {"message": "m", "author": {"name": "a", "date": (now - timedelta(hours=1)).isoformat()}}
+            }])
+        return httpx.Response(200, json=[])
+
+    service = SchedulerService()
+
+    async def run():
+        HttpClientManager._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        release.append(asyncio.Event())
+        try:
+            runs = [asyncio.create_task(service.execute_task(task_id, manual=True))]
+            for _ in range(500):
+                await asyncio.sleep(0.01)
+                if fetching:
+                    break
+            runs.append(asyncio.create_task(service.execute_task(twin_id, manual=True)))
+            for _ in range(500):
+                await asyncio.sleep(0.01)
+                if 2 in shared_collections._flights._waiters.values():
+                    break
+            # The run that started the shared fetch goes away, its twin still waits on it
+            assert service.cancel_task(task_id)
+            await asyncio.sleep(0.05)
+            release[0].set()
+            await asyncio.gather(*runs)
+        finally:
+            await HttpClientManager.close_client()
+            HttpClientManager._client = None
+
+    try:
+        asyncio.run(run())
+        assert _latest_log(task_id).status == "cancelled"
+        twin_log = _latest_log(twin_id)
+        assert (twin_log.status, twin_log.commit_count) == ("success", 1)
+        with SessionLocal() as db:
+            state = db.query(RepoSyncState).filter(RepoSyncState.gitea_config_id == config_ids[0]).one()
+            assert state.repo_full_name == "run-test/repo" and state.synced_until is not None
+        # The marks were saved through a session of the fetch's own, not the cancelled run's
+        assert mark_sessions and cancelled_sessions
+        assert not any(m is c for m in mark_sessions for c in cancelled_sessions)
+    finally:
+        _cleanup(twin_id, config_ids)
+        _cleanup(task_id, config_ids)
+
+def test_fetch_timeout_keeps_finished_repos():
+    _setup()
+
+    async def handler(request: httpx.Request):
+        if request.url.path.endswith("/settings/api"):
+            return httpx.Response(200, json={"max_response_items": 50})
+        if "/slow/" in request.url.path:
+            await asyncio.sleep(5)
+        if request.url.path.endswith("/commits"):
+            return httpx.Response(200, json=[{
+                "sha": "abc", "html_url": "", "commit": {"message": "m", "author": {"name": "a", "date": "2024-05-01T10:00:00Z"}}
+            }])
+        return httpx.Response(200, json=[])
+
+    async def run():
+        HttpClientManager._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            service = GiteaService("https://git.example.com", "token")
+            since = datetime(2024, 5, 1, tzinfo=timezone.utc)
+            data = await service.collect_repo_data(["fast/repo", "slow/repo"], since, since + timedelta(days=1), timeout=0.2)
+            return service, data
+        finally:
+            await HttpClientManager.close_client()
+            HttpClientManager._client = None
+
+    service, data = asyncio.run(run())
+    assert list(data) == ["fast/repo"]
+    assert {"path": "/repos/slow/repo", "status": "timeout"} in service.fetch_errors
+
+def test_search_timeout_keeps_commits_and_snapshots():
+    _setup()
+
+    async def handler(request: httpx.Request):
+        if request.url.path.endswith("/settings/api"):
+            return httpx.Response(200, json={"max_response_items": 50})
+        if request.url.path.endswith("/repos/issues/search"):
+            await asyncio.sleep(5)
+        if request.url.path.endswith("/commits"):
+            return httpx.Response(200, json=[{
+                "sha": "abc", "html_url": "", "commit": {"message": "m", "author": {"name": "a", "date": "2024-05-01T10:00:00Z"}}
+            }])
+        return httpx.Response(200, json=[])
+
+    since = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    synced = since - timedelta(hours=1)
+    marks = {"a/repo": {"issues": [{"id": 1, "state": "open"}], "prs": [], "issues_synced_at": synced}}
+
+    async def run():
+        HttpClientManager._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            service = GiteaService("https://git.example.com", "token")
+            infos = [{"full_name": "a/repo", "updated_at": "2024-05-01T11:00:00Z"}]
+            data = await service.collect_repo_data(["a/repo"], since, since + timedelta(days=1),
+                                                   repo_infos=infos, marks=marks, timeout=0.4)
+            return service, data
+        finally:
+            await HttpClientManager.close_client()
+            HttpClientManager._client = None
+
+    service, data = asyncio.run(run())
+    assert [c["sha"] for c in data["a/repo"]["commits"]] == ["abc"]
+    assert data["a/repo"]["issues"] == [{"id": 1, "state": "open"}]
+    assert {"path": "/repos/issues/search", "status": "timeout"} in service.fetch_errors
+    # The snapshot wasn't refreshed, so its sync time must not move either
+    assert marks["a/repo"]["issues_synced_at"] == synced
+
+def test_slow_repo_listing_counts_against_the_fetch_budget():
+    _setup()
+
+    async def handler(request: httpx.Request):
+        if request.url.path.endswith("/settings/api"):
+            return httpx.Response(200, json={"max_response_items": 50})
+        if request.url.path.endswith("/user/repos"):
+            await asyncio.sleep(5)
+        return httpx.Response(200, json=[])
+
+    async def run():
+        HttpClientManager._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            service = GiteaService("https://git.example.com", "token")
+            since = datetime(2024, 5, 1, tzinfo=timezone.utc)
+            started = time.monotonic()
+            try:
+                await ReportPipeline.fetch(service, -18, "all", None, since, since + timedelta(days=1), timeout=0.2)
+            except asyncio.TimeoutError:
+                return time.monotonic() - started
+            raise AssertionError("the listing should have used up the budget")
+        finally:
+            await HttpClientManager.close_client()
+            HttpClientManager._client = None
+
+    assert asyncio.run(run()) < 2
+
+def _ai_stream(*parts):
+    chunks = [
+        {"id": "c", "object": "chat.completion.chunk", "created": 0, "model": "m",
+         "choices": [{"index": 0, "delta": {"content": part}, "finish_reason": None}]}
+        for part in parts
+    ]
+    body = "".join(f"data: {json.dumps(c)}\n\n" for c in chunks) + "data: [DONE]\n\n"
+    return httpx.Response(200, headers={"Content-Type": "text/event-stream"}, content=body.encode())
+
+def test_subscribers_see_progress_and_ai_tokens():
+    _setup()
+    task_id, config_ids = _make_task()
+
+    async def handler(request: httpx.Request):
+        if request.url.host == "ai.example.com":
+            return _ai_stream("总结", "完成")
+        if request.url.host == "hook.example.com":
+            return httpx.Response(200, json={"errcode": 0})
+        if request.url.path.endswith("/settings/api"):
+            return httpx.Response(200, json={"max_response_items": 50})
+        return httpx.Response(200, json=[])
+
+    service = SchedulerService()
+    chunks = []
+
+    async def follow():
+        queue = run_events.subscribe(task_id)
+        async for chunk in run_events.stream(task_id, queue):
+            chunks.append(chunk)
+
+    async def run():
+        HttpClientManager._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            follower = asyncio.create_task(follow())
+            await asyncio.sleep(0)
+            await service.execute_task(task_id, manual=True)
+            await asyncio.wait_for(follower, 1)
+        finally:
+            await HttpClientManager.close_client()
+            HttpClientManager._client = None
+
+    try:
+        asyncio.run(run())
+        events = [c.split("\n", 1)[0].removeprefix("event: ") for c in chunks]
+        assert events[:6] == ["started", "stage", "repos", "repo", "fetched", "rendered"]
+        assert events[-3:] == ["stage", "delivered", "done"]
+        tokens = [json.loads(c.split("data: ", 1)[1])["text"] for c in chunks if c.startswith("event: token")]
+        assert tokens == ["总结", "完成"]
+        assert _latest_log(task_id).ai_summary == "总结完成"
+        assert not run_events.listening(task_id)
+    finally:
+        _cleanup(task_id, config_ids)
+
+def test_backfill_writes_one_log_per_day_from_one_fetch():
+    _setup()
+    task_id, config_ids = _make_task()
+    today = datetime.now().astimezone().replace(hour=12, minute=0, second=0, microsecond=0)
+    commit_calls = []
+
+    def commit(sha, when):
+        return {"sha": sha, "html_url": "", "commit": {"message": f"change {sha}", "author": {"name": "a", "date": when.isoformat()}}}
+
+    async def handler(request: httpx.Request):
+        if request.url.path.endswith("/settings/api"):
+            return httpx.Response(200, json={"max_response_items": 50})
+        if request.url.path.endswith("/commits"):
+            commit_calls.append(request.url)
+            return httpx.Response(200, json=[commit("b" * 40, today - timedelta(days=1)), commit("a" * 40, today - timedelta(days=2))])
+        return httpx.Response(200, json=[])
+
+    async def run():
+        HttpClientManager._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            await SchedulerService().backfill_task(task_id, 3)
+        finally:
+            await HttpClientManager.close_client()
+            HttpClientManager._client = None
+
+    try:
+        asyncio.run(run())
+        with SessionLocal() as db:
+            logs = db.query(TaskLog).filter(TaskLog.task_id == task_id).order_by(TaskLog.created_at).all()
+        assert [log.commit_count for log in logs] == [0, 1, 1]
+        assert all(log.status == "success" for log in logs)
+        assert "a" * 40 in logs[1].report_markdown and "b" * 40 not in logs[1].report_markdown
+        assert len(commit_calls) == 1
+    finally:
+        _cleanup(task_id, config_ids)
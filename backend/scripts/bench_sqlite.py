@@ -0,0 +1,178 @@
+"""
+Concurrent read/write benchmark for the SQLite connection profile.
+
+Simulates a multi-worker deployment against a scratch database: several
+processes serve the logs listing (like uvicorn workers), while others write
+runs the way the scheduler does (insert the log, checkpoint it, store the
+raw payload, each its own transaction). Runs once with the plain engine the
+app used to create and once with database.create_db_engine.
+
+    cd backend && python scripts/bench_sqlite.py --seconds 10
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import load_only, sessionmaker
+
+from app import models
+from app.database import Base, create_db_engine
+from app.services.log_blobs import LogBlobStore
+
+TASKS = 20
+PAYLOAD = ("commit " * 4000)[:24000]
+
+
+def make_engine(profile: str, url: str):
+    if profile == "tuned":
+        return create_db_engine(url)
+    # What database.py used to build: driver defaults, rollback journal
+    return create_engine(url, connect_args={"check_same_thread": False})
+
+
+def seed(profile: str, url: str, rows: int):
+    engine = make_engine(profile, url)
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    try:
+        for i in range(rows):
+            log = models.TaskLog(task_id=i % TASKS + 1, status="success", commit_count=i % 7, summary="seed")
+            session.add(log)
+            session.flush()
+            LogBlobStore.save(session, log.id, PAYLOAD)
+        session.commit()
+    finally:
+        session.close()
+        engine.dispose()
+
+
+def read_once(session):
+    task_id = random.randint(1, TASKS)
+    session.execute(
+        select(models.TaskLog)
+        .options(load_only(models.TaskLog.id, models.TaskLog.task_id, models.TaskLog.status,
+                           models.TaskLog.commit_count, models.TaskLog.summary, models.TaskLog.created_at))
+        .where(models.TaskLog.task_id == task_id)
+        .order_by(models.TaskLog.created_at.desc(), models.TaskLog.id.desc())
+        .limit(50)
+    ).scalars().all()
+
+
+def write_once(session):
+    log = models.TaskLog(task_id=random.randint(1, TASKS), status="running", summary="bench", stage=None)
+    session.add(log)
+    session.commit()
+    log.stage = "fetch"
+    LogBlobStore.save(session, log.id, PAYLOAD)
+    session.commit()
+    log.stage = "deliver"
+    log.status = "success"
+    log.report_markdown = PAYLOAD[:4000]
+    session.commit()
+
+
+def worker(role: str, profile: str, url: str, threads: int, start: float, deadline: float, results):
+    engine = make_engine(profile, url)
+    factory = sessionmaker(bind=engine, expire_on_commit=False)
+    op = read_once if role == "read" else write_once
+    lock = threading.Lock()
+    latencies, errors = [], [0]
+
+    def loop():
+        time.sleep(max(0.0, start - time.time()))
+        while time.time() < deadline:
+            session = factory()
+            started = time.perf_counter()
+            try:
+                op(session)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+            except OperationalError:
+                session.rollback()
+                with lock:
+                    errors[0] += 1
+            finally:
+                session.close()
+
+    pool = [threading.Thread(target=loop) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    engine.dispose()
+    results.put((role, latencies, errors[0]))
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    return statistics.quantiles(values, n=100)[q - 1] * 1000 if len(values) > 1 else values[0] * 1000
+
+
+def run(profile: str, args) -> dict:
+    directory = tempfile.mkdtemp(prefix="bench-sqlite-")
+    url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    seed(profile, url, args.seed_rows)
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    start = time.time() + 3  # every process is up and connected before the clock starts
+    deadline = start + args.seconds
+    procs = [ctx.Process(target=worker, args=("read", profile, url, args.reader_threads, start, deadline, results))
+             for _ in range(args.readers)]
+    procs += [ctx.Process(target=worker, args=("write", profile, url, 1, start, deadline, results))
+              for _ in range(args.writers)]
+    for p in procs:
+        p.start()
+    collected = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    shutil.rmtree(directory, ignore_errors=True)
+
+    summary = {}
+    for role in ("read", "write"):
+        latencies = [v for r, lat, _ in collected if r == role for v in lat]
+        summary[role] = {
+            "ops": len(latencies),
+            "errors": sum(e for r, _, e in collected if r == role),
+            "p50": percentile(latencies, 50),
+            "p99": percentile(latencies, 99),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--readers", type=int, default=4, help="reader processes (API workers)")
+    parser.add_argument("--reader-threads", type=int, default=8, help="concurrent requests per reader process")
+    parser.add_argument("--writers", type=int, default=2, help="writer processes (scheduler runs)")
+    parser.add_argument("--seed-rows", type=int, default=5000)
+    parser.add_argument("--profile", choices=("default", "tuned", "both"), default="both")
+    args = parser.parse_args()
+
+    profiles = ("default", "tuned") if args.profile == "both" else (args.profile,)
+    print(f"{args.readers}x{args.reader_threads} readers, {args.writers} writers, {args.seconds:g}s, "
+          f"{args.seed_rows} seeded logs")
+    print(f"{'profile':<8} {'role':<6} {'ops/s':>9} {'errors':>7} {'p50 ms':>8} {'p99 ms':>9}")
+    for profile in profiles:
+        summary = run(profile, args)
+        for role, row in summary.items():
+            print(f"{profile:<8} {role:<6} {row['ops'] / args.seconds:>9.1f} {row['errors']:>7} "
+                  f"{row['p50']:>8.2f} {row['p99']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import React, { useEffect, useState } from 'react';
 import { Form, Input, Select, Switch, Button, message, Space, TimePicker, Checkbox, InputNumber } from 'antd';
-import api from '../services/api';
+import api, { streamPost } from '../services/api';
+import { describeProgress } from '../services/progress';
 import dayjs from 'dayjs';
 
 const { Option } = Select;
@@ -79,11 +80,14 @@ const TaskForm = ({ initialValues, onSuccess, onCancel }) => {
         cron_expression: cron
       };
       
-      const res = await api.post('/tasks/test-run', payload);
-      message.success(`测试发送成功！统计到 ${res.data.commit_count} 条提交。`);
+      const result = await streamPost('/tasks/test-run/stream', payload, (event, data) => {
+        const progress = describeProgress(event, data);
+        if (progress) message.loading({ content: progress, key: 'test-run', duration: 0 });
+      });
+      message.success({ content: `测试发送成功！统计到 ${result.commit_count} 条提交。`, key: 'test-run' });
     } catch (error) {
       if (error.errorFields) return;
-      message.error(error.response?.data?.detail || '测试发送失败');
+      message.error({ content: error.message || '测试发送失败', key: 'test-run' });
     } finally {
       setTesting(false);
     }
@@ -1,7 +1,8 @@
 import React, { useEffect, useState } from 'react';
 import { Table, Button, Space, Popconfirm, message, Tag, Switch } from 'antd';
 import { EditOutlined, DeleteOutlined, HistoryOutlined, PlayCircleOutlined } from '@ant-design/icons';
-import api from '../services/api';
+import api, { streamPost } from '../services/api';
+import { describeProgress } from '../services/progress';
 
 const TaskList = ({ onEdit, onViewLogs }) => {
   const [tasks, setTasks] = useState([]);
@@ -24,11 +25,19 @@ const TaskList = ({ onEdit, onViewLogs }) => {
   };
 
   const handleRunNow = async (id) => {
+    const key = `run-${id}`;
     try {
-      await api.post(`/tasks/${id}/run`);
-      message.success('已触发即时执行，日报稍后送达');
-    } catch (_error) {
-      message.error('触发失败');
+      const result = await streamPost(`/tasks/${id}/run/stream`, null, (event, data) => {
+        const progress = describeProgress(event, data);
+        if (progress) message.loading({ content: progress, key, duration: 0 });
+      });
+      if (result.status === 'success') {
+        message.success({ content: result.summary, key });
+      } else {
+        message.error({ content: result.summary || '执行失败', key });
+      }
+    } catch (error) {
+      message.error({ content: error.message || '触发失败', key });
     }
   };
 
@@ -17,6 +17,8 @@ const Dashboard = () => {
   const [logLoading, setLogLoading] = useState(false);
   const [refreshKey, setRefreshKey] = useState(0);
   const [dateRange, setDateRange] = useState([dayjs().subtract(7, 'day'), dayjs()]);
+  // Raw payloads are not part of the log list; fetched when a row is expanded
+  const [rawData, setRawData] = useState({});
 
   const handleAdd = () => {
     setEditingTask(null);
@@ -43,6 +45,7 @@ const Dashboard = () => {
       }
       const res = await api.get('/logs/', { params });
       setLogs(res.data);
+      setRawData({});
     } catch (_error) {
       console.error('Failed to fetch logs');
     } finally {
@@ -50,6 +53,17 @@ const Dashboard = () => {
     }
   };
 
+  const fetchRawData = async (log) => {
+    if (rawData[log.id] !== undefined) return;
+    setRawData(prev => ({ ...prev, [log.id]: null }));
+    try {
+      const res = await api.get(`/logs/${log.id}/raw`, { responseType: 'text' });
+      setRawData(prev => ({ ...prev, [log.id]: JSON.stringify(JSON.parse(res.data), null, 2) }));
+    } catch (_error) {
+      setRawData(prev => ({ ...prev, [log.id]: '无原始数据' }));
+    }
+  };
+
   const handleViewLogs = async (task) => {
     setSelectedTask(task);
     setIsLogDrawerOpen(true);
@@ -145,14 +159,17 @@ const Dashboard = () => {
                   label: '原始数据 (JSON)',
                   children: (
                     <div style={{ background: '#f5f5f5', padding: '12px', borderRadius: '4px', whiteSpace: 'pre-wrap', fontFamily: 'monospace', maxHeight: '400px', overflow: 'auto' }}>
-                      {record.raw_data ? JSON.stringify(JSON.parse(record.raw_data), null, 2) : '无原始数据'}
+                      {rawData[record.id] ?? '加载中...'}
                     </div>
                   ),
                 },
               ];
               return <Tabs size="small" items={tabItems} />;
             },
-            rowExpandable: (record) => !!record.log_details || !!record.raw_data,
+            onExpand: (expanded, record) => {
+              if (expanded) fetchRawData(record);
+            },
+            rowExpandable: (record) => !!record.log_details || !!record.stage,
           }}
         />
       </Drawer>
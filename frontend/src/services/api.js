@@ -23,4 +23,46 @@ api.interceptors.response.use(
   }
 );
 
+// POST and read a Server-Sent Events response, calling onEvent(event, data)
+// for each event. Resolves with the data of the final "done" event.
+export const streamPost = async (path, body, onEvent) => {
+  const token = localStorage.getItem('token');
+  const response = await fetch(`${api.defaults.baseURL}${path}`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      ...(token ? { Authorization: `Bearer ${token}` } : {}),
+    },
+    body: body ? JSON.stringify(body) : undefined,
+  });
+  if (!response.ok) {
+    const detail = await response.json().catch(() => ({}));
+    throw new Error(detail.detail || `HTTP ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let end;
+    while ((end = buffer.indexOf('\n\n')) >= 0) {
+      const block = buffer.slice(0, end);
+      buffer = buffer.slice(end + 2);
+      const event = block.match(/^event: (.*)$/m)?.[1];
+      const data = block.match(/^data: (.*)$/m)?.[1];
+      if (!event) continue;
+      const payload = data ? JSON.parse(data) : {};
+      onEvent?.(event, payload);
+      if (event === 'done') return payload;
+      if (['error', 'cancelled', 'skipped'].includes(event)) {
+        throw new Error(payload.message || event);
+      }
+    }
+  }
+  throw new Error('连接已断开');
+};
+
 export default api;
@@ -0,0 +1,16 @@
+// Short status line for a run progress event (null: nothing to show)
+export const describeProgress = (event, data) => {
+  switch (event) {
+    case 'queued': return '排队中...';
+    case 'repos': return `正在拉取 ${data.total} 个仓库...`;
+    case 'repo': return `已拉取 ${data.done}/${data.total} 个仓库`;
+    case 'fetched': return `拉取完成：${data.commit_count} 个提交`;
+    case 'rendered': return '日报已生成';
+    case 'token': return null;
+    case 'stage':
+      if (data.stage === 'summarize') return 'AI 总结中...';
+      if (data.stage === 'deliver') return '正在推送...';
+      return '准备中...';
+    default: return null;
+  }
+};